@@ -1,4 +1,4 @@
-from typing import Optional # 记得导入 Optional
+from typing import List, Optional # 记得导入 Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -24,9 +24,165 @@ class Settings(BaseSettings):
     MILVUS_HOST: str = "localhost"
     MILVUS_PORT: int = 19530
 
+    # --- 向量存储后端 (milvus = 独立服务；numpy = 进程内精确检索，本地开发 / CI / 单机单 worker 使用) ---
+    VECTOR_STORE_BACKEND: str = "milvus"
+    NUMPY_STORE_DIR: str = "data/vector_store"   # numpy 后端的向量文件 (内存映射) 与 chunk 元数据目录
+
+    # --- 向量压缩 (numpy 后端：检索扫描 float16 / int8 矩阵；Milvus：MILVUS_INDEX_TYPE 选 IVF_SQ8 / IVF_PQ) ---
+    VECTOR_QUANTIZATION: str = "none"   # none / float16 / int8，仅 numpy 后端；float32 原始向量始终保留在磁盘上
+                                        # 只省内存不省时间：int8 约 1/4、float16 约 1/2，但检索时要先还原成 float32，
+                                        # 实测 int8 单次检索反而比 float32 慢约一倍（0.74ms vs 0.34ms），float16 更慢
+    VECTOR_RESCORE_FACTOR: int = 4      # 压缩检索先取 k × factor 个候选，再用 float32 原始向量精排；<= 1 不精排
+
+    # --- Milvus 知识库集合 (显式 schema：echo_id 为 partition key，标量字段建索引) ---
+    MILVUS_COLLECTION: str = "frequency_knowledge"
+    MILVUS_MANAGED_SCHEMA: bool = True     # 关闭则沿用 langchain 按首条数据隐式建表
+    MILVUS_NUM_PARTITIONS: int = 64        # partition key 哈希到的分区数
+    MILVUS_INDEX_TYPE: str = "HNSW"        # HNSW / IVF_FLAT / IVF_SQ8 / IVF_PQ / FLAT
+    MILVUS_METRIC_TYPE: str = "L2"         # 与旧集合保持一致；向量已归一化时可改 IP / COSINE（numpy 后端同样使用）
+    MILVUS_HNSW_M: int = 16
+    MILVUS_HNSW_EF_CONSTRUCTION: int = 200
+    MILVUS_HNSW_EF: int = 64               # 检索时的候选队列长度，需 >= 检索条数
+    MILVUS_IVF_NLIST: int = 1024
+    MILVUS_IVF_NPROBE: int = 16
+    MILVUS_PQ_M: int = 64                  # IVF_PQ 子空间数，需整除 EMBEDDING_DIM（1536 / 64 = 24 维一段）
+    MILVUS_PQ_NBITS: int = 8
+    MILVUS_SCALAR_INDEX_TYPE: str = "INVERTED"  # 留空则不建标量索引
+    MILVUS_ASYNC_CLIENT: bool = True       # 对话检索走 pymilvus AsyncMilvusClient，不占线程
+    EMBEDDING_DIM: int = 1536              # text-embedding-v1 输出维度，建表时使用
+
     # AI 模型配置
     OPENAI_API_KEY: str = "sk-..."
     OPENAI_API_BASE: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    LLM_MODEL: str = "qwen-plus"
+
+    # --- LLM 连接池 (所有 ChatOpenAI 实例共享) ---
+    LLM_MAX_CONNECTIONS: int = 100
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_KEEPALIVE_EXPIRY: float = 60.0
+    LLM_TIMEOUT: float = 60.0
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_WARMUP: bool = True                              # 启动时预建连接
+    LLM_WARMUP_TEMPERATURES: List[float] = [0.7, 0.85]   # 预创建的实例：对话 / 同频测试
+
+    # --- 调用准入 (按账号配额配置，<= 0 表示不限制；优先级：对话 > 同频测试 > 训练) ---
+    LLM_RATE_LIMIT_RPS: float = 10.0
+    LLM_RATE_LIMIT_TPM: int = 500000
+    LLM_RESERVED_OUTPUT_TOKENS: int = 300   # 预估 token 时为输出预留的量
+    EMBEDDING_RATE_LIMIT_RPS: float = 20.0
+    EMBEDDING_RATE_LIMIT_TPM: int = 1000000
+    ADMISSION_DEADLINE_CHAT: float = 10.0     # 各优先级最长排队秒数，超时直接失败
+    ADMISSION_DEADLINE_VIBE: float = 60.0
+    ADMISSION_DEADLINE_INGEST: float = 600.0
+
+    # --- 向量化 (DashScope Embedding) ---
+    EMBEDDING_MODEL: str = "text-embedding-v1"
+    EMBEDDING_BATCH_SIZE: int = 25        # text-embedding-v1 单次调用最多 25 条
+    EMBEDDING_MAX_CONCURRENCY: int = 4    # 同一文档的 batch 并发数
+    EMBEDDING_MAX_RETRIES: int = 3        # 限流 / 5xx 等瞬时错误的重试次数
+    EMBEDDING_RETRY_BACKOFF: float = 0.5  # 首次重试等待秒数，之后指数退避
+    EMBEDDING_NATIVE_ASYNC: bool = True   # 异步路径直接用 httpx 调 DashScope HTTP 接口，不经 SDK + 线程
+    EMBEDDING_HTTP_TIMEOUT: float = 30.0
+    EMBEDDING_HTTP_MAX_CONNECTIONS: int = 32
+
+    # --- 查询向量微批 (对话检索时并发到达的 query 合并成一次 DashScope 调用) ---
+    EMBEDDING_QUERY_BATCHING: bool = True
+    EMBEDDING_QUERY_BATCH_WINDOW_MS: float = 5.0   # 第一条 query 到达后最多等待的毫秒数
+    EMBEDDING_QUERY_BATCH_MAX: int = 25            # 攒满即发，不超过 EMBEDDING_BATCH_SIZE
+
+    # --- 向量缓存 (key = model + sha256(text)) ---
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MEMORY_SIZE: int = 20000  # 内存 LRU 条数
+    EMBEDDING_CACHE_PATH: Optional[str] = "data/embedding_cache.sqlite3"  # 留空则只用内存层
+
+    # --- OSS 下载 ---
+    OSS_RANGE_THRESHOLD: int = 8 * 1024 * 1024   # 超过该大小的对象改为分片并发下载
+    OSS_RANGE_PART_SIZE: int = 4 * 1024 * 1024   # 每个 Range GET 的字节数
+    OSS_RANGE_CONCURRENCY: int = 4               # 单个对象的并发分片数
+
+    # --- 流式训练 (下载 -> 逐页解析 -> 切分 -> 分批向量化 -> 增量写入) ---
+    INGEST_MAX_FILE_SIZE: int = 200 * 1024 * 1024  # 流式模式下的文件大小上限
+    INGEST_BATCH_SIZE: int = 100      # 每批向量化/写入的 chunk 数
+    INGEST_QUEUE_DEPTH: int = 2       # 解析与向量化之间缓冲的批次数，决定内存上限
+    INGEST_TEMP_DIR: Optional[str] = None  # 下载临时文件目录，默认系统临时目录
+
+    # --- 异步训练任务队列 ---
+    TRAIN_JOB_WORKERS: int = 2          # 同时执行的训练任务数
+    TRAIN_JOB_QUEUE_SIZE: int = 100     # 排队上限，超过返回 429
+    TRAIN_JOB_RETENTION: int = 1000     # 内存中保留的任务记录数
+
+    # --- 训练去重索引 (整篇文档 + 同一 echo 下跨文档的 chunk) ---
+    DEDUPE_INDEX_PATH: Optional[str] = "data/dedupe.sqlite3"  # 留空则只在进程内存中去重
+    CHUNK_DEDUPE_ENABLED: bool = True
+
+    # --- 训练产物缓存 (解析文本 + chunk 列表，按 ETag 条件请求复用) ---
+    ARTIFACT_CACHE_ENABLED: bool = True
+    ARTIFACT_CACHE_DIR: str = "data/artifacts"
+    ARTIFACT_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # 磁盘占用上限，超出按 LRU 淘汰
+
+    # --- 子系统执行器 (各自独立的并发容量，不再共用 anyio 默认的 40 个线程；/ai/metrics 中可看排队耗时) ---
+    EXECUTOR_EMBEDDING_CAPACITY: int = 16       # 同时进行的向量化调用（同步 SDK 时即线程数）
+    EXECUTOR_RETRIEVAL_CAPACITY: int = 16       # 对话检索：向量检索 / 补取向量 / BM25
+    EXECUTOR_INDEXING_CAPACITY: int = 8         # 训练写入：向量写入 / 删除 / 扫描回填
+    EXECUTOR_OBJECT_STORAGE_CAPACITY: int = 16  # OSS 下载（含分片并发）
+    EXECUTOR_PARSING_CAPACITY: int = 8          # 文件解析 / 切分
+    EXECUTOR_LOCAL_STORE_CAPACITY: int = 8      # 本地 SQLite：去重 / 知识清单 / 关键词登记 / 会话摘要
+
+    # --- PDF 解析 (PyMuPDF + 进程池) ---
+    PDF_PARSE_WORKERS: int = 4      # 解析进程数，<= 0 表示在当前进程内解析
+    PDF_PAGES_PER_TASK: int = 16    # 每个解析任务处理的页数
+
+    # --- 检索结果缓存 (key = echo_id + 归一化问题 + k，写入/删除时按 echo 失效) ---
+    RETRIEVAL_CACHE_ENABLED: bool = True
+    RETRIEVAL_CACHE_SIZE: int = 2048
+    RETRIEVAL_CACHE_TTL_SECONDS: int = 300
+
+    # --- 混合检索 (BM25 关键词倒排索引 + 向量检索，按 RRF 融合) ---
+    HYBRID_SEARCH_ENABLED: bool = True
+    KEYWORD_INDEX_PATH: Optional[str] = "data/keyword_index.sqlite3"  # 留空则只在进程内存中保存
+    KEYWORD_INDEX_MAX_ECHOES: int = 256   # 内存中保留倒排索引的 echo 数 (LRU)
+    HYBRID_CANDIDATES: int = 20           # 每一路检索的候选数
+    RRF_K: int = 60                       # RRF 平滑常数
+    RAG_TOP_K: int = 6                    # 对话时送入 prompt 的知识条数
+
+    # --- 检索门控 (闲聊 / 问时间 / echo 无知识时跳过向量化与 Milvus) ---
+    RETRIEVAL_GATE_ENABLED: bool = True
+    KNOWLEDGE_REGISTRY_PATH: Optional[str] = "data/knowledge_registry.sqlite3"  # 每个 echo 的已训练文档清单
+
+    # --- MMR 多样性重排 (多取候选后按 相关性 - 冗余度 选出前 RAG_TOP_K 条) ---
+    MMR_ENABLED: bool = True
+    MMR_FETCH_K: int = 20     # 参与重排的候选数
+    MMR_LAMBDA: float = 0.5   # 1 = 只看相关性，0 = 只看多样性
+
+    # --- 批量同频匹配 (一个用户 vs N 个候选人) ---
+    VIBE_BATCH_MAX_CANDIDATES: int = 50
+    VIBE_BATCH_CONCURRENCY: int = 4         # 同时进行的配对数
+    VIBE_BATCH_PAIR_TIMEOUT: float = 120.0  # 单个配对（对话 + 裁判）的超时秒数
+
+    # --- RAG 对话 prompt 的 token 预算 ---
+    PROMPT_TOKENIZER_ENCODING: str = "cl100k_base"  # 与 qwen 分词不同，仅作预算估算
+    PROMPT_BUDGET_SYSTEM: int = 800       # 人设 + 规则
+    PROMPT_BUDGET_KNOWLEDGE: int = 1500   # 检索到的知识
+    PROMPT_BUDGET_HISTORY: int = 1200     # 历史消息
+    PROMPT_BUDGET_QUERY: int = 400        # 用户本轮提问
+    PROMPT_BUDGET_SUMMARY: int = 400      # 更早对话的滚动摘要
+    PROMPT_MIN_PASSAGE_TOKENS: int = 50   # 知识预算剩余不足该值时不再截断塞入半段
+    PROMPT_BUDGET_PROFILE_FIELD: int = 64  # 昵称 / 语言风格 / 擅长领域各自的上限（嵌在规则里，不参与人设截断）
+
+    # --- 长对话滚动摘要 (按 user_id + echo_id，响应结束后在后台增量更新) ---
+    SESSION_MEMORY_ENABLED: bool = True
+    SESSION_MEMORY_PATH: Optional[str] = "data/session_memory.sqlite3"  # 留空则只在进程内存中保存
+    SESSION_RECENT_MESSAGES: int = 8     # 原样保留的最近消息数，更早的并入摘要
+    SESSION_SUMMARY_MIN_NEW: int = 4     # 累计这么多条未摘要的消息才触发一次更新
+    SESSION_MEMORY_TTL_DAYS: int = 30
+
+    # --- 画像向量索引 (候选人粗排，只让 shortlist 进入 LLM 模拟) ---
+    PROFILE_INDEX_PATH: Optional[str] = "data/profiles.sqlite3"  # 留空则只在进程内存中保存
+    PROFILE_SHORTLIST_K: int = 10
+    PROFILE_WEIGHT_VECTOR: float = 0.6     # 画像向量余弦相似度
+    PROFILE_WEIGHT_INTEREST: float = 0.25  # 兴趣 Jaccard 重合度
+    PROFILE_WEIGHT_MBTI: float = 0.1       # MBTI 相同维度占比
+    PROFILE_WEIGHT_STYLE: float = 0.05     # 说话风格一致
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, TypeVar
+
+import anyio
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+class BoundedExecutor:
+    """
+    子系统专用的并发容量（anyio CapacityLimiter），各子系统的阻塞调用不再争用 anyio 默认的 40 个线程：
+    训练时大批量的向量写入排满自己的容量，也不会让对话检索排不上队
+    - run: 在线程中执行同步调用
+    - slot: 原生异步调用（httpx / Milvus 异步客户端）占用同一份容量，只用于限流与统计
+    记录排队耗时（提交 -> 开始执行）与执行耗时
+    """
+
+    def __init__(self, name: str, capacity: int, samples: int = 1000):
+        if capacity <= 0:
+            raise ValueError(f"{name} executor capacity must be positive")
+        self.name = name
+        self.capacity = capacity
+        self.limiter = anyio.CapacityLimiter(capacity)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_wait = 0.0
+        self._waits: Deque[float] = deque(maxlen=samples)
+        self._durations: Deque[float] = deque(maxlen=samples)
+
+    def _record_start(self, submitted_at: float) -> float:
+        started = time.perf_counter()
+        waited = started - submitted_at
+        with self._lock:
+            self._waits.append(waited)
+            self.max_wait = max(self.max_wait, waited)
+        return started
+
+    def _record_end(self, started: float, ok: bool) -> None:
+        with self._lock:
+            self._durations.append(time.perf_counter() - started)
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        submitted_at = time.perf_counter()
+        self.submitted += 1
+
+        def call() -> T:
+            # 在工作线程里开始执行时才算出队
+            started = self._record_start(submitted_at)
+            ok = False
+            try:
+                result = func(*args)
+                ok = True
+                return result
+            finally:
+                self._record_end(started, ok)
+
+        return await anyio.to_thread.run_sync(call, limiter=self.limiter)
+
+    @asynccontextmanager
+    async def slot(self):
+        submitted_at = time.perf_counter()
+        self.submitted += 1
+        async with self.limiter:
+            started = self._record_start(submitted_at)
+            ok = False
+            try:
+                yield
+                ok = True
+            finally:
+                self._record_end(started, ok)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            durations = sorted(self._durations)
+
+        def percentile(values, p: float) -> float:
+            if not values:
+                return 0.0
+            return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 3)
+
+        return {
+            "capacity": self.capacity,
+            "running": int(self.limiter.borrowed_tokens),
+            "queued": self.limiter.statistics().tasks_waiting,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "p50_queue_ms": percentile(waits, 0.5),
+            "p95_queue_ms": percentile(waits, 0.95),
+            "max_queue_ms": round(self.max_wait * 1000, 3),
+            "p50_run_ms": percentile(durations, 0.5),
+            "p95_run_ms": percentile(durations, 0.95),
+        }
+
+
+# ==============================================================================
+# 各子系统的执行器
+# ==============================================================================
+# 向量化（DashScope 同步 SDK；开启原生异步后只占容量不占线程）
+embedding_pool = BoundedExecutor("embedding", settings.EXECUTOR_EMBEDDING_CAPACITY)
+# 对话检索：向量检索、补取向量、BM25
+retrieval_pool = BoundedExecutor("retrieval", settings.EXECUTOR_RETRIEVAL_CAPACITY)
+# 训练写入：向量写入 / 删除 / 扫描回填
+indexing_pool = BoundedExecutor("indexing", settings.EXECUTOR_INDEXING_CAPACITY)
+# OSS 下载
+object_storage_pool = BoundedExecutor("object_storage", settings.EXECUTOR_OBJECT_STORAGE_CAPACITY)
+# 文件解析 / 切分（PDF 解析本身另有进程池）
+parsing_pool = BoundedExecutor("parsing", settings.EXECUTOR_PARSING_CAPACITY)
+# 本地 SQLite 索引：去重、知识清单、关键词索引登记、会话摘要
+local_store_pool = BoundedExecutor("local_store", settings.EXECUTOR_LOCAL_STORE_CAPACITY)
+
+_executors = (embedding_pool, retrieval_pool, indexing_pool, object_storage_pool, parsing_pool, local_store_pool)
+
+
+def executor_stats() -> dict:
+    return {executor.name: executor.stats() for executor in _executors}
@@ -1,19 +1,173 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+import httpx
+from langchain_core.messages import BaseMessage
 from langchain_openai import ChatOpenAI
 from app.core.config import settings
+from app.core.logger import logger
+from app.core.rate_limit import llm_limiter
+
+# ==============================================================================
+# 准入控制：每次调用模型前按优先级排队领取 RPS / TPM 配额
+# ==============================================================================
+# streaming 模式下 _agenerate 内部会再走 _astream，用此标记避免重复领取
+_admitted: ContextVar[bool] = ContextVar("llm_admitted", default=False)
+
+
+def _estimate_tokens(messages: Sequence[BaseMessage]) -> int:
+    # 粗略估计：中文约 1 字 1 token，再为输出预留固定额度
+    prompt_chars = sum(len(str(message.content)) for message in messages)
+    return prompt_chars + settings.LLM_RESERVED_OUTPUT_TOKENS
+
+
+@contextmanager
+def _mark_admitted():
+    token = _admitted.set(True)
+    try:
+        yield
+    finally:
+        _admitted.reset(token)
+
+
+class AdmittedChatOpenAI(ChatOpenAI):
+    """
+    调用前经过全局准入控制的 ChatOpenAI
+    """
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if not _admitted.get():
+            await llm_limiter.acquire(_estimate_tokens(messages))
+        with _mark_admitted():
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        if not _admitted.get():
+            await llm_limiter.acquire(_estimate_tokens(messages))
+        with _mark_admitted():
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if not _admitted.get():
+            llm_limiter.acquire_sync(_estimate_tokens(messages))
+        with _mark_admitted():
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        if not _admitted.get():
+            llm_limiter.acquire_sync(_estimate_tokens(messages))
+        with _mark_admitted():
+            yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+# ==============================================================================
+# 共享 HTTP 连接池：所有 ChatOpenAI 实例复用同一组 keep-alive 连接，避免重复 TLS 握手
+# ==============================================================================
+_http_async_client: Optional[httpx.AsyncClient] = None
+_http_client: Optional[httpx.Client] = None
+_llm_registry: Dict[Tuple[str, float, bool], AdmittedChatOpenAI] = {}
+_registry_lock = threading.Lock()
+
 
-def get_llm(temperature: float = 0.7):
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def _http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.LLM_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
+
+
+def _get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    调用方持有 _registry_lock
+    """
+    global _http_client, _http_async_client
+    if _http_async_client is None or _http_async_client.is_closed:
+        _http_async_client = httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout())
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.Client(limits=_http_limits(), timeout=_http_timeout())
+    return _http_client, _http_async_client
+
+
+def get_llm(temperature: float = 0.7, streaming: bool = True, model: Optional[str] = None):
     """
     获取 LangChain 的 LLM 实例
     支持任何兼容 OpenAI 协议的模型 (DeepSeek, Moonshot, Qwen 等)
+    按 (model, temperature, streaming) 缓存，进程内共享同一个连接池
     """
     # 如果没有配置 Key，这里会报错，提醒开发者配置 .env
     if not settings.OPENAI_API_KEY:
         raise ValueError("请在 .env 文件中配置 OPENAI_API_KEY")
 
-    return ChatOpenAI(
-        openai_api_key=settings.OPENAI_API_KEY,
-        openai_api_base=settings.OPENAI_API_BASE,
-        model_name="qwen-plus", # 很多国产模型兼容接口时忽略此参数，或填具体模型名如 "deepseek-chat"
-        temperature=temperature,    # 0.7 比较适合闲聊，更有创造力
-        streaming=True              # 准备支持流式输出
-    )
\ No newline at end of file
+    model = model or settings.LLM_MODEL
+    key = (model, float(temperature), streaming)
+    llm = _llm_registry.get(key)
+    if llm is not None:
+        return llm
+
+    with _registry_lock:
+        llm = _llm_registry.get(key)
+        if llm is None:
+            http_client, http_async_client = _get_http_clients()
+            llm = AdmittedChatOpenAI(
+                openai_api_key=settings.OPENAI_API_KEY,
+                openai_api_base=settings.OPENAI_API_BASE,
+                model_name=model,  # 很多国产模型兼容接口时忽略此参数，或填具体模型名如 "deepseek-chat"
+                temperature=temperature,    # 0.7 比较适合闲聊，更有创造力
+                streaming=streaming,
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+            _llm_registry[key] = llm
+            logger.info("LLM client created: model={}, temperature={}, streaming={}", model, temperature, streaming)
+        return llm
+
+
+async def warmup_llm_clients() -> None:
+    """
+    启动预热：创建常用的 LLM 实例，并提前建立到模型服务的 keep-alive 连接
+    预热失败不影响启动（首个请求会再建连）
+    """
+    if not settings.LLM_WARMUP:
+        return
+    try:
+        for temperature in settings.LLM_WARMUP_TEMPERATURES:
+            get_llm(temperature=temperature)
+        # 任意轻量请求即可完成 DNS + TCP + TLS，状态码不重要
+        response = await _http_async_client.get(
+            f"{settings.OPENAI_API_BASE.rstrip('/')}/models",
+            headers={"Authorization": f"Bearer {settings.OPENAI_API_KEY}"},
+            timeout=settings.LLM_CONNECT_TIMEOUT,
+        )
+        logger.info("LLM connection warmed up: status={}", response.status_code)
+    except Exception as e:
+        logger.warning("LLM warmup failed: {!r}", e)
+
+
+async def close_llm_clients() -> None:
+    global _http_client, _http_async_client
+    with _registry_lock:
+        _llm_registry.clear()
+        http_client, http_async_client = _http_client, _http_async_client
+        _http_client = _http_async_client = None
+    if http_async_client is not None:
+        await http_async_client.aclose()
+    if http_client is not None:
+        http_client.close()
+
+
+def llm_stats() -> dict:
+    return {
+        "clients": len(_llm_registry),
+        "keys": [
+            {"model": model, "temperature": temperature, "streaming": streaming}
+            for model, temperature, streaming in list(_llm_registry)
+        ],
+    }
@@ -0,0 +1,336 @@
+import asyncio
+import functools
+import heapq
+import inspect
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Deque, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.logger import logger
+
+
+class Priority(IntEnum):
+    """
+    调用优先级，数值越小越先放行
+    """
+    CHAT = 0     # 实时对话
+    VIBE = 1     # 同频测试 / 批量匹配
+    INGEST = 2   # 知识训练、画像入库等后台任务
+
+
+_current_priority: ContextVar[Priority] = ContextVar("admission_priority", default=Priority.VIBE)
+
+
+def current_priority() -> Priority:
+    return _current_priority.get()
+
+
+@contextmanager
+def priority_scope(priority: Priority):
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def with_priority(priority: Priority):
+    """
+    装饰器：函数（或异步生成器）内发起的 LLM / 向量化调用按给定优先级排队
+    contextvar 会随 create_task / anyio.to_thread 传递下去
+    """
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def gen_wrapper(*args, **kwargs):
+                with priority_scope(priority):
+                    async for item in func(*args, **kwargs):
+                        yield item
+            return gen_wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with priority_scope(priority):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class AdmissionTimeout(RuntimeError):
+    """
+    在截止时间内未获得调用配额
+    """
+
+
+# ==============================================================================
+# 令牌桶 + 优先级队列
+# ==============================================================================
+class _TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.available = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.available -= amount
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tokens: int = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class _PriorityStats:
+    def __init__(self, samples: int = 1000):
+        self.granted = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent: Deque[float] = deque(maxlen=samples)
+
+    def record(self, waited: float) -> None:
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self._recent.append(waited)
+
+    def snapshot(self, queued: int) -> dict:
+        recent = sorted(self._recent)
+
+        def percentile(p: float) -> float:
+            if not recent:
+                return 0.0
+            return round(recent[min(len(recent) - 1, int(len(recent) * p))], 4)
+
+        return {
+            "queued": queued,
+            "granted": self.granted,
+            "timeouts": self.timeouts,
+            "avg_wait": round(self.total_wait / self.granted, 4) if self.granted else 0.0,
+            "p50_wait": percentile(0.5),
+            "p95_wait": percentile(0.95),
+            "max_wait": round(self.max_wait, 4),
+        }
+
+
+class AdmissionController:
+    """
+    调用准入控制：同时约束每秒请求数 (RPS) 与每分钟 token 数 (TPM)
+    - 配额不足时按 (优先级, 到达顺序) 排队，高优先级请求到达会插到低优先级前面
+    - 每个请求带截止时间，超时抛 AdmissionTimeout，不会无限堆积
+    - 所有状态只在事件循环线程中修改；线程内的同步调用通过 acquire_sync 投递到循环
+    rps / tpm <= 0 表示不限制该维度
+    """
+
+    def __init__(self, name: str, *, rps: float, tpm: int, deadlines: Dict[Priority, float]):
+        self.name = name
+        self.deadlines = deadlines
+        self._buckets: List[_TokenBucket] = []
+        self._request_bucket: Optional[_TokenBucket] = None
+        self._token_bucket: Optional[_TokenBucket] = None
+        if rps > 0:
+            self._request_bucket = _TokenBucket(rps, max(1.0, rps))
+            self._buckets.append(self._request_bucket)
+        if tpm > 0:
+            self._token_bucket = _TokenBucket(tpm / 60.0, float(tpm))
+            self._buckets.append(self._token_bucket)
+
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats = {priority: _PriorityStats() for priority in Priority}
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    # --------------------------------------------------------------------------
+    def _wait_time(self, tokens: int, now: float) -> float:
+        wait = 0.0
+        if self._request_bucket is not None:
+            wait = max(wait, self._request_bucket.wait_time(1, now))
+        if self._token_bucket is not None:
+            wait = max(wait, self._token_bucket.wait_time(tokens, now))
+        return wait
+
+    def _take(self, tokens: int) -> None:
+        if self._request_bucket is not None:
+            self._request_bucket.take(1)
+        if self._token_bucket is not None:
+            self._token_bucket.take(tokens)
+
+    def _queued(self) -> Dict[Priority, int]:
+        queued = {priority: 0 for priority in Priority}
+        for waiter in self._heap:
+            if not waiter.future.done():
+                queued[Priority(waiter.priority)] += 1
+        return queued
+
+    async def acquire(
+        self,
+        tokens: int = 1,
+        priority: Optional[Priority] = None,
+        deadline: Optional[float] = None,
+    ) -> float:
+        """
+        等待配额，返回排队耗时（秒）
+        """
+        if not self._buckets:
+            return 0.0
+        priority = current_priority() if priority is None else priority
+        timeout = self.deadlines[priority] if deadline is None else deadline
+        if self._token_bucket is not None:
+            # 单个请求超过桶容量时按容量计，否则永远无法放行
+            tokens = min(tokens, int(self._token_bucket.capacity))
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+
+        now = time.monotonic()
+        if not self._heap and self._wait_time(tokens, now) <= 0:
+            self._take(tokens)
+            self._stats[priority].record(0.0)
+            return 0.0
+
+        waiter = _Waiter(
+            priority=int(priority),
+            seq=next(self._seq),
+            tokens=tokens,
+            enqueued_at=now,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        heapq.heappush(self._heap, waiter)
+        self._ensure_dispatcher()
+
+        try:
+            return await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            self._stats[priority].timeouts += 1
+            self._wakeup.set()  # 队首可能正是它，让调度器重新选择
+            logger.warning(
+                "Admission timeout: limiter={}, priority={}, tokens={}, waited={:.2f}s",
+                self.name, priority.name, tokens, timeout,
+            )
+            raise AdmissionTimeout(
+                f"{self.name} quota not available within {timeout:.1f}s ({priority.name})"
+            ) from None
+
+    def acquire_sync(self, tokens: int = 1, priority: Optional[Priority] = None) -> float:
+        """
+        供工作线程调用：把 acquire 投递到事件循环并阻塞等待
+        没有可用的事件循环（脚本 / 未启动应用）时直接放行
+        """
+        loop = self._loop
+        if not self._buckets or loop is None or loop.is_closed():
+            return 0.0
+        try:
+            if asyncio.get_running_loop() is loop:
+                # 在循环线程里同步调用会死锁，只能放行
+                return 0.0
+        except RuntimeError:
+            pass
+        priority = current_priority() if priority is None else priority
+        return asyncio.run_coroutine_threadsafe(self.acquire(tokens, priority), loop).result()
+
+    # --------------------------------------------------------------------------
+    def _ensure_dispatcher(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+
+    async def _dispatch(self) -> None:
+        while self._heap:
+            waiter = self._heap[0]
+            if waiter.future.done():
+                # 已超时 / 被取消
+                heapq.heappop(self._heap)
+                continue
+
+            now = time.monotonic()
+            wait = self._wait_time(waiter.tokens, now)
+            if wait <= 0:
+                heapq.heappop(self._heap)
+                self._take(waiter.tokens)
+                waited = now - waiter.enqueued_at
+                self._stats[Priority(waiter.priority)].record(waited)
+                waiter.future.set_result(waited)
+                continue
+
+            # 等配额恢复；期间有新请求入队（可能优先级更高）则提前醒来重新选队首
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        queued = self._queued()
+        return {
+            "queue_depth": sum(queued.values()),
+            "tokens_available": round(self._token_bucket.available) if self._token_bucket else None,
+            "priorities": {
+                priority.name.lower(): self._stats[priority].snapshot(queued[priority])
+                for priority in Priority
+            },
+        }
+
+
+def _deadlines() -> Dict[Priority, float]:
+    return {
+        Priority.CHAT: settings.ADMISSION_DEADLINE_CHAT,
+        Priority.VIBE: settings.ADMISSION_DEADLINE_VIBE,
+        Priority.INGEST: settings.ADMISSION_DEADLINE_INGEST,
+    }
+
+
+llm_limiter = AdmissionController(
+    "llm",
+    rps=settings.LLM_RATE_LIMIT_RPS,
+    tpm=settings.LLM_RATE_LIMIT_TPM,
+    deadlines=_deadlines(),
+)
+embedding_limiter = AdmissionController(
+    "embedding",
+    rps=settings.EMBEDDING_RATE_LIMIT_RPS,
+    tpm=settings.EMBEDDING_RATE_LIMIT_TPM,
+    deadlines=_deadlines(),
+)
+
+
+def bind_admission_loop() -> None:
+    """
+    应用启动时调用，使线程中的同步调用也能进入同一个排队
+    """
+    loop = asyncio.get_running_loop()
+    llm_limiter.bind_loop(loop)
+    embedding_limiter.bind_loop(loop)
+
+
+def admission_stats() -> dict:
+    return {
+        "llm": llm_limiter.stats(),
+        "embedding": embedding_limiter.stats(),
+    }
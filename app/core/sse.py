@@ -0,0 +1,10 @@
+import json
+from typing import Any
+
+
+def sse_event(event: str, data: Any) -> str:
+    """
+    编码一条 Server-Sent Event，data 序列化为单行 JSON
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
@@ -1,25 +1,55 @@
+from contextlib import asynccontextmanager
 from app.core.logger import logger
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
+from app.core.executors import executor_stats, indexing_pool
+from app.core.llm import close_llm_clients, llm_stats, warmup_llm_clients
+from app.core.rate_limit import Priority, admission_stats, bind_admission_loop, priority_scope
 from app.schemas.knowledge import KnowledgeIngestResponse, KnowledgeDeleteRequest, BatchKnowledgeDeleteRequest
 from app.services.knowledge_engine import knowledge_engine
-from app.services.vibe_engine import VibeEngine
-from pydantic import BaseModel
+from app.services.vibe_engine import VibeEngine, vibe_batch_event_stream, vibe_check_event_stream
+from app.schemas.vibe import VibeBatchRequest, VibeCheckRequest
+from app.schemas.profile import ProfileDeleteRequest, ProfileIndexRequest, ShortlistRequest, ShortlistResponse
+from app.services.profile_index import profile_index
 from fastapi import HTTPException
-from app.services.knowledge_trainer import train_from_oss
+from app.services.knowledge_trainer import train_from_oss, artifact_cache
 from app.schemas.KnowledgeTrainRequest import KnowledgeTrainRequest
 from fastapi.responses import StreamingResponse
 from app.schemas.chat import ChatRequest
 from app.services.chat_service import chat_stream_generator
+from app.services.file_parsers import shutdown_parse_pool
+from app.services.retrieval_gate import retrieval_gate
+from app.services.session_memory import session_memory
+from app.schemas.train_job import TrainJobRequest, TrainJobResponse
+from app.services.train_jobs import train_job_manager, TrainJobQueueFull, TrainJobNotCancellable
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时预热，关闭时释放进程池 / 连接等资源
+    """
+    bind_admission_loop()
+    await warmup_llm_clients()
+    await knowledge_engine.prepare()
+    await train_job_manager.start()
+    yield
+    await train_job_manager.stop()
+    await session_memory.aclose()
+    await knowledge_engine.aclose()
+    shutdown_parse_pool()
+    await close_llm_clients()
+
 
 # 1. 初始化 FastAPI 应用
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version="1.0.0",
     description="Frequency 社交平台 AI 核心引擎",
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan,
 )
 
 # 2. 配置跨域
@@ -32,13 +62,6 @@ app.add_middleware(
 )
 
 
-# --- 请求参数 ---
-class VibeCheckRequest(BaseModel):
-    user_a: dict
-    user_b: dict
-    rounds: int = 3
-    session_id: str = "default-session"  # 新增接收 Java 传来的 SessionID
-
 @app.get("/")
 def read_root():
     logger.info("Root endpoint called")
@@ -49,6 +72,23 @@ def health_check():
     logger.info("Health check called")
     return {"status": "UP", "service": settings.PROJECT_NAME}
 
+@app.get("/ai/metrics")
+def metrics():
+    """
+    运行时指标（缓存命中率等）
+    """
+    return {
+        **knowledge_engine.stats(),
+        "train_jobs": train_job_manager.stats(),
+        "artifact_cache": artifact_cache.stats() if artifact_cache else None,
+        "profile_index": profile_index.stats(),
+        "session_memory": session_memory.stats(),
+        "retrieval_gate": retrieval_gate.stats(),
+        "llm": llm_stats(),
+        "admission": admission_stats(),
+        "executors": executor_stats(),
+    }
+
 @app.post("/ai/chat/stream")
 async def chat_stream_endpoint(request: ChatRequest):
     """
@@ -90,6 +130,7 @@ async def start_vibe_check(request: VibeCheckRequest):
             "status": "success",
             "score": analysis_result.get("score", 0),
             "summary": analysis_result.get("summary", "AI 正在思考人生..."),
+            "fallback": bool(analysis_result.get("fallback")),
             "dialogue": dialogue
         }
 
@@ -100,6 +141,73 @@ async def start_vibe_check(request: VibeCheckRequest):
         logger.exception("Error executing Vibe Check: {}", e)
         raise HTTPException(status_code=500, detail="AI 服务内部错误")
 
+@app.post(f"{settings.API_V1_STR}/ai/vibe-check/stream")
+async def stream_vibe_check(request: VibeCheckRequest):
+    """
+    同频测试流式版 (SSE)：破冰语与每轮对话逐 token 推送，最后一条 result 事件携带评分与评价
+    """
+    logger.info(
+        "🚀 开始流式同频测试: session_id={}, rounds={}",
+        request.session_id,
+        request.rounds,
+    )
+    return StreamingResponse(
+        vibe_check_event_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post(f"{settings.API_V1_STR}/ai/vibe-check/batch")
+async def batch_vibe_check(request: VibeBatchRequest):
+    """
+    批量同频匹配 (SSE)：一个用户 vs 多个候选人并发测试，
+    每完成一对推送 pair_result，最后推送按分数排序的 ranking
+    """
+    return StreamingResponse(
+        vibe_batch_event_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post(f"{settings.API_V1_STR}/ai/vibe-check/shortlist", response_model=ShortlistResponse)
+async def shortlist_candidates(request: ShortlistRequest):
+    """
+    候选人粗排：画像向量相似度 + 兴趣/MBTI/风格规则特征，返回最值得做同频测试的前 K 个
+    """
+    try:
+        candidates = await profile_index.ashortlist(
+            request.user_a,
+            top_k=request.top_k,
+            candidates=request.candidates,
+            exclude_ids=request.exclude_ids,
+        )
+    except Exception as e:
+        logger.exception("Shortlist failed: {}", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    return ShortlistResponse(candidates=candidates)
+
+
+@app.post("/ai/profiles/index")
+async def index_profiles(request: ProfileIndexRequest):
+    """
+    写入/更新用户画像向量（业务系统在画像变更时调用）
+    """
+    try:
+        with priority_scope(Priority.INGEST):
+            count = await profile_index.aupsert(request.profiles)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Profile index failed: {}", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "success", "indexed": count}
+
+
+@app.post("/ai/profiles/delete")
+async def delete_profiles(request: ProfileDeleteRequest):
+    removed = await indexing_pool.run(profile_index.remove, request.ids)
+    return {"status": "success", "removed": removed}
+
 
 @app.post("/ai/knowledge/train")
 async def train_knowledge(request: KnowledgeTrainRequest):
@@ -114,11 +222,48 @@ async def train_knowledge(request: KnowledgeTrainRequest):
             file_url=request.file_url,
             file_type=request.file_type,
             source_name=request.source_name,
+            streaming=request.streaming,
+            upsert=request.upsert,
         )
     except Exception as e:
         logger.exception("Knowledge train failed: {}", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ai/knowledge/train/jobs", status_code=202, response_model=TrainJobResponse)
+async def submit_train_job(request: TrainJobRequest):
+    """
+    异步知识训练：立即返回 job_id，通过状态接口轮询结果
+    """
+    try:
+        job = train_job_manager.submit(request)
+    except TrainJobQueueFull as e:
+        logger.warning("Train job rejected: {}", e)
+        raise HTTPException(status_code=429, detail=str(e))
+    return job.to_response()
+
+@app.get("/ai/knowledge/train/jobs/{job_id}", response_model=TrainJobResponse)
+async def get_train_job(job_id: str):
+    """
+    查询训练任务状态、各阶段耗时与错误信息
+    """
+    job = train_job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_response()
+
+@app.post("/ai/knowledge/train/jobs/{job_id}/cancel", response_model=TrainJobResponse)
+async def cancel_train_job(job_id: str):
+    """
+    取消训练任务（排队中直接取消，执行中会回滚已写入的向量）
+    """
+    try:
+        job = train_job_manager.cancel(job_id)
+    except TrainJobNotCancellable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_response()
+
 @app.post("/ai/knowledge/delete")
 async def delete_knowledge_endpoint(request: KnowledgeDeleteRequest):
     """
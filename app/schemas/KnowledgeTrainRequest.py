@@ -7,3 +7,11 @@ class KnowledgeTrainRequest(BaseModel):
     file_url: str
     file_type: str
     source_name: str
+    # 两种模式都按 chunk 分批向量化 / 写入，不受 MAX_CONTENT_LENGTH 限制：
+    # - 默认：整个文件下载到内存（上限 20MB）后整篇解析、切分
+    # - 流式：下载落盘后逐页解析、切分，内存占用与文件大小无关，适合上百 MB 的大文档
+    # 两种模式的文档指纹都是原始文件的 sha256；但流式按页切分，chunk 边界不同，
+    # 切换模式后对同一 knowledge_id 做 upsert 会重新向量化整篇文档
+    streaming: bool = False
+    # 增量更新：与该 knowledge_id 已有的 chunk 对比，只向量化变化的部分
+    upsert: bool = False
@@ -23,6 +23,10 @@ class KnowledgeIngestRequest(BaseModel):
         description="来源文件名",
     )
     metadata: Optional[Dict[str, Any]] = Field(default_factory=dict)
+    upsert: bool = Field(
+        False,
+        description="增量更新 metadata.knowledge_id 对应的知识：只写入新增 chunk，删除已不存在的 chunk",
+    )
 
     @field_validator("content")
     @classmethod
@@ -47,6 +51,10 @@ class KnowledgeIngestResponse(BaseModel):
     status: str
     chunks_count: int
     message: str
+    # 仅 upsert 模式返回
+    added: Optional[int] = None
+    kept: Optional[int] = None
+    removed: Optional[int] = None
 
 class KnowledgeDeleteRequest(BaseModel):
     knowledge_id: int = Field(..., description="业务系统中的知识ID (必须与训练时传入的一致)")
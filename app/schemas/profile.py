@@ -0,0 +1,38 @@
+from typing import List, Optional, Union
+
+from pydantic import BaseModel, Field
+
+from app.core.config import settings
+
+
+class ProfileIndexRequest(BaseModel):
+    profiles: List[dict] = Field(..., min_length=1, max_length=500, description="画像列表，每个画像必须带 id")
+
+
+class ProfileDeleteRequest(BaseModel):
+    ids: List[Union[int, str]] = Field(..., min_length=1)
+
+
+class ShortlistRequest(BaseModel):
+    user_a: dict
+    top_k: int = Field(settings.PROFILE_SHORTLIST_K, ge=1, le=200)
+    candidates: Optional[List[dict]] = Field(
+        None,
+        max_length=1000,
+        description="只在这些候选人中排序；为空则在整个画像索引中检索",
+    )
+    exclude_ids: List[Union[int, str]] = Field(default_factory=list, description="排除的候选人，如已匹配过的")
+
+
+class ShortlistItem(BaseModel):
+    candidate_id: str
+    position: Optional[int] = Field(None, description="在请求 candidates 中的下标")
+    name: Optional[str] = None
+    score: float
+    features: dict
+    profile: dict
+
+
+class ShortlistResponse(BaseModel):
+    status: str = "success"
+    candidates: List[ShortlistItem]
@@ -0,0 +1,24 @@
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, Field
+
+from app.schemas.KnowledgeTrainRequest import KnowledgeTrainRequest
+
+
+class TrainJobRequest(KnowledgeTrainRequest):
+    priority: int = Field(0, ge=-10, le=10, description="优先级，越大越先执行")
+
+
+class TrainJobResponse(BaseModel):
+    job_id: str
+    status: str
+    priority: int
+    knowledge_id: int
+    echo_id: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    timings: Dict[str, float] = Field(default_factory=dict, description="各阶段耗时（秒）")
+    progress: Dict[str, Any] = Field(default_factory=dict)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
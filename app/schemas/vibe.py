@@ -0,0 +1,29 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from app.core.config import settings
+
+
+class VibeCheckRequest(BaseModel):
+    user_a: dict
+    user_b: dict
+    rounds: int = 3
+    session_id: str = "default-session"  # 新增接收 Java 传来的 SessionID
+
+
+class VibeBatchRequest(BaseModel):
+    user_a: dict
+    candidates: List[dict] = Field(
+        ...,
+        min_length=1,
+        max_length=settings.VIBE_BATCH_MAX_CANDIDATES,
+        description="候选人画像列表，可带 id 字段用于回传",
+    )
+    rounds: int = 3
+    session_id: str = "default-session"
+    shortlist_k: Optional[int] = Field(
+        None,
+        ge=1,
+        description="先用画像向量粗排，只对前 K 个候选人做 LLM 模拟",
+    )
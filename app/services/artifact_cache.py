@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterable, Iterator, Optional
+
+from app.core.logger import logger
+
+PARSER_VERSION = 1  # 解析/切分逻辑变化时递增，使旧产物自然失效
+
+
+@dataclass
+class ArtifactManifest:
+    """
+    OSS 对象 -> 解析产物 的映射
+    object_id 指向对象（bucket/key），artifact 指向内容寻址的产物目录
+    """
+    object_id: str
+    etag: Optional[str]
+    sha256: str
+    artifact: str
+    updated_at: float
+
+
+class ArtifactWriter:
+    """
+    边解析边落盘：section 写入 text.txt，chunk 写入 chunks.jsonl
+    全部写完才 commit（原子 rename），中途失败直接丢弃临时目录
+    """
+
+    def __init__(self, cache: "ArtifactCache", object_id: str, etag: Optional[str], sha256: str, signature: str):
+        self._cache = cache
+        self.object_id = object_id
+        self.etag = etag
+        self.sha256 = sha256
+        self.artifact = f"{sha256}-{signature}"
+        self._tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=cache.objects_dir)
+        self._text = open(os.path.join(self._tmp_dir, "text.txt"), "w", encoding="utf-8")
+        self._chunks = open(os.path.join(self._tmp_dir, "chunks.jsonl"), "w", encoding="utf-8")
+        self._closed = False
+
+    def tee_sections(self, sections: Iterable[str], separator: str) -> Iterator[str]:
+        first = True
+        for section in sections:
+            if not first:
+                self._text.write(separator)
+            self._text.write(section)
+            first = False
+            yield section
+
+    def tee_chunks(self, chunks: Iterable[str]) -> Iterator[str]:
+        for chunk in chunks:
+            self._chunks.write(json.dumps(chunk, ensure_ascii=False))
+            self._chunks.write("\n")
+            yield chunk
+        # chunk 流完整读完才说明产物完整
+        self.commit()
+
+    def _close_files(self) -> None:
+        if not self._closed:
+            self._text.close()
+            self._chunks.close()
+            self._closed = True
+
+    def commit(self) -> None:
+        if self._closed:
+            return
+        self._close_files()
+        self._cache._commit(self, self._tmp_dir)
+
+    def abort(self) -> None:
+        if self._closed and not os.path.exists(self._tmp_dir):
+            return
+        self._close_files()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+class ArtifactCache:
+    """
+    本地训练产物缓存（解析文本 + chunk 列表）
+    - 产物按内容 sha256 + 切分参数寻址，同一文件被多个 URL 引用时共享
+    - manifest 记录对象 ETag，供下次训练时做条件请求
+    - 按磁盘占用做 LRU 淘汰（读取时刷新 mtime）
+    """
+
+    def __init__(self, *, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifests_dir = os.path.join(root, "manifests")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # --------------------------------------------------------------------------
+    def _manifest_path(self, object_id: str) -> str:
+        name = hashlib.sha1(object_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.manifests_dir, f"{name}.json")
+
+    def _artifact_dir(self, artifact: str) -> str:
+        return os.path.join(self.objects_dir, artifact)
+
+    def lookup(self, object_id: str, signature: str) -> Optional[ArtifactManifest]:
+        """
+        返回可用的 manifest（产物已被淘汰或切分参数变化时视为未命中）
+        """
+        try:
+            with open(self._manifest_path(object_id), encoding="utf-8") as f:
+                manifest = ArtifactManifest(**json.load(f))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+        if manifest.artifact != f"{manifest.sha256}-{signature}":
+            return None
+        if not os.path.exists(os.path.join(self._artifact_dir(manifest.artifact), "chunks.jsonl")):
+            return None
+        return manifest
+
+    def adopt(self, object_id: str, etag: Optional[str], sha256: str, signature: str) -> Optional[ArtifactManifest]:
+        """
+        对象 ETag 变了但内容相同（重新上传同一文件 / 换了 URL）时复用已有产物
+        """
+        artifact = f"{sha256}-{signature}"
+        if not os.path.exists(os.path.join(self._artifact_dir(artifact), "chunks.jsonl")):
+            return None
+        manifest = ArtifactManifest(
+            object_id=object_id,
+            etag=etag,
+            sha256=sha256,
+            artifact=artifact,
+            updated_at=time.time(),
+        )
+        self._write_manifest(manifest)
+        return manifest
+
+    def iter_chunks(self, manifest: ArtifactManifest) -> Iterator[str]:
+        path = os.path.join(self._artifact_dir(manifest.artifact), "chunks.jsonl")
+        os.utime(path)  # 刷新 LRU
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def record_hit(self) -> None:
+        self.hits += 1
+
+    def record_miss(self) -> None:
+        self.misses += 1
+
+    # --------------------------------------------------------------------------
+    def writer(self, object_id: str, etag: Optional[str], sha256: str, signature: str) -> ArtifactWriter:
+        return ArtifactWriter(self, object_id, etag, sha256, signature)
+
+    def _commit(self, writer: ArtifactWriter, tmp_dir: str) -> None:
+        final_dir = self._artifact_dir(writer.artifact)
+        try:
+            os.rename(tmp_dir, final_dir)
+        except OSError:
+            # 其它 worker 已写入相同内容的产物
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self._write_manifest(ArtifactManifest(
+            object_id=writer.object_id,
+            etag=writer.etag,
+            sha256=writer.sha256,
+            artifact=writer.artifact,
+            updated_at=time.time(),
+        ))
+
+        logger.info("Artifact cached: object={}, artifact={}", writer.object_id, writer.artifact)
+        self.evict()
+
+    def _write_manifest(self, manifest: ArtifactManifest) -> None:
+        manifest_path = self._manifest_path(manifest.object_id)
+        tmp_manifest = f"{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(asdict(manifest), f, ensure_ascii=False)
+        os.replace(tmp_manifest, manifest_path)
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        total = 0
+        for entry in os.scandir(path):
+            if entry.is_file():
+                total += entry.stat().st_size
+        return total
+
+    def evict(self) -> None:
+        with self._lock:
+            artifacts = []
+            total = 0
+            for entry in os.scandir(self.objects_dir):
+                if not entry.is_dir() or entry.name.startswith(".tmp-"):
+                    continue
+                chunks_path = os.path.join(entry.path, "chunks.jsonl")
+                try:
+                    last_used = os.stat(chunks_path).st_mtime
+                except FileNotFoundError:
+                    last_used = 0.0
+                size = self._dir_size(entry.path)
+                artifacts.append((last_used, size, entry.path))
+                total += size
+
+            artifacts.sort()
+            while total > self.max_bytes and artifacts:
+                _, size, path = artifacts.pop(0)
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                self.evictions += 1
+                logger.info("Artifact evicted: {}", os.path.basename(path))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
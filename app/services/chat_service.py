@@ -1,75 +1,93 @@
-from typing import List
-
 from datetime import datetime
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import AIMessage, HumanMessage
 from app.core.config import settings
+from app.core.llm import get_llm
+from app.core.rate_limit import Priority, with_priority
 from app.core.logger import logger
 from app.services.knowledge_engine import knowledge_engine
+from app.services.prompt_assembler import PERSONA_SLOT, fit_profile_field, history_to_messages, prompt_assembler
+from app.services.retrieval_gate import retrieval_gate
+from app.services.session_memory import session_memory
 from app.schemas.chat import ChatRequest
 
 
+@with_priority(Priority.CHAT)
 async def chat_stream_generator(request: ChatRequest):
     """
     RAG 对话流式生成器
     """
     try:
-        # 1. 检索相关知识 (RAG)
-        docs = await knowledge_engine.search(request.query, request.echo_id, limit=10)
-        context_text = "\n\n".join([doc.page_content for doc in docs])
+        # 1. 检索相关知识 (RAG)：闲聊、问时间、echo 无知识时跳过向量化与 Milvus
+        docs = []
+        gate = await retrieval_gate.decide(request.query, request.echo_id)
+        if gate.retrieve:
+            docs = await knowledge_engine.search(request.query, request.echo_id, limit=settings.RAG_TOP_K)
 
-        logger.info(f"Retrieved {len(docs)} docs for echo_id={request.echo_id}")
+        logger.info(f"Retrieved {len(docs)} docs for echo_id={request.echo_id} (gate={gate.reason})")
         current_time_str = datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
+        # 这些字段嵌在规则里且会重复出现，先各自限长；人设正文由 prompt_assembler 按预算截断
+        nickname = fit_profile_field(request.echo_nickname)
+        tone = fit_profile_field(request.echo_tone)
+        tags = fit_profile_field(request.echo_tags)
 
         system_template = f"""
-        你现在的身份是：【{request.echo_nickname}】
-        你的核心人设：{request.echo_prompt}
-        你的语言风格：{request.echo_tone}
-        你擅长的领域：{request.echo_tags}
+        你现在的身份是：【{nickname}】
+        你的核心人设：{PERSONA_SLOT}
+        你的语言风格：{tone}
+        你擅长的领域：{tags}
         
         【客观世界状态 - 必须以此为准】：
         当前真实时间：{current_time_str}
         （注意：如果用户问时间或日期，请直接根据“当前真实时间”回答，然后再结合你的人设风格进行调侃或延伸，绝对不要编造虚假的时间数字。）
 
         请严格遵守以下规则进行对话：
-        1. **沉浸式扮演**：你就是{request.echo_nickname}本人的数字分身Echo，不是AI助手。不要暴露你是程序或模型。
+        1. **沉浸式扮演**：你就是{nickname}本人的数字分身Echo，不是AI助手。不要暴露你是程序或模型。
         2. **拒绝重复介绍**：除非用户明确询问“你是谁”，否则**绝对不要**在每句话开头重复你的名字、身份或人设背景。
-        3. **风格一致性**：请始终保持“{request.echo_tone}”的语气，但是不要每一句话都完全沉浸其中，该正式的时候要正式。
+        3. **风格一致性**：请始终保持“{tone}”的语气，但是不要每一句话都完全沉浸其中，该正式的时候要正式。
         4. **上下文理解**：历史记录仅供参考，不要重复回答历史记录中已经回答过的问题。只针对用户最新发送的一句话进行回复。
         5. **知识参考**：如果需要，可以参考以下背景知识（结合你的人设用口语表达出来）：
-        {context_text}
         """
-        logger.info(f"context_text: {context_text}")
-
-        messages: List[BaseMessage] = [SystemMessage(content=system_template)]
-
-        # History Messages (处理历史，防止复读)
-        if request.history:
-            for msg in request.history[-20:]:  # 取最近20条
-                if msg.role == 'user':
-                    messages.append(HumanMessage(content=msg.content))
-                elif msg.role in ['assistant', 'ai']:
-                    messages.append(AIMessage(content=msg.content))
 
-        # Current User Query
-        messages.append(HumanMessage(content=request.query))
+        # 2. 更早的历史用滚动摘要代替，只保留摘要之后的原始消息
+        history = history_to_messages(request.history)
+        summary, recent_history = None, history
+        if settings.SESSION_MEMORY_ENABLED:
+            summary, recent_history = await session_memory.recall(request.user_id, request.echo_id, history)
 
-        logger.info(f"Chat Request: echo={request.echo_nickname}, prompt_len={len(system_template)}")
+        # 3. 按 token 预算组装：知识合并重叠 chunk + 去重，历史从最近往前装 (处理历史，防止复读)
+        prompt = prompt_assembler.assemble(
+            system_prompt=system_template,
+            persona=request.echo_prompt or "",
+            docs=docs,
+            history=recent_history,
+            query=request.query,
+            summary=summary,
+        )
+        messages = prompt.messages
 
-        # 3. 初始化 LLM
-        llm = ChatOpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE,
-            model="qwen-plus",
-            temperature=0.7,
-            streaming=True
+        logger.info(
+            f"Chat Request: echo={request.echo_nickname}, prompt_tokens={sum(prompt.final_tokens.values())}, "
+            f"saved={prompt.tokens_saved}"
         )
 
-        # 4. 流式调用
+        # 4. 获取 LLM（进程内共享实例与连接池）
+        llm = get_llm(temperature=0.7)
+
+        # 5. 流式调用
+        pieces = []
         async for chunk in llm.astream(messages):
             if chunk.content:
+                pieces.append(chunk.content)
                 yield chunk.content
 
+        # 6. 响应结束后在后台把更早的消息并入摘要，不占用本次请求
+        if settings.SESSION_MEMORY_ENABLED:
+            session_memory.schedule_update(
+                request.user_id,
+                request.echo_id,
+                history + [HumanMessage(content=request.query), AIMessage(content="".join(pieces))],
+            )
+
     except Exception as e:
         logger.exception(f"Chat error: {e}")
         yield f"Error: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,292 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+# 每次写操作顺带清理的过期条数上限：按 expires_at 索引取最早过期的若干条，
+# 清理成本摊到每次写入上是常数级，不再全表扫描
+PURGE_BATCH = 64
+
+
+class DedupeIndex:
+    """
+    训练去重索引（SQLite，WAL 模式，同机所有 uvicorn worker 共享）
+    - documents：整篇文档指纹 (echo_id, content_hash)
+    - chunks：同一 echo 下跨文档的 chunk 指纹 (echo_id, chunk_hash)
+    - chunk_refs：chunk 被哪些知识引用 (echo_id, chunk_hash, knowledge_id)，随 chunk 行一起过期
+      （过期后同一内容会重新写入一份向量，旧引用指向的是旧向量，不能算作新 chunk 的引用方）
+    两张指纹表都记录 knowledge_id，删除知识时同步释放，避免删除后无法重新训练
+    过期依赖 expires_at 索引（B 树即有序的到期队列），查询时也会校验是否过期
+
+    跨文档共享的 chunk 只以第一篇文档的 knowledge_id 写入一份向量，其它文档只登记引用；
+    删除知识前用 shared_chunk_owners 找出仍被其它知识引用的 chunk，由调用方把向量改挂到存活的引用方名下
+    """
+
+    def __init__(self, *, db_path: Optional[str], ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = self._open_db(db_path or ":memory:")
+
+        self.document_duplicates = 0
+        self.chunk_duplicates = 0
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        if db_path != ":memory:":
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        has_refs = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunk_refs'"
+        ).fetchone()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                echo_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                knowledge_id INTEGER,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (echo_id, content_hash)
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_expires ON documents (expires_at);
+            CREATE INDEX IF NOT EXISTS idx_documents_knowledge ON documents (knowledge_id);
+
+            CREATE TABLE IF NOT EXISTS chunks (
+                echo_id TEXT NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                knowledge_id INTEGER,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (echo_id, chunk_hash)
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_expires ON chunks (expires_at);
+            CREATE INDEX IF NOT EXISTS idx_chunks_knowledge ON chunks (knowledge_id);
+
+            CREATE TABLE IF NOT EXISTS chunk_refs (
+                echo_id TEXT NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                knowledge_id INTEGER NOT NULL,
+                PRIMARY KEY (echo_id, chunk_hash, knowledge_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunk_refs_knowledge ON chunk_refs (knowledge_id);
+            """
+        )
+        if not has_refs:
+            # 升级前的数据只知道写入方，其余引用方无从得知
+            conn.execute(
+                "INSERT OR IGNORE INTO chunk_refs (echo_id, chunk_hash, knowledge_id)"
+                " SELECT echo_id, chunk_hash, knowledge_id FROM chunks WHERE knowledge_id IS NOT NULL"
+            )
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE 立即拿写锁，保证多个进程并发登记同一指纹时只有一个成功
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _purge_expired(conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            "DELETE FROM documents WHERE rowid IN ("
+            " SELECT rowid FROM documents WHERE expires_at <= ?"
+            f" ORDER BY expires_at LIMIT {PURGE_BATCH})",
+            (now,),
+        )
+        expired = conn.execute(
+            "SELECT rowid, echo_id, chunk_hash FROM chunks WHERE expires_at <= ?"
+            f" ORDER BY expires_at LIMIT {PURGE_BATCH}",
+            (now,),
+        ).fetchall()
+        conn.executemany(
+            "DELETE FROM chunk_refs WHERE echo_id = ? AND chunk_hash = ?",
+            [(echo_id, chunk_hash) for _, echo_id, chunk_hash in expired],
+        )
+        conn.executemany("DELETE FROM chunks WHERE rowid = ?", [(rowid,) for rowid, _, _ in expired])
+
+    # --------------------------------------------------------------------------
+    def claim_document(self, echo_id: str, content_hash: str, knowledge_id: Optional[int] = None) -> bool:
+        """
+        登记文档指纹，已存在（且未过期）时返回 False
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._purge_expired(conn, now)
+            conn.execute(
+                "DELETE FROM documents WHERE echo_id = ? AND content_hash = ? AND expires_at <= ?",
+                (echo_id, content_hash, now),
+            )
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO documents (echo_id, content_hash, knowledge_id, expires_at)"
+                " VALUES (?, ?, ?, ?)",
+                (echo_id, content_hash, knowledge_id, now + self.ttl_seconds),
+            )
+            claimed = cursor.rowcount == 1
+
+        if not claimed:
+            self.document_duplicates += 1
+        return claimed
+
+    def release_document(self, echo_id: str, content_hash: str) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM documents WHERE echo_id = ? AND content_hash = ?",
+                (echo_id, content_hash),
+            )
+
+    def claim_chunks(
+        self, echo_id: str, chunk_hashes: Sequence[str], knowledge_id: Optional[int] = None
+    ) -> List[bool]:
+        """
+        批量登记 chunk 指纹，返回每个 chunk 是否为新内容（批内重复的只有第一个为 True）
+        无论是否重复，都登记 knowledge_id 对这些 chunk 的引用
+        """
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        result: List[bool] = []
+        with self._transaction() as conn:
+            self._purge_expired(conn, now)
+            for chunk_hash in chunk_hashes:
+                cursor = conn.execute(
+                    "DELETE FROM chunks WHERE echo_id = ? AND chunk_hash = ? AND expires_at <= ?",
+                    (echo_id, chunk_hash, now),
+                )
+                if cursor.rowcount:
+                    conn.execute(
+                        "DELETE FROM chunk_refs WHERE echo_id = ? AND chunk_hash = ?", (echo_id, chunk_hash)
+                    )
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO chunks (echo_id, chunk_hash, knowledge_id, expires_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (echo_id, chunk_hash, knowledge_id, expires_at),
+                )
+                result.append(cursor.rowcount == 1)
+            if knowledge_id is not None:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO chunk_refs (echo_id, chunk_hash, knowledge_id) VALUES (?, ?, ?)",
+                    [(echo_id, chunk_hash, knowledge_id) for chunk_hash in chunk_hashes],
+                )
+
+        self.chunk_duplicates += result.count(False)
+        return result
+
+    def release_claims(
+        self,
+        echo_id: str,
+        knowledge_id: Optional[int],
+        claimed: Sequence[str],
+        referenced: Sequence[str],
+    ) -> Dict[str, int]:
+        """
+        训练失败时撤销本次登记：referenced 为本次登记引用的全部 chunk，claimed 为其中由本次写入向量的 chunk
+        在同一事务里撤销引用并检查剩余引用：并发训练同一内容的其它知识已引用的 chunk 不释放指纹，
+        改记到存活的引用方名下，返回 chunk_hash -> 存活的引用方（调用方须保留这些向量并改挂，不能回滚删除）
+        """
+        survivors: Dict[str, int] = {}
+        with self._transaction() as conn:
+            if knowledge_id is not None:
+                conn.executemany(
+                    "DELETE FROM chunk_refs WHERE echo_id = ? AND chunk_hash = ? AND knowledge_id = ?",
+                    [(echo_id, chunk_hash, knowledge_id) for chunk_hash in referenced],
+                )
+            for chunk_hash in claimed:
+                owner = conn.execute(
+                    "SELECT MIN(knowledge_id) FROM chunk_refs WHERE echo_id = ? AND chunk_hash = ?",
+                    (echo_id, chunk_hash),
+                ).fetchone()[0]
+                if owner is None:
+                    conn.execute(
+                        "DELETE FROM chunks WHERE echo_id = ? AND chunk_hash = ?", (echo_id, chunk_hash)
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE chunks SET knowledge_id = ? WHERE echo_id = ? AND chunk_hash = ?",
+                        (owner, echo_id, chunk_hash),
+                    )
+                    survivors[chunk_hash] = owner
+        return survivors
+
+    def owned_chunks(self, echo_id: str, knowledge_id: int) -> Set[str]:
+        """
+        knowledge_id 引用的全部 chunk 指纹（含写在其它知识名下的共享 chunk）
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_hash FROM chunk_refs WHERE echo_id = ? AND knowledge_id = ?",
+                (echo_id, knowledge_id),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def shared_chunk_owners(
+        self, knowledge_ids: Sequence[int], echo_id: Optional[str] = None
+    ) -> Dict[Tuple[str, str], int]:
+        """
+        这些知识引用的 chunk 中，仍被其它知识引用的部分：(echo_id, chunk_hash) -> 存活的引用方（取最小的 knowledge_id）
+        """
+        echo_clause, echo_args = ("", []) if echo_id is None else (" AND r.echo_id = ?", [echo_id])
+        ids = json.dumps([int(k) for k in knowledge_ids])
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT r.echo_id, r.chunk_hash, MIN(o.knowledge_id) FROM chunk_refs r"
+                " JOIN chunk_refs o ON o.echo_id = r.echo_id AND o.chunk_hash = r.chunk_hash"
+                "  AND o.knowledge_id NOT IN (SELECT value FROM json_each(?))"
+                f" WHERE r.knowledge_id IN (SELECT value FROM json_each(?)){echo_clause}"
+                " GROUP BY r.echo_id, r.chunk_hash",
+                [ids, ids, *echo_args],
+            ).fetchall()
+        return {(echo, chunk_hash): owner for echo, chunk_hash, owner in rows}
+
+    def forget_knowledge(self, knowledge_ids: Sequence[int], echo_id: Optional[str] = None) -> None:
+        """
+        知识被删除后释放其文档指纹与引用；chunk 指纹只在没有其它知识引用时释放，
+        仍被引用的改记到存活的引用方名下（与 shared_chunk_owners 的选择一致）
+        """
+        echo_clause, echo_args = ("", []) if echo_id is None else (" AND echo_id = ?", [echo_id])
+        # 用 json_each 传入 id 列表，不受 SQLite 绑定参数个数的限制
+        ids = json.dumps([int(k) for k in knowledge_ids])
+        in_ids = "IN (SELECT value FROM json_each(?))"
+        other_refs = (
+            "SELECT 1 FROM chunk_refs r WHERE r.echo_id = chunks.echo_id"
+            f" AND r.chunk_hash = chunks.chunk_hash AND r.knowledge_id NOT {in_ids}"
+        )
+        with self._transaction() as conn:
+            conn.execute(f"DELETE FROM documents WHERE knowledge_id {in_ids}{echo_clause}", [ids, *echo_args])
+            conn.execute(
+                "DELETE FROM chunks WHERE (knowledge_id " + in_ids + " OR EXISTS ("
+                " SELECT 1 FROM chunk_refs r WHERE r.echo_id = chunks.echo_id"
+                f" AND r.chunk_hash = chunks.chunk_hash AND r.knowledge_id {in_ids}))"
+                f" AND NOT EXISTS ({other_refs}){echo_clause}",
+                [ids, ids, ids, *echo_args],
+            )
+            conn.execute(
+                "UPDATE chunks SET knowledge_id = ("
+                " SELECT MIN(r.knowledge_id) FROM chunk_refs r WHERE r.echo_id = chunks.echo_id"
+                f" AND r.chunk_hash = chunks.chunk_hash AND r.knowledge_id NOT {in_ids})"
+                f" WHERE knowledge_id {in_ids}{echo_clause}",
+                [ids, ids, *echo_args],
+            )
+            conn.execute(f"DELETE FROM chunk_refs WHERE knowledge_id {in_ids}{echo_clause}", [ids, *echo_args])
+
+    def stats(self) -> dict:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            chunks = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            refs = self._conn.execute("SELECT COUNT(*) FROM chunk_refs").fetchone()[0]
+        return {
+            "documents": documents,
+            "chunks": chunks,
+            "chunk_refs": refs,
+            "document_duplicates": self.document_duplicates,
+            "chunk_duplicates": self.chunk_duplicates,
+        }
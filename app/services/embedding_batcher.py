@@ -0,0 +1,147 @@
+import asyncio
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, List, Optional, Union
+
+from app.core.logger import logger
+from app.core.rate_limit import Priority, current_priority, priority_scope
+
+Vector = List[float]
+AsyncEmbedFunc = Callable[[List[str]], Awaitable[List[Vector]]]
+
+
+@dataclass
+class _Pending:
+    text: str
+    priority: Priority
+    enqueued_at: float
+    future: asyncio.Future = field(repr=False)
+
+
+class QueryEmbeddingBatcher:
+    """
+    查询向量微批：同一时间窗口内（window 秒，或攒满 max_batch 条）到达的 query
+    合并成一次向量化调用，再把结果分发回各自的调用方
+    - 窗口从第一条 query 到达时开始计时，攒满立即发出，不等窗口结束
+    - 同一批内重复的文本只向量化一次
+    - 批次按其中最高的优先级排队（对话 > 同频测试 > 训练）
+    - 调用方被取消只影响自己，批次照常完成；整批失败时逐条重试，只把异常传给出错的调用方
+    """
+
+    def __init__(self, embed: AsyncEmbedFunc, *, window: float, max_batch: int, samples: int = 1000):
+        if max_batch <= 0:
+            raise ValueError("max_batch must be positive")
+        self._embed = embed
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[_Pending] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+        self.queries = 0
+        self.batches = 0
+        self.full_batches = 0       # 因攒满而提前发出的批次
+        self.deduplicated = 0
+        self.failures = 0
+        self._sizes: Counter = Counter()
+        self._recent_waits: Deque[float] = deque(maxlen=samples)
+
+    async def embed(self, text: str) -> Vector:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(_Pending(text, current_priority(), time.perf_counter(), future))
+        self.queries += 1
+
+        if len(self._pending) >= self.max_batch:
+            self.full_batches += 1
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        # 调用方被取消时不取消共享的批次，只是不再等待结果
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[_Pending]) -> None:
+        dispatched = time.perf_counter()
+        for item in batch:
+            self._recent_waits.append(dispatched - item.enqueued_at)
+        texts = list(dict.fromkeys(item.text for item in batch))
+        self.deduplicated += len(batch) - len(texts)
+        self.batches += 1
+        self._sizes[len(batch)] += 1
+
+        try:
+            with priority_scope(min(item.priority for item in batch)):
+                results = await self._embed_all(texts)
+        except BaseException:
+            for item in batch:
+                item.future.cancel()
+            raise
+
+        by_text = dict(zip(texts, results))
+        for item in batch:
+            if item.future.done():
+                continue
+            result = by_text[item.text]
+            if isinstance(result, Exception):
+                item.future.set_exception(result)
+            else:
+                item.future.set_result(result)
+
+    async def _embed_all(self, texts: List[str]) -> List[Union[Vector, Exception]]:
+        """
+        整批向量化；整批失败（瞬时错误已在执行器内重试过）时逐条重试，
+        一条有问题的 query 不连累同批的其它调用方
+        """
+        try:
+            return await self._embed(texts)
+        except Exception as e:
+            self.failures += 1
+            logger.warning("Query embedding batch of {} failed: {!r}", len(texts), e)
+            if len(texts) == 1:
+                return [e]
+
+        async def single(text: str) -> Union[Vector, Exception]:
+            try:
+                return (await self._embed([text]))[0]
+            except Exception as e:
+                return e
+
+        return list(await asyncio.gather(*[single(text) for text in texts]))
+
+    def stats(self) -> dict:
+        waits = sorted(self._recent_waits)
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 3)
+
+        sized = sum(size * count for size, count in self._sizes.items())
+        return {
+            "window_ms": round(self.window * 1000, 3),
+            "max_batch": self.max_batch,
+            "queries": self.queries,
+            "batches": self.batches,
+            "full_batches": self.full_batches,
+            "deduplicated": self.deduplicated,
+            "failures": self.failures,
+            "pending": len(self._pending),
+            "avg_batch_size": round(sized / self.batches, 2) if self.batches else 0.0,
+            "avg_fill": round(sized / self.batches / self.max_batch, 4) if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self._sizes.items())),
+            # 排队等待凑批引入的额外延迟
+            "p50_added_ms": percentile(0.5),
+            "p95_added_ms": percentile(0.95),
+            "max_added_ms": percentile(1.0),
+        }
@@ -0,0 +1,275 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.embeddings import Embeddings
+
+from app.core.executors import local_store_pool
+from app.core.logger import logger
+
+Vector = List[float]
+
+
+def _text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    内容寻址的向量缓存，key = (model, sha256(text))
+    - 内存层：有界 LRU
+    - 磁盘层：SQLite（同机多个 uvicorn worker 共享），向量以 float32 存储
+    异步调用方只在事件循环中查内存层，磁盘层的读写放进 local_store_pool
+    """
+
+    def __init__(self, *, memory_size: int, db_path: Optional[str] = None):
+        self.memory_size = memory_size
+        self.db_path = db_path
+        self._memory: "OrderedDict[tuple, Vector]" = OrderedDict()
+        # 内存层与磁盘层分开加锁：SQLite 等锁 / 提交期间，事件循环上的内存查询不受影响
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if db_path:
+            self._conn = self._open_db(db_path)
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, digest))"
+        )
+        conn.commit()
+        return conn
+
+    # --------------------------------------------------------------------------
+    def _memory_get(self, key: tuple) -> Optional[Vector]:
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+        return vector
+
+    def _memory_put(self, key: tuple, vector: Vector) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _disk_get_many(self, model: str, digests: List[str]) -> Dict[str, Vector]:
+        if self._conn is None or not digests:
+            return {}
+        found: Dict[str, Vector] = {}
+        # SQLite 默认最多 999 个绑定参数
+        for i in range(0, len(digests), 500):
+            part = digests[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            rows = self._conn.execute(
+                f"SELECT digest, vector FROM embeddings"
+                f" WHERE model = ? AND digest IN ({placeholders})",
+                [model, *part],
+            ).fetchall()
+            for digest, blob in rows:
+                found[digest] = array("f", blob).tolist()
+        return found
+
+    # --------------------------------------------------------------------------
+    @property
+    def persistent(self) -> bool:
+        return self._conn is not None
+
+    def get_memory(self, model: str, texts: Sequence[str]) -> List[Optional[Vector]]:
+        """
+        只查内存层（纯内存操作，可直接在事件循环中调用）；未命中的位置为 None，由 get_disk 继续查
+        """
+        results: List[Optional[Vector]] = []
+        with self._lock:
+            for text in texts:
+                vector = self._memory_get((model, _text_digest(text)))
+                if vector is not None:
+                    self.memory_hits += 1
+                results.append(vector)
+        return results
+
+    def get_disk(self, model: str, texts: Sequence[str]) -> List[Optional[Vector]]:
+        """
+        查磁盘层（SQLite，需在线程中调用），命中的向量回填内存层
+        """
+        digests = [_text_digest(text) for text in texts]
+        with self._db_lock:
+            on_disk = self._disk_get_many(model, list(set(digests)))
+
+        results: List[Optional[Vector]] = []
+        with self._lock:
+            for digest in digests:
+                vector = on_disk.get(digest)
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.disk_hits += 1
+                    self._memory_put((model, digest), vector)
+                results.append(vector)
+        return results
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[Vector]]:
+        results = self.get_memory(model, texts)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            for i, vector in zip(missing, self.get_disk(model, [texts[i] for i in missing])):
+                results[i] = vector
+        return results
+
+    def put_memory(self, model: str, texts: Sequence[str], vectors: Sequence[Vector]) -> None:
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                self._memory_put((model, _text_digest(text)), list(vector))
+
+    def put_disk(self, model: str, texts: Sequence[str], vectors: Sequence[Vector]) -> None:
+        """
+        写磁盘层（需在线程中调用）
+        """
+        if self._conn is None or not texts:
+            return
+        rows = [
+            (model, _text_digest(text), array("f", vector).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._db_lock:
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, digest, vector)"
+                    " VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                # 磁盘层写失败不影响主流程，只丢失持久化
+                logger.warning("Embedding cache disk write failed: {}", e)
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Vector]) -> None:
+        self.put_memory(model, texts, vectors)
+        self.put_disk(model, texts, vectors)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    给任意 Embeddings 套一层缓存，只把未命中的文本交给底层模型
+    """
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache, model: str):
+        self.underlying = underlying
+        self.cache = cache
+        self.model = model
+
+    @staticmethod
+    def _pending(texts: List[str], cached: List[Optional[Vector]]) -> List[str]:
+        # 同一批次内重复的文本只向量化一次
+        return list(dict.fromkeys(
+            text for text, vector in zip(texts, cached) if vector is None
+        ))
+
+    def _plan(self, texts: List[str]):
+        cached = self.cache.get_many(self.model, texts)
+        return cached, self._pending(texts, cached)
+
+    async def _aplan(self, texts: List[str]):
+        cached = self.cache.get_memory(self.model, texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            if self.cache.persistent:
+                on_disk = await local_store_pool.run(self.cache.get_disk, self.model, missing_texts)
+            else:
+                on_disk = self.cache.get_disk(self.model, missing_texts)
+            for i, vector in zip(missing, on_disk):
+                cached[i] = vector
+        return cached, self._pending(texts, cached)
+
+    @staticmethod
+    def _combine(
+        texts: List[str],
+        cached: List[Optional[Vector]],
+        pending: List[str],
+        fresh: List[Vector],
+    ) -> List[Vector]:
+        fresh_by_text = dict(zip(pending, fresh))
+        return [
+            vector if vector is not None else fresh_by_text[text]
+            for text, vector in zip(texts, cached)
+        ]
+
+    def _merge(
+        self,
+        texts: List[str],
+        cached: List[Optional[Vector]],
+        pending: List[str],
+        fresh: List[Vector],
+    ) -> List[Vector]:
+        if pending:
+            self.cache.put_many(self.model, pending, fresh)
+        return self._combine(texts, cached, pending, fresh)
+
+    async def _amerge(
+        self,
+        texts: List[str],
+        cached: List[Optional[Vector]],
+        pending: List[str],
+        fresh: List[Vector],
+    ) -> List[Vector]:
+        if pending:
+            self.cache.put_memory(self.model, pending, fresh)
+            if self.cache.persistent:
+                await local_store_pool.run(self.cache.put_disk, self.model, pending, fresh)
+        return self._combine(texts, cached, pending, fresh)
+
+    def embed_documents(self, texts: List[str]) -> List[Vector]:
+        cached, pending = self._plan(texts)
+        fresh = self.underlying.embed_documents(pending) if pending else []
+        return self._merge(texts, cached, pending, fresh)
+
+    async def aembed_documents(self, texts: List[str]) -> List[Vector]:
+        cached, pending = await self._aplan(texts)
+        fresh = await self.underlying.aembed_documents(pending) if pending else []
+        return await self._amerge(texts, cached, pending, fresh)
+
+    def embed_query(self, text: str) -> Vector:
+        cached, pending = self._plan([text])
+        if not pending:
+            return cached[0]
+        fresh = [self.underlying.embed_query(text)]
+        return self._merge([text], cached, pending, fresh)[0]
+
+    async def aembed_query(self, text: str) -> Vector:
+        cached, pending = await self._aplan([text])
+        if not pending:
+            return cached[0]
+        fresh = [await self.underlying.aembed_query(text)]
+        return (await self._amerge([text], cached, pending, fresh))[0]
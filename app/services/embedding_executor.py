@@ -0,0 +1,176 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+import httpx
+import requests
+
+from app.core.executors import BoundedExecutor, embedding_pool
+from app.core.logger import logger
+from app.core.rate_limit import AdmissionController, Priority, current_priority
+
+Vector = List[float]
+EmbedBatchFunc = Callable[[List[str]], List[Vector]]
+AsyncEmbedBatchFunc = Callable[[List[str]], Awaitable[List[Vector]]]
+
+
+class TransientEmbeddingError(RuntimeError):
+    """
+    可重试的向量化错误（限流 / 服务端 5xx / 网络抖动）
+    """
+
+
+RETRYABLE_EXCEPTIONS = (
+    TransientEmbeddingError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    httpx.TransportError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class EmbeddingExecutor:
+    """
+    向量化执行器：
+    1. 按供应商单次调用上限切分 batch
+    2. 在并发上限内并行执行各个 batch
+    3. 对瞬时错误做指数退避重试
+    4. 按原始顺序拼回结果
+    每次调用（含重试）前向 limiter 领取配额，token 数按字符数估计
+    异步执行时：提供 aembed_batch 则原生异步调用（只占 pool 的容量），否则把 embed_batch 放进 pool 的线程
+    """
+
+    def __init__(
+        self,
+        embed_batch: EmbedBatchFunc,
+        *,
+        aembed_batch: Optional[AsyncEmbedBatchFunc] = None,
+        batch_size: int,
+        max_concurrency: int,
+        max_retries: int,
+        retry_backoff: float,
+        limiter: Optional[AdmissionController] = None,
+        pool: Optional[BoundedExecutor] = None,
+    ):
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be positive")
+
+        self._embed_batch = embed_batch
+        self._aembed_batch = aembed_batch
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.limiter = limiter
+        self.pool = pool or embedding_pool
+
+    def _split(self, texts: Sequence[str]) -> List[List[str]]:
+        return [
+            list(texts[i:i + self.batch_size])
+            for i in range(0, len(texts), self.batch_size)
+        ]
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        # 指数退避 + 抖动，避免多个 batch 同时重试再次撞上限流
+        return self.retry_backoff * (2 ** attempt) * (1 + random.random() * 0.5)
+
+    @staticmethod
+    def _check_result(batch: List[str], vectors: List[Vector]) -> List[Vector]:
+        if len(vectors) != len(batch):
+            raise RuntimeError(
+                f"Embedding count mismatch: expected {len(batch)}, got {len(vectors)}"
+            )
+        return vectors
+
+    @staticmethod
+    def _batch_tokens(batch: List[str]) -> int:
+        return sum(len(text) for text in batch)
+
+    # --------------------------------------------------------------------------
+    def _run_batch_sync(self, index: int, batch: List[str], priority: Priority) -> List[Vector]:
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire_sync(self._batch_tokens(batch), priority)
+            try:
+                return self._check_result(batch, self._embed_batch(batch))
+            except RETRYABLE_EXCEPTIONS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_seconds(attempt)
+                logger.warning(
+                    "Embedding batch {} failed (attempt {}), retry in {:.2f}s: {}",
+                    index, attempt + 1, delay, e,
+                )
+                time.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    def run(self, texts: Sequence[str]) -> List[Vector]:
+        """
+        同步执行（供 langchain 的同步接口使用）
+        """
+        batches = self._split(texts)
+        if not batches:
+            return []
+        # 线程池不继承 contextvar，优先级在调用线程里取好再传下去
+        priority = current_priority()
+        if len(batches) == 1:
+            return self._run_batch_sync(0, batches[0], priority)
+
+        workers = min(self.max_concurrency, len(batches))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(self._run_batch_sync, i, batch, priority)
+                for i, batch in enumerate(batches)
+            ]
+            results = [future.result() for future in futures]
+
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    # --------------------------------------------------------------------------
+    async def _call_async(self, batch: List[str]) -> List[Vector]:
+        if self._aembed_batch is None:
+            return await self.pool.run(self._embed_batch, batch)
+        async with self.pool.slot():
+            return await self._aembed_batch(batch)
+
+    async def _run_batch_async(
+        self, index: int, batch: List[str], semaphore: asyncio.Semaphore
+    ) -> List[Vector]:
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                if self.limiter is not None:
+                    await self.limiter.acquire(self._batch_tokens(batch))
+                try:
+                    vectors = await self._call_async(batch)
+                    return self._check_result(batch, vectors)
+                except RETRYABLE_EXCEPTIONS as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self._backoff_seconds(attempt)
+                    logger.warning(
+                        "Embedding batch {} failed (attempt {}), retry in {:.2f}s: {}",
+                        index, attempt + 1, delay, e,
+                    )
+                    await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def arun(self, texts: Sequence[str]) -> List[Vector]:
+        """
+        异步执行：各 batch 在并发上限内并行，结果按输入顺序返回
+        """
+        batches = self._split(texts)
+        if not batches:
+            return []
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*[
+            self._run_batch_async(i, batch, semaphore)
+            for i, batch in enumerate(batches)
+        ])
+
+        return [vector for batch_vectors in results for vector in batch_vectors]
@@ -1,25 +1,85 @@
+import asyncio
 import functools
-import anyio
+import hashlib
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Protocol, Tuple
+
 import alibabacloud_oss_v2 as oss
+import anyio
 from app.core.logger import logger
 from app.core.config import settings
+from app.core.executors import object_storage_pool
 
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
 CHUNK_SIZE = 256 * 1024  # 256KB
+HASH_BLOCK_SIZE = 1024 * 1024  # 分片下载完成后计算 sha256 时的读块大小
 
 
-def _download_from_oss_sync(
-    *,
-    region: str,
-    bucket: str,
-    object_key: str,
-    endpoint: str | None = None,
-) -> bytes:
+class ObjectStoreClient(Protocol):
     """
-    使用阿里云 OSS 官方 SDK 同步下载（内部函数）
+    下载用到的 OSS 客户端接口（oss.Client 或测试用的本地假对象存储）
     """
-    logger.info(f"Downloading from OSS: region={region}, bucket={bucket}, object_key={object_key}")
 
+    def head_object(self, request: oss.HeadObjectRequest): ...
+
+    def get_object(self, request: oss.GetObjectRequest): ...
+
+
+class ObjectNotModified(Exception):
+    """
+    条件请求命中：对象 ETag 与本地缓存一致 (HTTP 304)
+    """
+
+
+def _is_not_modified(error: Exception) -> bool:
+    if isinstance(error, ObjectNotModified):
+        return True
+    inner = error.unwrap() if isinstance(error, oss.exceptions.OperationError) else error
+    return getattr(inner, "status_code", None) == 304
+
+
+@dataclass
+class DownloadedFile:
+    """
+    流式下载到本地临时文件的结果（调用方负责 cleanup）
+    """
+    path: str
+    size: int
+    sha256: str
+    etag: Optional[str] = None
+
+    def cleanup(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+@dataclass
+class DownloadedBuffer:
+    """
+    下载到内存的结果；与 DownloadedFile 字段一致，cleanup 无需做任何事
+    """
+    data: bytearray
+    size: int
+    sha256: str
+    etag: Optional[str] = None
+
+    def cleanup(self) -> None:
+        pass
+
+
+# ==============================================================================
+# 客户端池：按 (region, endpoint) 复用 oss.Client，连接与 TLS 会话随之复用
+# ==============================================================================
+_client_pool: Dict[Tuple[str, Optional[str]], oss.Client] = {}
+_client_pool_lock = threading.Lock()
+
+
+def _create_client(region: str, endpoint: str | None = None) -> oss.Client:
     if not settings.OSS_ACCESS_KEY_ID or not settings.OSS_ACCESS_KEY_SECRET:
         error_msg = "OSS Access Key 未配置，请在 .env 文件中填写 OSS_ACCESS_KEY_ID 和 OSS_ACCESS_KEY_SECRET"
         logger.error(error_msg)
@@ -36,35 +96,164 @@ def _download_from_oss_sync(
     if endpoint:
         cfg.endpoint = endpoint
 
-    client = oss.Client(cfg)
+    return oss.Client(cfg)
+
+
+def get_oss_client(region: str, endpoint: str | None = None) -> oss.Client:
+    key = (region, endpoint)
+    client = _client_pool.get(key)
+    if client is not None:
+        return client
+    with _client_pool_lock:
+        client = _client_pool.get(key)
+        if client is None:
+            logger.info(f"Creating pooled OSS client: region={region}, endpoint={endpoint}")
+            client = _create_client(region, endpoint)
+            _client_pool[key] = client
+        return client
+
+
+# ==============================================================================
+# 下载实现：先 HEAD 拿大小并预分配，小文件单次 GET，大文件并发 Range GET
+# ==============================================================================
+class _BufferSink:
+    def __init__(self, size: int):
+        self.buffer = bytearray(size)
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        self.buffer[offset:offset + len(data)] = data
+
 
+class _FileSink:
+    def __init__(self, f, size: int):
+        self._f = f
+        self._lock = threading.Lock()
+        f.truncate(size)
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        with self._lock:
+            self._f.seek(offset)
+            self._f.write(data)
+
+
+def _head_object(
+    client: ObjectStoreClient,
+    bucket: str,
+    object_key: str,
+    if_none_match: Optional[str] = None,
+):
     try:
-        result = client.get_object(
-            oss.GetObjectRequest(
-                bucket=bucket,
-                key=object_key,
-            )
+        return client.head_object(
+            oss.HeadObjectRequest(bucket=bucket, key=object_key, if_none_match=if_none_match)
         )
     except Exception as e:
-        logger.error(f"OSS download failed: {e}")
+        if if_none_match and _is_not_modified(e):
+            raise ObjectNotModified(object_key) from e
+        logger.error(f"OSS head failed: {e}")
         raise e
 
-    total = 0
-    chunks: list[bytes] = []
 
+def _get_range(
+    client: ObjectStoreClient,
+    *,
+    bucket: str,
+    object_key: str,
+    etag: Optional[str],
+    start: int,
+    end: int,
+    sink,
+    on_bytes: Optional[Callable[[int], None]],
+) -> None:
+    """
+    下载 [start, end] 字节区间并写入 sink 的对应位置
+    带 If-Match，防止 HEAD 之后对象被覆盖导致各分片来自不同版本
+    """
+    result = client.get_object(
+        oss.GetObjectRequest(
+            bucket=bucket,
+            key=object_key,
+            if_match=etag,
+            range_header=f"bytes={start}-{end}",
+        )
+    )
+    offset = start
     with result.body as body_stream:
         for chunk in body_stream.iter_bytes(block_size=CHUNK_SIZE):
-            total += len(chunk)
-            if total > MAX_FILE_SIZE:
-                raise RuntimeError(f"File too large (exceeds {MAX_FILE_SIZE} bytes)")
+            if offset + len(chunk) > end + 1:
+                raise RuntimeError(f"OSS returned more data than requested for bytes={start}-{end}")
+            sink.write_at(offset, chunk)
+            offset += len(chunk)
+            if on_bytes is not None:
+                on_bytes(len(chunk))
 
-            chunks.append(chunk)
+    if offset != end + 1:
+        raise RuntimeError(f"Incomplete OSS range download: bytes={start}-{end}, got {offset - start}")
 
-    if not chunks:
-        logger.warning(f"Downloaded empty file: {object_key}")
-        return b""
 
-    return b"".join(chunks)
+async def _download_into(
+    client: ObjectStoreClient,
+    *,
+    bucket: str,
+    object_key: str,
+    size: int,
+    etag: Optional[str],
+    sink,
+    on_bytes: Optional[Callable[[int], None]] = None,
+) -> None:
+    """
+    分片在事件循环里编排，每个 Range GET 作为一次 object_storage_pool 调用提交：
+    并发受 OSS_RANGE_CONCURRENCY 与 object_storage_pool 容量双重限制，外层不占着线程等分片
+    """
+    if size == 0:
+        return
+
+    get_range = functools.partial(
+        _get_range,
+        client,
+        bucket=bucket,
+        object_key=object_key,
+        etag=etag,
+        sink=sink,
+        on_bytes=on_bytes,
+    )
+
+    if size <= settings.OSS_RANGE_THRESHOLD:
+        await object_storage_pool.run(functools.partial(get_range, start=0, end=size - 1))
+        return
+
+    part_size = settings.OSS_RANGE_PART_SIZE
+    parts = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+    logger.info(f"Ranged download: object_key={object_key}, size={size}, parts={len(parts)}")
+
+    semaphore = asyncio.Semaphore(min(settings.OSS_RANGE_CONCURRENCY, len(parts)))
+
+    async def fetch(start: int, end: int) -> None:
+        async with semaphore:
+            await object_storage_pool.run(functools.partial(get_range, start=start, end=end))
+
+    tasks = [asyncio.ensure_future(fetch(start, end)) for start, end in parts]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # 已进入线程的分片无法中断，等它们结束后调用方才能释放 sink（临时文件）
+        with anyio.CancelScope(shield=True):
+            await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _file_sha256(f) -> str:
+    f.flush()
+    f.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(functools.partial(f.read, HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def _buffer_sha256(buffer: bytearray) -> str:
+    return hashlib.sha256(buffer).hexdigest()
 
 
 async def download_file_from_oss(
@@ -73,19 +262,81 @@ async def download_file_from_oss(
     bucket: str,
     object_key: str,
     endpoint: str | None = None,
-) -> bytes:
+    on_bytes: Optional[Callable[[int], None]] = None,
+    client: ObjectStoreClient | None = None,
+    if_none_match: Optional[str] = None,
+) -> DownloadedBuffer:
     """
-    FastAPI 可用的异步包装
+    使用阿里云 OSS 官方 SDK 下载到内存
+    HEAD、各个 GET 与 sha256 分别提交到 object_storage_pool，编排留在事件循环里
+    传入 if_none_match 时先做条件请求，对象未变化则抛出 ObjectNotModified
     """
-    # --- 2. 核心修改开始 ---
-    # 使用 functools.partial 将关键字参数绑定到函数上
-    # anyio.to_thread.run_sync(func, *args) 不支持 kwargs，所以必须这样写
-    func = functools.partial(
-        _download_from_oss_sync,
-        region=region,
-        bucket=bucket,
-        object_key=object_key,
-        endpoint=endpoint,
+    logger.info(f"Downloading from OSS: region={region}, bucket={bucket}, object_key={object_key}")
+
+    client = client or get_oss_client(region, endpoint)
+    # object_storage_pool.run(func, *args) 不支持 kwargs，所以用 functools.partial 绑定
+    head = await object_storage_pool.run(
+        functools.partial(_head_object, client, bucket, object_key, if_none_match=if_none_match)
+    )
+    size = head.content_length or 0
+    if size > MAX_FILE_SIZE:
+        raise RuntimeError(f"File too large (exceeds {MAX_FILE_SIZE} bytes)")
+
+    if size == 0:
+        logger.warning(f"Downloaded empty file: {object_key}")
+
+    sink = _BufferSink(size)
+    await _download_into(
+        client, bucket=bucket, object_key=object_key, size=size, etag=head.etag, sink=sink, on_bytes=on_bytes
+    )
+    sha256 = await object_storage_pool.run(_buffer_sha256, sink.buffer)
+    return DownloadedBuffer(data=sink.buffer, size=size, sha256=sha256, etag=head.etag)
+
+
+async def download_file_from_oss_to_disk(
+    *,
+    region: str,
+    bucket: str,
+    object_key: str,
+    endpoint: str | None = None,
+    max_size: int | None = None,
+    on_bytes: Optional[Callable[[int], None]] = None,
+    client: ObjectStoreClient | None = None,
+    if_none_match: Optional[str] = None,
+) -> DownloadedFile:
+    """
+    流式下载到预分配的本地临时文件（大文件训练用）：大对象分片并发写入各自偏移，完成后顺序计算 sha256
+    传入 if_none_match 时先做条件请求，对象未变化则抛出 ObjectNotModified，不传输任何数据
+    """
+    logger.info(f"Downloading from OSS to disk: bucket={bucket}, object_key={object_key}")
+
+    max_size = max_size or settings.INGEST_MAX_FILE_SIZE
+    client = client or get_oss_client(region, endpoint)
+    head = await object_storage_pool.run(
+        functools.partial(_head_object, client, bucket, object_key, if_none_match=if_none_match)
     )
-    return await anyio.to_thread.run_sync(func)
-    # --- 核心修改结束 ---
\ No newline at end of file
+    size = head.content_length or 0
+    if size > max_size:
+        raise RuntimeError(f"File too large (exceeds {max_size} bytes)")
+
+    fd, path = tempfile.mkstemp(prefix="frequency-oss-", dir=settings.INGEST_TEMP_DIR)
+    try:
+        with os.fdopen(fd, "w+b") as f:
+            await _download_into(
+                client,
+                bucket=bucket,
+                object_key=object_key,
+                size=size,
+                etag=head.etag,
+                sink=_FileSink(f, size),
+                on_bytes=on_bytes,
+            )
+            sha256 = await object_storage_pool.run(_file_sha256, f)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    if size == 0:
+        logger.warning(f"Downloaded empty file: {object_key}")
+
+    return DownloadedFile(path=path, size=size, sha256=sha256, etag=head.etag)
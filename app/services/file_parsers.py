@@ -1,14 +1,138 @@
+import codecs
 import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Union
+
 import pdfplumber
+import pymupdf
+
+from app.core.config import settings
+from app.core.executors import parsing_pool
+
+TEXT_BLOCK_SIZE = 64 * 1024  # 流式读取文本文件时每次读取的字节数
+TEXT_FILE_TYPES = ("md", "markdown", "txt")
+
+PdfSource = Union[str, bytes]  # 文件路径或文件内容
+
+
+# ==============================================================================
+# PDF 解析引擎：PyMuPDF 为主，空页回退 pdfplumber；按页段拆到进程池并行
+# ==============================================================================
+def _open_pymupdf(source: PdfSource):
+    if isinstance(source, str):
+        return pymupdf.open(source)
+    return pymupdf.open(stream=source, filetype="pdf")
+
+
+def _open_pdfplumber(source: PdfSource):
+    return pdfplumber.open(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def pdf_page_count(source: PdfSource) -> int:
+    with _open_pymupdf(source) as doc:
+        return doc.page_count
+
+
+def extract_page_range(source: PdfSource, start: int, end: int) -> List[str]:
+    """
+    提取 [start, end) 页的文本（进程池 worker 入口，必须是模块级函数）
+    PyMuPDF 提取为空的页（版式复杂 / 字体映射缺失）再用 pdfplumber 补一次
+    """
+    with _open_pymupdf(source) as doc:
+        texts = [doc[i].get_text("text").strip() for i in range(start, end)]
+
+    empty = [i for i, text in enumerate(texts) if not text]
+    if empty:
+        with _open_pdfplumber(source) as pdf:
+            for i in empty:
+                page = pdf.pages[start + i]
+                texts[i] = (page.extract_text() or "").strip()
+                page.close()
+
+    return texts
+
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    进程池懒加载；PDF_PARSE_WORKERS <= 0 时在当前进程内解析
+    使用 spawn 启动 worker，避免 fork 多线程的 uvicorn 进程
+    """
+    global _parse_pool
+    if settings.PDF_PARSE_WORKERS <= 0:
+        return None
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=settings.PDF_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+def iter_pdf_pages(path: str) -> Iterator[str]:
+    """
+    按页产出 PDF 文本（保持页序）
+    页段分发到进程池，同时在途的页段数有上限，内存占用与页数无关
+    """
+    total = pdf_page_count(path)
+    per_task = settings.PDF_PAGES_PER_TASK
+    ranges = [(start, min(start + per_task, total)) for start in range(0, total, per_task)]
+
+    pool = get_parse_pool()
+    if pool is None:
+        for start, end in ranges:
+            yield from filter(None, extract_page_range(path, start, end))
+        return
+
+    max_in_flight = settings.PDF_PARSE_WORKERS * 2
+    in_flight = deque()
+    try:
+        for start, end in ranges:
+            in_flight.append(pool.submit(extract_page_range, path, start, end))
+            if len(in_flight) >= max_in_flight:
+                yield from filter(None, in_flight.popleft().result())
+        while in_flight:
+            yield from filter(None, in_flight.popleft().result())
+    finally:
+        for future in in_flight:
+            future.cancel()
 
 
 def parse_pdf(content: bytes) -> str:
-    texts = []
-    with pdfplumber.open(io.BytesIO(content)) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-            if text:
-                texts.append(text)
+    texts = [text for text in extract_page_range(content, 0, pdf_page_count(content)) if text]
+
+    if not texts:
+        raise RuntimeError("No text extracted from PDF")
+
+    return "\n\n".join(texts)
+
+
+def _parse_pdf_parallel(content: bytes) -> str:
+    # 落盘后按路径分发给 worker，避免把整份文件反复序列化给每个进程
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=settings.INGEST_TEMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        texts = list(iter_pdf_pages(path))
+    finally:
+        os.remove(path)
 
     if not texts:
         raise RuntimeError("No text extracted from PDF")
@@ -26,7 +150,71 @@ def parse_file(content: bytes, file_type: str) -> str:
 
     if ft == "pdf":
         return parse_pdf(content)
-    elif ft in ("md", "markdown", "txt"):
+    elif ft in TEXT_FILE_TYPES:
         return parse_text(content)
     else:
         raise RuntimeError(f"Unsupported file type: {file_type}")
+
+
+async def aparse_file(content: bytes, file_type: str) -> str:
+    """
+    异步解析：不阻塞事件循环，PDF 走进程池并行解析
+    """
+    if file_type.lower() == "pdf":
+        return await parsing_pool.run(_parse_pdf_parallel, content)
+    return await parsing_pool.run(parse_file, content, file_type)
+
+
+# ==============================================================================
+# 流式解析：按页 / 按块产出文本，内存占用与文件大小无关
+# ==============================================================================
+def iter_text_blocks(path: str, block_size: int = TEXT_BLOCK_SIZE) -> Iterator[str]:
+    """
+    增量解码 UTF-8 文本，在换行处切块，避免把一行拆到两个块里
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending = ""
+    with open(path, "rb") as f:
+        while True:
+            raw = f.read(block_size)
+            text = pending + decoder.decode(raw, final=not raw)
+            if not raw:
+                if text:
+                    yield text
+                return
+
+            cut = text.rfind("\n")
+            if cut <= 0:
+                # 超长单行也要按块吐出，否则内存会随行长增长
+                if len(text) < block_size * 4:
+                    pending = text
+                    continue
+                yield text
+                pending = ""
+                continue
+            # 换行符留给下一块开头，保证块拼接后与原文一致
+            yield text[:cut]
+            pending = text[cut:]
+
+
+def iter_file_sections(path: str, file_type: str) -> Iterator[str]:
+    ft = file_type.lower()
+
+    if ft == "pdf":
+        return iter_pdf_pages(path)
+    elif ft in TEXT_FILE_TYPES:
+        return iter_text_blocks(path)
+    else:
+        raise RuntimeError(f"Unsupported file type: {file_type}")
+
+
+def is_supported_file_type(file_type: str) -> bool:
+    ft = file_type.lower()
+    return ft == "pdf" or ft in TEXT_FILE_TYPES
+
+
+def section_separator(file_type: str) -> str:
+    """
+    相邻 section 之间的分隔符：PDF 按页用空行分隔（与 parse_pdf 一致），文本块直接拼接
+    """
+    return "\n\n" if file_type.lower() == "pdf" else ""
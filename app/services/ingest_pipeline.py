@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from langchain_text_splitters import TextSplitter
+
+from app.core.logger import logger
+
+
+@dataclass
+class IngestProgress:
+    """
+    流式训练的进度与各阶段耗时
+    各阶段是流水线并行的，stage_timings 记录的是每个阶段的累计耗时（秒）
+    """
+    label: str = ""
+    stage: str = "pending"
+    bytes_downloaded: int = 0
+    sections_parsed: int = 0
+    chunks_produced: int = 0
+    chunks_skipped: int = 0
+    chunks_embedded: int = 0
+    chunks_inserted: int = 0
+    stage_timings: Dict[str, float] = field(default_factory=dict)
+    on_update: Optional[Callable[["IngestProgress"], None]] = field(default=None, repr=False)
+
+    def set_stage(self, stage: str) -> None:
+        self.stage = stage
+        logger.info("Ingest [{}] stage -> {}", self.label, stage)
+        self._notify()
+
+    @contextmanager
+    def timed(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stage_timings[stage] = self.stage_timings.get(stage, 0.0) + elapsed
+
+    def add_bytes(self, count: int) -> None:
+        self.bytes_downloaded += count
+
+    def report(self) -> None:
+        logger.info(
+            "Ingest [{}] progress: sections={}, chunks produced={}, skipped={}, embedded={}, inserted={}",
+            self.label,
+            self.sections_parsed,
+            self.chunks_produced,
+            self.chunks_skipped,
+            self.chunks_embedded,
+            self.chunks_inserted,
+        )
+        self._notify()
+
+    def _notify(self) -> None:
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def snapshot(self) -> dict:
+        return {
+            "stage": self.stage,
+            "bytes_downloaded": self.bytes_downloaded,
+            "sections_parsed": self.sections_parsed,
+            "chunks_produced": self.chunks_produced,
+            "chunks_skipped": self.chunks_skipped,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_inserted": self.chunks_inserted,
+            "stage_timings": {k: round(v, 3) for k, v in self.stage_timings.items()},
+        }
+
+
+def iter_document_chunks(
+    sections: Iterable[str],
+    splitter: TextSplitter,
+    *,
+    separator: str = "",
+    progress: Optional[IngestProgress] = None,
+) -> Iterator[str]:
+    """
+    把按页/按块产出的 section 流切成 chunk 流
+    每个 section 切分后保留最后一个 chunk 与下一个 section 拼接再切，
+    这样跨页的句子不会被硬切断，且内存里最多只有一页 + 一个 chunk
+    """
+    carry = ""
+    for section in sections:
+        if progress is not None:
+            progress.sections_parsed += 1
+
+        buffer = f"{carry}{separator}{section}" if carry else section
+        pieces = splitter.split_text(buffer)
+        if not pieces:
+            continue
+
+        yield from pieces[:-1]
+        carry = pieces[-1]
+
+    if carry:
+        yield carry
+
+
+def next_batch(chunks: Iterator[str], size: int) -> List[str]:
+    """
+    从 chunk 流中取下一批（在线程中调用，PDF 解析就发生在这里）
+    """
+    return list(islice(chunks, size))
@@ -0,0 +1,316 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.core.logger import logger
+
+# BM25 参数（Lucene / Elasticsearch 默认值）
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_CJK_CHAR = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[{_CJK_CHAR}]+|[a-z0-9]+(?:[._\-][a-z0-9]+)*")
+_CJK_RUN = re.compile(rf"^[{_CJK_CHAR}]+$")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中英混合分词
+    - 中文连续片段切成重叠二元组（单字片段保留单字），与 Lucene CJKAnalyzer 思路一致，不依赖词典
+    - 英文 / 数字按词切分并小写，保留 "v1.2"、"iphone-15" 这类带连接符的整体
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    for match in _TOKEN_RE.finditer(text):
+        piece = match.group()
+        if _CJK_RUN.match(piece):
+            if len(piece) == 1:
+                tokens.append(piece)
+            else:
+                tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        else:
+            tokens.append(piece)
+    return tokens
+
+
+class _EchoIndex:
+    """
+    单个 echo 的内存倒排索引：term -> (文档下标数组, 词频数组)
+    """
+
+    def __init__(self, version: int, rows: Sequence[Tuple[int, str, str]]):
+        self.version = version
+        self.pks: List[int] = []
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        lengths: List[int] = []
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+
+        for doc_index, (pk, text, metadata) in enumerate(rows):
+            self.pks.append(pk)
+            self.texts.append(text)
+            self.metadatas.append(json.loads(metadata))
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                doc_ids, tfs = postings.setdefault(term, ([], []))
+                doc_ids.append(doc_index)
+                tfs.append(tf)
+
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.avg_length = float(self.lengths.mean()) if lengths else 0.0
+        self.postings = {
+            term: (np.asarray(doc_ids, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for term, (doc_ids, tfs) in postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        n_docs = len(self.pks)
+        if not n_docs:
+            return []
+        scores = np.zeros(n_docs, dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / max(self.avg_length, 1e-6))
+        for term, query_tf in Counter(tokenize(query)).items():
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            doc_ids, tfs = posting
+            idf = math.log(1 + (n_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            scores[doc_ids] += query_tf * idf * tfs * (BM25_K1 + 1) / (tfs + norm[doc_ids])
+
+        matched = np.flatnonzero(scores > 0)
+        if not len(matched):
+            return []
+        top = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+class KeywordIndex:
+    """
+    知识 chunk 的 BM25 关键词索引，补足向量检索对人名、数字、生僻词的召回
+    - chunk 原文与 metadata 持久化在 SQLite（WAL，同机 worker 共享），以 Milvus 主键为 id
+    - 每个 echo 一个版本号，写入/删除时 +1；检索时版本变化才重建该 echo 的内存倒排索引
+    - 内存中按 LRU 只保留最近使用的 max_echoes 个 echo
+    """
+
+    def __init__(self, *, db_path: Optional[str], max_echoes: int):
+        self.max_echoes = max_echoes
+        self._lock = threading.Lock()
+        self._conn = self._open_db(db_path or ":memory:")
+        self._indexes: "OrderedDict[str, _EchoIndex]" = OrderedDict()
+
+        self.queries = 0
+        self.rebuilds = 0
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        if db_path != ":memory:":
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                pk INTEGER PRIMARY KEY,
+                echo_id TEXT NOT NULL,
+                knowledge_id INTEGER,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_echo ON chunks (echo_id);
+            CREATE INDEX IF NOT EXISTS idx_chunks_knowledge ON chunks (knowledge_id);
+
+            CREATE TABLE IF NOT EXISTS echo_versions (
+                echo_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                backfilled INTEGER NOT NULL DEFAULT 0
+            );
+            """
+        )
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection, echo_ids: Iterable[str]) -> None:
+        conn.executemany(
+            "INSERT INTO echo_versions (echo_id, version) VALUES (?, 1)"
+            " ON CONFLICT (echo_id) DO UPDATE SET version = version + 1",
+            [(echo_id,) for echo_id in set(echo_ids)],
+        )
+
+    # --------------------------------------------------------------------------
+    def add(self, pks: Sequence[int], texts: Sequence[str], metadatas: Sequence[dict]) -> None:
+        """
+        与 Milvus 写入同步调用（同步，需在线程中调用）
+        """
+        if not pks:
+            return
+        rows = [
+            (
+                int(pk),
+                metadata["echo_id"],
+                metadata.get("knowledge_id"),
+                text,
+                json.dumps({**metadata, "pk": int(pk)}, ensure_ascii=False),
+            )
+            for pk, text, metadata in zip(pks, texts, metadatas)
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (pk, echo_id, knowledge_id, text, metadata)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._bump(self._conn, (row[1] for row in rows))
+
+    def remove_pks(self, pks: Sequence[int]) -> None:
+        if not pks:
+            return
+        keys = [int(pk) for pk in pks]
+        with self._lock:
+            with self._conn:
+                echo_ids = set()
+                for i in range(0, len(keys), 500):
+                    part = keys[i:i + 500]
+                    marks = ",".join("?" * len(part))
+                    echo_ids.update(row[0] for row in self._conn.execute(
+                        f"SELECT DISTINCT echo_id FROM chunks WHERE pk IN ({marks})", part
+                    ))
+                    self._conn.execute(f"DELETE FROM chunks WHERE pk IN ({marks})", part)
+                self._bump(self._conn, echo_ids)
+
+    def remove_knowledge(self, knowledge_ids: Sequence[int], echo_id: Optional[str] = None) -> None:
+        """
+        echo_id 为空时删除这些 knowledge_id 在所有 echo 下的 chunk（对应 batch_delete）
+        """
+        if not knowledge_ids:
+            return
+        ids = [int(k) for k in knowledge_ids]
+        marks = ",".join("?" * len(ids))
+        where = f"knowledge_id IN ({marks})"
+        params: list = list(ids)
+        if echo_id is not None:
+            where += " AND echo_id = ?"
+            params.append(echo_id)
+        with self._lock:
+            with self._conn:
+                echo_ids = [row[0] for row in self._conn.execute(
+                    f"SELECT DISTINCT echo_id FROM chunks WHERE {where}", params
+                )]
+                self._conn.execute(f"DELETE FROM chunks WHERE {where}", params)
+                self._bump(self._conn, echo_ids)
+
+    # --------------------------------------------------------------------------
+    def claim_backfill(self, echo_id: str) -> bool:
+        """
+        该 echo 是否需要从 Milvus 回填（功能上线前已训练的知识）；只有一个调用方会拿到 True
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO echo_versions (echo_id, version) VALUES (?, 0)", (echo_id,)
+                )
+                cursor = self._conn.execute(
+                    "UPDATE echo_versions SET backfilled = 1 WHERE echo_id = ? AND backfilled = 0",
+                    (echo_id,),
+                )
+        return cursor.rowcount == 1
+
+    def release_backfill(self, echo_id: str) -> None:
+        # 回填失败时撤销标记，下次检索再试
+        with self._lock:
+            with self._conn:
+                self._conn.execute("UPDATE echo_versions SET backfilled = 0 WHERE echo_id = ?", (echo_id,))
+
+    def reset(self) -> None:
+        """
+        清空索引（Milvus 主键整体变化后调用，如集合迁移），各 echo 在下次检索时重新回填
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM chunks")
+                self._conn.execute("UPDATE echo_versions SET version = version + 1, backfilled = 0")
+            self._indexes.clear()
+
+    def loaded_version(self, echo_id: str) -> Optional[int]:
+        """
+        内存中该 echo 倒排索引的版本（即上次检索时读到的版本，不访问 SQLite）；未加载时为 None
+        """
+        index = self._indexes.get(echo_id)
+        return index.version if index is not None else None
+
+    def _echo_index(self, echo_id: str) -> _EchoIndex:
+        """
+        调用方持有锁
+        """
+        row = self._conn.execute(
+            "SELECT version FROM echo_versions WHERE echo_id = ?", (echo_id,)
+        ).fetchone()
+        version = row[0] if row else 0
+        index = self._indexes.get(echo_id)
+        if index is None or index.version != version:
+            rows = self._conn.execute(
+                "SELECT pk, text, metadata FROM chunks WHERE echo_id = ? ORDER BY pk", (echo_id,)
+            ).fetchall()
+            index = _EchoIndex(version, rows)
+            self.rebuilds += 1
+            logger.info("Keyword index rebuilt: echo_id={}, chunks={}, version={}", echo_id, len(rows), version)
+        self._indexes[echo_id] = index
+        self._indexes.move_to_end(echo_id)
+        while len(self._indexes) > self.max_echoes:
+            self._indexes.popitem(last=False)
+        return index
+
+    def search(self, query: str, echo_id: str, k: int) -> List[Document]:
+        self.queries += 1
+        with self._lock:
+            index = self._echo_index(echo_id)
+        results = []
+        for doc_index, _ in index.search(query, k):
+            metadata = dict(index.metadatas[doc_index])
+            results.append(Document(page_content=index.texts[doc_index], metadata=metadata))
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        return {
+            "chunks": count,
+            "echoes_loaded": len(self._indexes),
+            "queries": self.queries,
+            "rebuilds": self.rebuilds,
+        }
+
+
+def reciprocal_rank_fusion(
+    result_lists: Sequence[Sequence[Document]], *, k: int, limit: int, with_scores: bool = False
+) -> list:
+    """
+    RRF 融合：score = Σ 1 / (k + rank)，只看排名不看分数，无需对齐向量分与 BM25 分的量纲
+    以 Milvus 主键识别同一 chunk，缺主键时退化为按原文识别
+    with_scores=True 时返回 [(Document, 融合分)]
+    """
+    scores: Dict[object, float] = {}
+    docs: Dict[object, Document] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc.metadata.get("pk") or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=lambda key: scores[key], reverse=True)[:limit]
+    if with_scores:
+        return [(docs[key], scores[key]) for key in ranked]
+    return [docs[key] for key in ranked]
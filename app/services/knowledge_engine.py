@@ -1,17 +1,29 @@
 import dashscope
 import hashlib
-import time
 from http import HTTPStatus
-from typing import List
-import functools
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+import asyncio
 import anyio
+import httpx
+import numpy as np
+from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
-from langchain_community.vectorstores import Milvus
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from pymilvus import connections, utility, Collection
 
 from app.core.config import settings
+from app.core.executors import indexing_pool, local_store_pool, parsing_pool, retrieval_pool
 from app.core.logger import logger
+from app.core.rate_limit import Priority, embedding_limiter, with_priority
+from app.services.embedding_batcher import QueryEmbeddingBatcher
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from app.services.dedupe_index import DedupeIndex
+from app.services.embedding_executor import EmbeddingExecutor, TransientEmbeddingError
+from app.services.ingest_pipeline import IngestProgress, next_batch
+from app.services.keyword_index import KeywordIndex, reciprocal_rank_fusion
+from app.services.knowledge_registry import KnowledgeRegistry
+from app.services.mmr import maximal_marginal_relevance
+from app.services.retrieval_cache import RetrievalCache
+from app.services.vector_store import PRIMARY_FIELD, TEXT_FIELD, create_vector_store
 from app.schemas.knowledge import (
     KnowledgeIngestRequest,
     KnowledgeIngestResponse,
@@ -20,65 +32,124 @@ from app.schemas.knowledge import (
 )
 
 # ==============================================================================
-# Milvus Vector Config
+# Knowledge Config
 # ==============================================================================
-COLLECTION_NAME = "frequency_knowledge"
-DEDUPE_PREFIX = "frequency:ingest:dedupe"
 DEDUPE_TTL_SECONDS = 60 * 60 * 24 * 7
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+CHUNK_SEPARATORS = ["\n\n", "\n", "。", "！", "？", " ", ""]
 
 # ==============================================================================
-# Milvus Connection Check
+# DashScope Embedding
 # ==============================================================================
-def check_milvus_connection() -> None:
-    try:
-        connections.connect(
-            alias="default",
-            host=settings.MILVUS_HOST,
-            port=settings.MILVUS_PORT,
-        )
-        utility.list_collections()
-    except Exception as e:
-        raise RuntimeError(
-            "\n❌ Milvus NOT available.\n"
-            "Please start Milvus:\n\n"
-            "docker run -d -p 19530:19530 -p 9091:9091 milvusdb/milvus:v2.4.0\n\n"
-            f"Original error: {e}"
-        )
+RETRYABLE_STATUS_CODES = {
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+}
 
 
-# ==============================================================================
-# DashScope Embedding
-# ==============================================================================
 class FrequencyDashScopeEmbeddings(Embeddings):
     def __init__(self, api_key: str, model: str = "text-embedding-v1"):
         dashscope.api_key = api_key
+        self.api_key = api_key
         self.model = model
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        resp = dashscope.TextEmbedding.call(
-            model=self.model,
-            input=texts,
+        # 异步路径（对话 query、训练）直接走 httpx，同步接口仍用 SDK
+        self._http: Optional[httpx.AsyncClient] = None
+        self.executor = EmbeddingExecutor(
+            self._embed_batch,
+            aembed_batch=self._aembed_batch if settings.EMBEDDING_NATIVE_ASYNC else None,
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+            max_retries=settings.EMBEDDING_MAX_RETRIES,
+            retry_backoff=settings.EMBEDDING_RETRY_BACKOFF,
+            limiter=embedding_limiter,
         )
-        if resp.status_code != HTTPStatus.OK:
-            raise RuntimeError(f"{resp.code} - {resp.message}")
+        self.query_batcher = None
+        if settings.EMBEDDING_QUERY_BATCHING:
+            self.query_batcher = QueryEmbeddingBatcher(
+                self.executor.arun,
+                window=settings.EMBEDDING_QUERY_BATCH_WINDOW_MS / 1000,
+                max_batch=min(settings.EMBEDDING_QUERY_BATCH_MAX, settings.EMBEDDING_BATCH_SIZE),
+            )
 
+    @staticmethod
+    def _parse_embeddings(output: dict) -> List[List[float]]:
         return [
             item["embedding"]
             for item in sorted(
-                resp.output["embeddings"],
+                output["embeddings"],
                 key=lambda x: x["text_index"],
             )
         ]
 
-    def embed_query(self, text: str) -> List[float]:
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        单次 DashScope 调用（texts 长度不超过 batch 上限）
+        """
         resp = dashscope.TextEmbedding.call(
             model=self.model,
-            input=[text],
+            input=texts,
         )
         if resp.status_code != HTTPStatus.OK:
+            if resp.status_code in RETRYABLE_STATUS_CODES:
+                raise TransientEmbeddingError(f"{resp.code} - {resp.message}")
             raise RuntimeError(f"{resp.code} - {resp.message}")
 
-        return resp.output["embeddings"][0]["embedding"]
+        return self._parse_embeddings(resp.output)
+
+    def _get_http(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.EMBEDDING_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.EMBEDDING_HTTP_MAX_CONNECTIONS,
+                ),
+                timeout=httpx.Timeout(settings.EMBEDDING_HTTP_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT),
+            )
+        return self._http
+
+    async def _aembed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        与 _embed_batch 相同的调用，经 DashScope HTTP 接口原生异步发出，不占线程
+        """
+        resp = await self._get_http().post(
+            f"{dashscope.base_http_api_url.rstrip('/')}/services/embeddings/text-embedding/text-embedding",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json={"model": self.model, "input": {"texts": texts}, "parameters": {}},
+        )
+        try:
+            body = resp.json()
+        except ValueError:
+            body = {}
+        if resp.status_code != HTTPStatus.OK:
+            message = f"{body.get('code')} - {body.get('message') or resp.text[:200]}"
+            if resp.status_code in RETRYABLE_STATUS_CODES:
+                raise TransientEmbeddingError(message)
+            raise RuntimeError(message)
+
+        return self._parse_embeddings(body["output"])
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            http, self._http = self._http, None
+            await http.aclose()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.executor.run(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.executor.arun(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.executor.run([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.query_batcher is not None:
+            return await self.query_batcher.embed(text)
+        return (await self.executor.arun([text]))[0]
 
 
 # ==============================================================================
@@ -88,117 +159,554 @@ def _content_hash(content: str) -> str:
     return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
 
-def _dedupe_key(echo_id: str, content_hash: str) -> str:
-    return f"{DEDUPE_PREFIX}:{echo_id}:{content_hash}"
+def _duplicate_response(echo_id: str) -> KnowledgeIngestResponse:
+    logger.info("Duplicate ingest skipped for echo_id={}", echo_id)
+    return KnowledgeIngestResponse(
+        status="warning",
+        chunks_count=0,
+        message="Duplicate content skipped",
+    )
 
 
 class KnowledgeEngine:
     def __init__(self):
         self.embeddings = FrequencyDashScopeEmbeddings(
-            api_key=settings.OPENAI_API_KEY
+            api_key=settings.OPENAI_API_KEY,
+            model=settings.EMBEDDING_MODEL,
         )
+        # 缓存层包装之前的原始客户端，关闭连接 / 读取微批统计用
+        self._dashscope = self.embeddings
+        self.query_batcher = self.embeddings.query_batcher
+        self.embedding_cache = None
+        if settings.EMBEDDING_CACHE_ENABLED:
+            self.embedding_cache = EmbeddingCache(
+                memory_size=settings.EMBEDDING_CACHE_MEMORY_SIZE,
+                db_path=settings.EMBEDDING_CACHE_PATH or None,
+            )
+            self.embeddings = CachedEmbeddings(
+                self.embeddings,
+                self.embedding_cache,
+                model=settings.EMBEDDING_MODEL,
+            )
 
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=100,
-            separators=["\n\n", "\n", "。", "！", "？", " ", ""],
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            separators=CHUNK_SEPARATORS,
+        )
+
+        self.retrieval_cache = None
+        if settings.RETRIEVAL_CACHE_ENABLED:
+            self.retrieval_cache = RetrievalCache(
+                max_entries=settings.RETRIEVAL_CACHE_SIZE,
+                ttl_seconds=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+            )
+
+        self.dedupe_index = DedupeIndex(
+            db_path=settings.DEDUPE_INDEX_PATH or None,
+            ttl_seconds=DEDUPE_TTL_SECONDS,
         )
 
-        self.vector_store = None
-        self._dedupe_cache = {}
+        self.keyword_index = None
+        if settings.HYBRID_SEARCH_ENABLED:
+            self.keyword_index = KeywordIndex(
+                db_path=settings.KEYWORD_INDEX_PATH or None,
+                max_echoes=settings.KEYWORD_INDEX_MAX_ECHOES,
+            )
+        # echo_id -> 确认已回填时内存索引的版本；版本变化（含其它进程 reset）后重新核对 SQLite 中的回填标记
+        self._keyword_backfilled: Dict[str, Optional[int]] = {}
+        self._backfill_tasks: Dict[str, asyncio.Task] = {}
+
+        self.knowledge_registry = KnowledgeRegistry(db_path=settings.KNOWLEDGE_REGISTRY_PATH or None)
+        self._registry_tasks: Dict[str, asyncio.Task] = {}
+
+        # 向量存储后端由 VECTOR_STORE_BACKEND 选择（milvus / numpy），首次使用时才连接
+        self.vector_store = create_vector_store(self.embeddings)
 
     def _ensure_vector_store(self) -> None:
-        if self.vector_store is not None:
-            return
-        # ⚠️ 注意：uvicorn --reload 下这里会执行两次
-        check_milvus_connection()
-        self.vector_store = Milvus(
-            embedding_function=self.embeddings,
-            collection_name=COLLECTION_NAME,
-            connection_args={
-                "host": settings.MILVUS_HOST,
-                "port": settings.MILVUS_PORT,
-            },
-            auto_id=True,  # <--- 【关键修改】开启自动 ID 生成
-            # drop_old=True, # ⚠️ 如果重启后报错 "Schema not match" (Schema不匹配)，请临时取消此行注释，运行一次以重建集合，然后再注释掉
+        self.vector_store.ensure_ready()
+
+    async def prepare(self) -> None:
+        """
+        启动时连接向量存储（Milvus 建好集合与索引并 load()），避免首个请求承担加载耗时
+        失败只记录日志，首次使用时会再尝试
+        """
+        try:
+            await indexing_pool.run(self._ensure_vector_store)
+        except Exception as e:
+            logger.warning("Vector store not ready at startup: {!r}", e)
+
+    def _insert_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[dict],
+    ) -> List[int]:
+        """
+        写入已向量化的 chunk（同步，需在线程中调用）
+        """
+        pks = self.vector_store.insert(texts, embeddings, metadatas)
+        if self.keyword_index is not None:
+            self.keyword_index.add(pks, texts, metadatas)
+        return pks
+
+    async def _claim_dedupe(
+        self, echo_id: str, content_hash: str, knowledge_id: Optional[int] = None
+    ) -> bool:
+        """
+        登记文档指纹，已存在（且未过期）时返回 False
+        """
+        return await local_store_pool.run(
+            self.dedupe_index.claim_document, echo_id, content_hash, knowledge_id
+        )
+
+    async def _release_dedupe(self, echo_id: str, content_hash: str) -> None:
+        # 训练失败时撤销登记，否则 7 天内无法重试
+        await local_store_pool.run(self.dedupe_index.release_document, echo_id, content_hash)
+
+    async def _filter_new_chunks(
+        self, echo_id: str, texts: List[str], knowledge_id: Optional[int] = None
+    ) -> tuple[List[str], List[str], List[str]]:
+        """
+        chunk 级去重：返回 (需要写入的 chunk, 本次新登记的 chunk 指纹, 全部 chunk 指纹)
+        同一 echo 下其它文档已写入过的 chunk 直接跳过，不再向量化，只登记本知识对它的引用
+        """
+        if not settings.CHUNK_DEDUPE_ENABLED:
+            return texts, [], []
+        hashes = [_content_hash(text) for text in texts]
+        claimed = await local_store_pool.run(
+            self.dedupe_index.claim_chunks, echo_id, hashes, knowledge_id
+        )
+        fresh = [text for text, is_new in zip(texts, claimed) if is_new]
+        fresh_hashes = [h for h, is_new in zip(hashes, claimed) if is_new]
+        return fresh, fresh_hashes, hashes
+
+    async def _release_chunks(
+        self,
+        echo_id: str,
+        chunk_hashes: List[str],
+        knowledge_id: Optional[int] = None,
+        referenced: Optional[List[str]] = None,
+        inserted_pks: Optional[List[int]] = None,
+    ) -> None:
+        """
+        训练失败时撤销 chunk 登记并回滚本次写入的向量
+        并发训练同一内容的其它知识已引用的 chunk 由 release_claims 在同一事务里判定，向量先改挂到对方名下再删除
+        """
+        survivors: Dict[str, int] = {}
+        if chunk_hashes or (knowledge_id is not None and referenced):
+            survivors = await local_store_pool.run(
+                self.dedupe_index.release_claims, echo_id, knowledge_id, chunk_hashes, referenced or []
+            )
+        owners = {(echo_id, chunk_hash): owner for chunk_hash, owner in survivors.items()}
+        await self._rollback_inserted(echo_id, inserted_pks or [], knowledge_id, owners)
+
+    def _delete_by_pks(self, pks: List[int]) -> None:
+        self.vector_store.delete_pks(pks)
+        if self.keyword_index is not None:
+            self.keyword_index.remove_pks(pks)
+
+    def _query_chunk_pks(self, echo_id: str, knowledge_id: int) -> Dict[str, List[int]]:
+        """
+        读取某条知识已有的 chunk 指纹：content_hash -> 主键列表（同一 chunk 可能出现多次）
+        """
+        existing: Dict[str, List[int]] = {}
+        for rows in self.vector_store.iter_rows(echo_id, ["content_hash"], knowledge_id=knowledge_id):
+            for row in rows:
+                existing.setdefault(row.get("content_hash"), []).append(row[PRIMARY_FIELD])
+        return existing
+
+    def _rehome_shared_chunks(
+        self, knowledge_ids: List[int], echo_id: Optional[str] = None, pks: Optional[Set[int]] = None
+    ) -> int:
+        """
+        跨文档共享的 chunk 只以第一篇文档的 knowledge_id 写入了一份向量。删除这些知识的向量前，
+        把仍被其它知识引用的 chunk 复制一份改挂到存活的引用方名下，之后按 knowledge_id 删除不会连带删掉
+        pks 不为空时只处理其中的向量（upsert 删除旧 chunk 时）；同步，需在线程中调用
+        """
+        return self._rehome_chunks(self.dedupe_index.shared_chunk_owners(knowledge_ids, echo_id), knowledge_ids, pks)
+
+    def _rehome_chunks(
+        self,
+        owners: Dict[Tuple[str, str], int],
+        knowledge_ids: List[Optional[int]],
+        pks: Optional[Set[int]] = None,
+    ) -> int:
+        """
+        把 knowledge_ids 名下、(echo_id, chunk_hash) 在 owners 中的向量复制一份，knowledge_id 改为 owners 中的引用方
+        """
+        if not owners:
+            return 0
+
+        picked: Dict[Tuple[str, str], dict] = {}
+        for echo in {echo for echo, _ in owners}:
+            for knowledge_id in knowledge_ids:
+                for rows in self.vector_store.iter_rows(echo, knowledge_id=knowledge_id):
+                    for row in rows:
+                        key = (echo, row.get("content_hash"))
+                        if key in owners and key not in picked and (pks is None or row[PRIMARY_FIELD] in pks):
+                            picked[key] = row
+        if not picked:
+            return 0
+
+        vectors = self.vector_store.fetch_vectors([row[PRIMARY_FIELD] for row in picked.values()])
+        texts, embeddings, metadatas = [], [], []
+        for key, row in picked.items():
+            vector = vectors.get(row[PRIMARY_FIELD])
+            if vector is None:
+                continue
+            metadata = {k: v for k, v in row.items() if k not in (PRIMARY_FIELD, TEXT_FIELD)}
+            # 正文与向量相同，来源等其它字段沿用原文档的
+            metadata["knowledge_id"] = owners[key]
+            texts.append(row[TEXT_FIELD])
+            embeddings.append(vector.tolist())
+            metadatas.append(metadata)
+        if texts:
+            self._insert_embeddings(texts, embeddings, metadatas)
+            logger.info("Re-homed {} shared chunks of knowledge_ids={}", len(texts), knowledge_ids)
+        return len(texts)
+
+    def _delete_knowledge_pks(self, knowledge_id: int, echo_id: str, pks: List[int]) -> None:
+        self._rehome_shared_chunks([knowledge_id], echo_id, set(pks))
+        self._delete_by_pks(pks)
+
+    async def _embed_and_insert(
+        self, texts: List[str], metadata: Dict[str, Any], progress: IngestProgress
+    ) -> List[int]:
+        # content_hash 按 chunk 记录，upsert 时据此与新版本做差异对比
+        metadatas = [{**metadata, "content_hash": _content_hash(text)} for text in texts]
+
+        with progress.timed("embed"):
+            embeddings = await self.embeddings.aembed_documents(texts)
+        progress.chunks_embedded += len(texts)
+
+        with progress.timed("insert"):
+            pks = await indexing_pool.run(
+                self._insert_embeddings, texts, embeddings, metadatas
+            )
+        progress.chunks_inserted += len(texts)
+        return pks
+
+    async def _run_batches(
+        self,
+        chunks: Iterator[str],
+        progress: IngestProgress,
+        handle_batch: Callable[[List[str]], Awaitable[None]],
+    ) -> None:
+        """
+        解析（生产者）与向量化/写入（消费者）之间用有界队列衔接，内存占用与文档大小无关
+        """
+        batch_size = settings.INGEST_BATCH_SIZE
+        send_stream, receive_stream = anyio.create_memory_object_stream(
+            settings.INGEST_QUEUE_DEPTH
         )
 
+        async def produce():
+            async with send_stream:
+                while True:
+                    with progress.timed("parse"):
+                        batch = await parsing_pool.run(next_batch, chunks, batch_size)
+                    if not batch:
+                        return
+                    progress.chunks_produced += len(batch)
+                    await send_stream.send(batch)
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(produce)
+            async with receive_stream:
+                async for batch in receive_stream:
+                    await handle_batch(batch)
+                    progress.report()
+
     # --------------------------------------------------------------------------
+    @with_priority(Priority.INGEST)
     async def ingest(
-        self, request: KnowledgeIngestRequest
+        self, request: KnowledgeIngestRequest, content_hash: Optional[str] = None
     ) -> KnowledgeIngestResponse:
-        self._ensure_vector_store()
+        """
+        content_hash 为空时按正文计算；从文件训练时传入原始文件的 sha256（与流式训练一致）
+        """
+        await indexing_pool.run(self._ensure_vector_store)
         content = request.content.strip()
         if not content:
             raise ValueError("content must not be blank")
 
-        now = time.time()
-        content_hash = _content_hash(content)
-        dedupe_key = _dedupe_key(request.echo_id, content_hash)
-        expired_keys = [
-            key for key, expires_at in self._dedupe_cache.items()
-            if expires_at <= now
-        ]
-        for key in expired_keys:
-            self._dedupe_cache.pop(key, None)
-        if dedupe_key in self._dedupe_cache:
-            logger.info("Duplicate ingest skipped for echo_id=%s", request.echo_id)
-            return KnowledgeIngestResponse(
-                status="warning",
-                chunks_count=0,
-                message="Duplicate content skipped",
+        content_hash = content_hash or _content_hash(content)
+        knowledge_id = (request.metadata or {}).get("knowledge_id")
+        base_metadata = {
+            "user_id": request.user_id,
+            "echo_id": request.echo_id,
+            "source": request.source_name,
+            **(request.metadata or {}),
+        }
+
+        if request.upsert:
+            return await self.upsert_stream(
+                iter(self.text_splitter.split_text(content)),
+                user_id=request.user_id,
+                echo_id=request.echo_id,
+                knowledge_id=knowledge_id,
+                source_name=request.source_name,
+                content_hash=content_hash,
+                metadata=request.metadata,
             )
-        self._dedupe_cache[dedupe_key] = now + DEDUPE_TTL_SECONDS
-
-        documents = self.text_splitter.create_documents(
-            texts=[content],
-            metadatas=[
-                {
-                    "user_id": request.user_id,
-                    "echo_id": request.echo_id,
-                    "source": request.source_name,
-                    "content_hash": content_hash,
-                    **(request.metadata or {}),
-                }
-            ],
-        )
-
-        if not documents:
+
+        if not await self._claim_dedupe(request.echo_id, content_hash, knowledge_id):
+            return _duplicate_response(request.echo_id)
+
+        texts = self.text_splitter.split_text(content)
+        if not texts:
+            await self._release_dedupe(request.echo_id, content_hash)
             raise ValueError("No content to ingest")
 
-        logger.info(
-            "Ingesting knowledge: echo_id={}, user_id={}, chunks={}",
-            request.echo_id,
-            request.user_id,
-            len(documents),
+        chunk_hashes: List[str] = []
+        referenced: List[str] = []
+        inserted_pks: List[int] = []
+        total = len(texts)
+
+        # 向量化走异步执行器（分 batch 并发 + 重试），只有向量写入留在线程里
+        try:
+            texts, chunk_hashes, referenced = await self._filter_new_chunks(request.echo_id, texts, knowledge_id)
+            skipped = total - len(texts)
+            logger.info(
+                "Ingesting knowledge: echo_id={}, user_id={}, chunks={}, skipped={}",
+                request.echo_id,
+                request.user_id,
+                len(texts),
+                skipped,
+            )
+            if not texts:
+                return _duplicate_response(request.echo_id)
+
+            inserted_pks.extend(
+                await self._embed_and_insert(texts, base_metadata, IngestProgress(label=request.source_name))
+            )
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self._release_dedupe(request.echo_id, content_hash)
+                await self._release_chunks(request.echo_id, chunk_hashes, knowledge_id, referenced, inserted_pks)
+            raise
+        self._invalidate_retrieval(request.echo_id)
+        await self._register_document(request.echo_id, knowledge_id, content_hash)
+
+        return KnowledgeIngestResponse(
+            status="success",
+            chunks_count=len(texts),
+            message=f"Ingested {len(texts)} chunks" + (f", skipped {skipped} duplicates" if skipped else ""),
         )
-        await anyio.to_thread.run_sync(self.vector_store.add_documents, documents)
 
+    async def ingest_stream(
+        self,
+        chunks: Iterator[str],
+        *,
+        user_id: str,
+        echo_id: str,
+        source_name: str,
+        content_hash: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        progress: Optional[IngestProgress] = None,
+    ) -> KnowledgeIngestResponse:
+        """
+        流式训练：chunk 流 -> 分批向量化 -> 增量写入向量存储
+        中途失败或被取消时回滚已写入的向量
+        """
+        await indexing_pool.run(self._ensure_vector_store)
+        progress = progress or IngestProgress(label=source_name)
+
+        knowledge_id = (metadata or {}).get("knowledge_id")
+        if not await self._claim_dedupe(echo_id, content_hash, knowledge_id):
+            return _duplicate_response(echo_id)
+
+        base_metadata = {
+            "user_id": user_id,
+            "echo_id": echo_id,
+            "source": source_name,
+            **(metadata or {}),
+        }
+        inserted_pks: List[int] = []
+        claimed_chunks: List[str] = []
+        referenced: List[str] = []
+
+        async def handle_batch(batch: List[str]) -> None:
+            produced = len(batch)
+            batch, batch_hashes, batch_referenced = await self._filter_new_chunks(echo_id, batch, knowledge_id)
+            claimed_chunks.extend(batch_hashes)
+            referenced.extend(batch_referenced)
+            progress.chunks_skipped += produced - len(batch)
+            if batch:
+                inserted_pks.extend(await self._embed_and_insert(batch, base_metadata, progress))
+
+        progress.set_stage("ingesting")
+        try:
+            await self._run_batches(chunks, progress, handle_batch)
+            if not progress.chunks_produced:
+                raise ValueError("No content to ingest")
+        except BaseException:
+            progress.set_stage("failed")
+            with anyio.CancelScope(shield=True):
+                await self._release_dedupe(echo_id, content_hash)
+                await self._release_chunks(echo_id, claimed_chunks, knowledge_id, referenced, inserted_pks)
+            raise
+
+        if not inserted_pks:
+            # 所有 chunk 都已存在于该 echo 的其它文档中
+            progress.set_stage("done")
+            return _duplicate_response(echo_id)
+
+        self._invalidate_retrieval(echo_id)
+        await self._register_document(echo_id, knowledge_id, content_hash)
+        progress.set_stage("done")
+
+        skipped = progress.chunks_skipped
         return KnowledgeIngestResponse(
             status="success",
-            chunks_count=len(documents),
-            message=f"Ingested {len(documents)} chunks",
+            chunks_count=len(inserted_pks),
+            message=f"Ingested {len(inserted_pks)} chunks" + (f", skipped {skipped} duplicates" if skipped else ""),
         )
 
-    async def delete(self, request: KnowledgeDeleteRequest):
-        self._ensure_vector_store()
+    async def upsert_stream(
+        self,
+        chunks: Iterator[str],
+        *,
+        user_id: str,
+        echo_id: str,
+        knowledge_id: Optional[int],
+        source_name: str,
+        content_hash: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        progress: Optional[IngestProgress] = None,
+    ) -> KnowledgeIngestResponse:
+        """
+        增量更新某条知识：按 chunk 指纹与向量存储中已有版本对比，
+        只向量化/写入新增的 chunk，最后删除新版本中已不存在的 chunk
+        先写后删，更新过程中检索不会出现空窗；失败时只回滚本次新增的向量
+        """
+        if knowledge_id is None:
+            raise ValueError("upsert requires knowledge_id")
+
+        await indexing_pool.run(self._ensure_vector_store)
+        progress = progress or IngestProgress(label=source_name)
+
+        progress.set_stage("diffing")
+        existing = await indexing_pool.run(self._query_chunk_pks, echo_id, knowledge_id)
+        # 本知识引用、但向量写在其它知识名下的共享 chunk：新版本仍包含时无需重新向量化
+        shared = await local_store_pool.run(self.dedupe_index.owned_chunks, echo_id, knowledge_id)
+        shared.difference_update(existing)
+
+        base_metadata = {
+            "user_id": user_id,
+            "echo_id": echo_id,
+            "source": source_name,
+            **(metadata or {}),
+        }
+        inserted_pks: List[int] = []
+        chunk_hashes: List[str] = []
+        kept = 0
+
+        async def handle_batch(batch: List[str]) -> None:
+            nonlocal kept
+            added = []
+            for text in batch:
+                chunk_hash = _content_hash(text)
+                chunk_hashes.append(chunk_hash)
+                pks = existing.get(chunk_hash)
+                if pks:
+                    pks.pop()
+                    kept += 1
+                elif chunk_hash in shared:
+                    kept += 1
+                else:
+                    added.append(text)
+            progress.chunks_skipped += len(batch) - len(added)
+            if added:
+                inserted_pks.extend(await self._embed_and_insert(added, base_metadata, progress))
+
+        progress.set_stage("ingesting")
+        try:
+            await self._run_batches(chunks, progress, handle_batch)
+            if not progress.chunks_produced:
+                raise ValueError("No content to ingest")
+        except BaseException:
+            progress.set_stage("failed")
+            with anyio.CancelScope(shield=True):
+                await self._rollback_inserted(echo_id, inserted_pks)
+            raise
+
+        removed_pks = [pk for pks in existing.values() for pk in pks]
+        if removed_pks:
+            with progress.timed("delete"):
+                await indexing_pool.run(self._delete_knowledge_pks, knowledge_id, echo_id, removed_pks)
+
+        # 去重索引以新版本为准
+        await local_store_pool.run(self._reregister_knowledge, echo_id, knowledge_id, content_hash, chunk_hashes)
+        if inserted_pks or removed_pks:
+            self._invalidate_retrieval(echo_id)
+        await self._register_document(echo_id, knowledge_id, content_hash)
+        progress.set_stage("done")
 
-        # [修改点]: 直接使用 knowledge_id 和 echo_id 字段
-        # 注意：knowledge_id 是 int 类型，不需要引号；echo_id 是 string，需要引号
-        expr = f'knowledge_id == {request.knowledge_id} and echo_id == "{request.echo_id}"'
+        logger.info(
+            "Upserted knowledge_id={}, echo_id={}: added={}, kept={}, removed={}",
+            knowledge_id, echo_id, len(inserted_pks), kept, len(removed_pks),
+        )
+        return KnowledgeIngestResponse(
+            status="success",
+            chunks_count=len(inserted_pks) + kept,
+            message=f"Added {len(inserted_pks)}, kept {kept}, removed {len(removed_pks)} chunks",
+            added=len(inserted_pks),
+            kept=kept,
+            removed=len(removed_pks),
+        )
 
-        logger.info(f"Deleting vectors with expr: {expr}")
+    def _reregister_knowledge(
+        self, echo_id: str, knowledge_id: int, content_hash: str, chunk_hashes: List[str]
+    ) -> None:
+        self.dedupe_index.forget_knowledge([knowledge_id], echo_id)
+        self.dedupe_index.claim_document(echo_id, content_hash, knowledge_id)
+        if settings.CHUNK_DEDUPE_ENABLED:
+            self.dedupe_index.claim_chunks(echo_id, chunk_hashes, knowledge_id)
+
+    async def _register_document(
+        self, echo_id: str, knowledge_id: Optional[int], content_hash: str
+    ) -> None:
+        key = KnowledgeRegistry.doc_key(knowledge_id, content_hash)
+        await local_store_pool.run(self.knowledge_registry.add, echo_id, [key])
+
+    async def _rollback_inserted(
+        self,
+        echo_id: str,
+        inserted_pks: List[int],
+        knowledge_id: Optional[int] = None,
+        owners: Optional[Dict[Tuple[str, str], int]] = None,
+    ) -> None:
+        if not inserted_pks:
+            return
+        logger.warning(
+            "Rolling back {} inserted chunks for echo_id={}", len(inserted_pks), echo_id
+        )
 
-        def _sync_delete():
-            if hasattr(self.vector_store, "col") and self.vector_store.col:
-                col = self.vector_store.col
-            else:
-                col = Collection(COLLECTION_NAME)
+        def _sync_rollback():
+            if owners:
+                self._rehome_chunks(owners, [knowledge_id], set(inserted_pks))
+            self._delete_by_pks(inserted_pks)
 
-            col.delete(expr)
+        await indexing_pool.run(_sync_rollback)
+        self._invalidate_retrieval(echo_id)
+
+    async def delete(self, request: KnowledgeDeleteRequest):
+        def _sync_delete():
+            self._ensure_vector_store()
+            self._rehome_shared_chunks([request.knowledge_id], request.echo_id)
+            self.vector_store.delete_knowledge([request.knowledge_id], request.echo_id)
+            if self.keyword_index is not None:
+                self.keyword_index.remove_knowledge([request.knowledge_id], request.echo_id)
+            self.knowledge_registry.remove_knowledge([request.knowledge_id], request.echo_id)
             return True
 
-        await anyio.to_thread.run_sync(_sync_delete)
+        await indexing_pool.run(_sync_delete)
+        await local_store_pool.run(
+            self.dedupe_index.forget_knowledge, [request.knowledge_id], request.echo_id
+        )
+        self._invalidate_retrieval(request.echo_id)
 
         return {"status": "success", "message": f"Deleted knowledge_id={request.knowledge_id}"}
 
@@ -206,46 +714,216 @@ class KnowledgeEngine:
         if not request.items:
             return {"status": "skipped", "message": "Empty list"}
 
-        self._ensure_vector_store()
-
         knowledge_ids = [item.knowledge_id for item in request.items]
-        ids_str = ", ".join(map(str, knowledge_ids))
-
-        # [修改点]: 直接使用 knowledge_id 字段
-        expr = f'knowledge_id in [{ids_str}]'
-
-        logger.info(f"Batch deleting vectors with expr: {expr}")
 
         def _sync_delete():
-            if hasattr(self.vector_store, "col") and self.vector_store.col:
-                col = self.vector_store.col
-            else:
-                col = Collection(COLLECTION_NAME)
-
-            col.delete(expr)
+            self._ensure_vector_store()
+            self._rehome_shared_chunks(knowledge_ids)
+            self.vector_store.delete_knowledge(knowledge_ids)
+            if self.keyword_index is not None:
+                self.keyword_index.remove_knowledge(knowledge_ids)
+            self.knowledge_registry.remove_knowledge(knowledge_ids)
             return True
 
-        await anyio.to_thread.run_sync(_sync_delete)
+        await indexing_pool.run(_sync_delete)
+        await local_store_pool.run(self.dedupe_index.forget_knowledge, knowledge_ids)
+        for echo_id in {item.echo_id for item in request.items}:
+            self._invalidate_retrieval(echo_id)
 
         return {"status": "success", "message": f"Deleted {len(knowledge_ids)} items"}
 
     # --------------------------------------------------------------------------
+    def _scan_knowledge_keys(self, echo_id: str) -> Set[str]:
+        """
+        从向量存储读取某 echo 已有的文档（同步，需在线程中调用）
+        """
+        keys: Set[str] = set()
+        for rows in self.vector_store.iter_rows(echo_id, ["knowledge_id"]):
+            for row in rows:
+                # 没有 knowledge_id 的旧数据只需证明“有知识”
+                keys.add(KnowledgeRegistry.doc_key(row.get("knowledge_id"), "legacy"))
+        return keys
+
+    async def knowledge_count(self, echo_id: str) -> Optional[int]:
+        """
+        echo 已训练的文档数；未知（尚未从向量存储回填）时返回 None 并在后台回填
+        """
+        count = await local_store_pool.run(self.knowledge_registry.count, echo_id)
+        if count is None and echo_id not in self._registry_tasks:
+            self._registry_tasks[echo_id] = asyncio.get_running_loop().create_task(
+                self._backfill_registry(echo_id)
+            )
+        return count
+
+    async def _backfill_registry(self, echo_id: str) -> None:
+        registry = self.knowledge_registry
+        try:
+            if not await local_store_pool.run(registry.claim_backfill, echo_id):
+                return
+            try:
+                await indexing_pool.run(self._ensure_vector_store)
+                keys = await indexing_pool.run(self._scan_knowledge_keys, echo_id)
+                await local_store_pool.run(registry.finish_backfill, echo_id, keys)
+            except BaseException:
+                with anyio.CancelScope(shield=True):
+                    await local_store_pool.run(registry.release_backfill, echo_id)
+                raise
+            logger.info("Knowledge registry backfilled: echo_id={}, documents={}", echo_id, len(keys))
+        except Exception as e:
+            logger.warning("Knowledge registry backfill failed: echo_id={}, error={!r}", echo_id, e)
+        finally:
+            self._registry_tasks.pop(echo_id, None)
+
+    def _invalidate_retrieval(self, echo_id: str) -> None:
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.invalidate_echo(echo_id)
+
+    def _backfill_keyword_index(self, echo_id: str) -> int:
+        """
+        把该 echo 在向量存储中已有的 chunk 写入关键词索引（同步，需在线程中调用）
+        """
+        total = 0
+        for rows in self.vector_store.iter_rows(echo_id):
+            pks = [row.pop(PRIMARY_FIELD) for row in rows]
+            texts = [row.pop(TEXT_FIELD) for row in rows]
+            self.keyword_index.add(pks, texts, rows)
+            total += len(rows)
+        return total
+
+    def _ensure_keyword_backfill(self, echo_id: str) -> None:
+        """
+        关键词索引上线前训练的知识需从向量存储回填一次；在后台执行，期间检索只用已有的部分
+        索引版本变化后重新领取一次：集合迁移（milvus_schema --swap）会在其它进程里清空索引并重置回填标记
+        """
+        if echo_id in self._backfill_tasks:
+            return
+        version = self.keyword_index.loaded_version(echo_id)
+        if echo_id in self._keyword_backfilled and self._keyword_backfilled[echo_id] == version:
+            return
 
-    async def search(self, query: str, echo_id: str, limit: int = 5):
-        self._ensure_vector_store()
-
-        # [修改点]: 字段不再带 metadata["..."]，直接使用字段名
-        filter_expr = f'echo_id == "{echo_id}"'
-
-        func = functools.partial(
-            self.vector_store.similarity_search,
-            query,
-            k=limit,
-            expr=filter_expr
+        async def backfill():
+            try:
+                # 只有一个 worker 能领到回填；已回填过的 echo 直接标记
+                if await local_store_pool.run(self.keyword_index.claim_backfill, echo_id):
+                    try:
+                        count = await indexing_pool.run(self._backfill_keyword_index, echo_id)
+                    except BaseException:
+                        with anyio.CancelScope(shield=True):
+                            await local_store_pool.run(self.keyword_index.release_backfill, echo_id)
+                        raise
+                    logger.info("Keyword index backfilled: echo_id={}, chunks={}", echo_id, count)
+                self._keyword_backfilled[echo_id] = self.keyword_index.loaded_version(echo_id)
+            except Exception as e:
+                logger.warning("Keyword index backfill failed: echo_id={}, error={!r}", echo_id, e)
+            finally:
+                self._backfill_tasks.pop(echo_id, None)
+
+        self._backfill_tasks[echo_id] = asyncio.get_running_loop().create_task(backfill())
+
+    async def _vector_search(
+        self, embedding: List[float], echo_id: str, k: int, with_vectors: bool = False
+    ) -> Tuple[List[Document], Dict[Any, np.ndarray]]:
+        return await self.vector_store.asearch(embedding, echo_id, k, with_vectors)
+
+    async def _rerank_mmr(
+        self,
+        embedding: List[float],
+        candidates: List[Document],
+        vectors: Dict[Any, np.ndarray],
+        limit: int,
+        relevance: Optional[List[float]] = None,
+    ) -> List[Document]:
+        """
+        MMR 多样性重排：同一页上高度重叠的 chunk 只保留最相关的一两个
+        """
+        if len(candidates) <= 1:
+            return candidates[:limit]
+        primary = PRIMARY_FIELD
+        missing = [d.metadata.get(primary) for d in candidates if d.metadata.get(primary) not in vectors]
+        missing = [pk for pk in missing if pk is not None]
+        if missing:
+            vectors = {**vectors, **await retrieval_pool.run(self.vector_store.fetch_vectors, missing)}
+
+        dim = len(embedding)
+        matrix = np.vstack([
+            vectors.get(d.metadata.get(primary), np.zeros(dim, dtype=np.float32)) for d in candidates
+        ])
+        selected = maximal_marginal_relevance(
+            embedding, matrix, k=limit, lambda_mult=settings.MMR_LAMBDA, relevance=relevance
         )
+        return [candidates[i] for i in selected]
 
-        docs = await anyio.to_thread.run_sync(func)
+    async def search(self, query: str, echo_id: str, limit: int = 5):
+        generation = 0
+        if self.retrieval_cache is not None:
+            cached = self.retrieval_cache.get(echo_id, query, limit)
+            if cached is not None:
+                return cached
+            generation = self.retrieval_cache.generation(echo_id)
+
+        # 向量存储的就绪检查（Milvus 首次连接、建索引、load）由 asearch 在线程池中完成，不在事件循环上执行
+        # MMR 开启时多取候选，重排后再截取前 limit 个
+        use_mmr = settings.MMR_ENABLED
+        pool = max(limit, settings.MMR_FETCH_K) if use_mmr else limit
+
+        # 先异步向量化（命中缓存时不发请求），再做向量检索
+        embedding = await self.embeddings.aembed_query(query)
+
+        if self.keyword_index is None:
+            docs, vectors = await self._vector_search(embedding, echo_id, pool, with_vectors=use_mmr)
+            if use_mmr:
+                docs = await self._rerank_mmr(embedding, docs, vectors, limit)
+        else:
+            # 混合检索：向量与 BM25 各取一批候选并发执行，按 RRF 融合
+            self._ensure_keyword_backfill(echo_id)
+            candidates = max(pool, settings.HYBRID_CANDIDATES)
+            results: Dict[str, Any] = {}
+
+            async def vector():
+                results["vector"] = await self._vector_search(
+                    embedding, echo_id, candidates, with_vectors=use_mmr
+                )
+
+            async def keyword():
+                results["keyword"] = await retrieval_pool.run(
+                    self.keyword_index.search, query, echo_id, candidates
+                )
+
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(vector)
+                tg.start_soon(keyword)
+            vector_docs, vectors = results["vector"]
+            fused = reciprocal_rank_fusion(
+                [vector_docs, results["keyword"]], k=settings.RRF_K, limit=pool, with_scores=True
+            )
+            docs = [doc for doc, _ in fused]
+            if use_mmr:
+                # 相关性用 RRF 融合分，保留关键词命中的权重
+                docs = await self._rerank_mmr(
+                    embedding, docs, vectors, limit, relevance=[score for _, score in fused]
+                )
+
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.put(echo_id, query, limit, docs, generation)
         return docs
 
+    async def aclose(self) -> None:
+        """
+        关闭原生异步客户端（DashScope HTTP 连接池、Milvus 异步连接）
+        """
+        await self._dashscope.aclose()
+        await self.vector_store.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "embedding_cache": self.embedding_cache.stats() if self.embedding_cache else None,
+            "query_batcher": self.query_batcher.stats() if self.query_batcher else None,
+            "retrieval_cache": self.retrieval_cache.stats() if self.retrieval_cache else None,
+            "dedupe_index": self.dedupe_index.stats(),
+            "keyword_index": self.keyword_index.stats() if self.keyword_index else None,
+            "knowledge_registry": self.knowledge_registry.stats(),
+            "vector_store": self.vector_store.stats(),
+        }
+
 
 knowledge_engine = KnowledgeEngine()
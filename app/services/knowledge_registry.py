@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+
+class KnowledgeRegistry:
+    """
+    每个 echo 已训练的文档清单（SQLite，WAL，同机 worker 共享），用于判断 echo 是否有知识可检索
+    - 文档以 knowledge_id 标识，缺 knowledge_id 时用内容指纹
+    - 本功能上线前训练的 echo 没有记录，需从 Milvus 回填一次；回填前 count 返回 None（未知）
+    回填与删除并发时可能多记一条已删除的文档，只会导致多检索一次，不会误跳过
+    """
+
+    def __init__(self, *, db_path: Optional[str]):
+        self._lock = threading.Lock()
+        self._conn = self._open_db(db_path or ":memory:")
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        if db_path != ":memory:":
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                echo_id TEXT NOT NULL,
+                doc_key TEXT NOT NULL,
+                PRIMARY KEY (echo_id, doc_key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_key ON documents (doc_key);
+
+            CREATE TABLE IF NOT EXISTS echoes (
+                echo_id TEXT PRIMARY KEY,
+                backfilled INTEGER NOT NULL DEFAULT 0
+            );
+            """
+        )
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def doc_key(knowledge_id: Optional[int], content_hash: str) -> str:
+        return f"k:{knowledge_id}" if knowledge_id is not None else f"h:{content_hash}"
+
+    # --------------------------------------------------------------------------
+    def add(self, echo_id: str, doc_keys: Iterable[str]) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO documents (echo_id, doc_key) VALUES (?, ?)",
+                    [(echo_id, key) for key in doc_keys],
+                )
+
+    def remove_knowledge(self, knowledge_ids: Iterable[int], echo_id: Optional[str] = None) -> None:
+        """
+        echo_id 为空时删除这些 knowledge_id 在所有 echo 下的记录（对应 batch_delete）
+        """
+        keys = [self.doc_key(int(k), "") for k in knowledge_ids]
+        with self._lock:
+            with self._conn:
+                if echo_id is None:
+                    self._conn.executemany("DELETE FROM documents WHERE doc_key = ?", [(k,) for k in keys])
+                else:
+                    self._conn.executemany(
+                        "DELETE FROM documents WHERE echo_id = ? AND doc_key = ?",
+                        [(echo_id, k) for k in keys],
+                    )
+
+    def count(self, echo_id: str) -> Optional[int]:
+        """
+        echo 的文档数；尚未回填时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT backfilled FROM echoes WHERE echo_id = ?", (echo_id,)
+            ).fetchone()
+            if not row or row[0] != 1:
+                return None
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM documents WHERE echo_id = ?", (echo_id,)
+            ).fetchone()[0]
+
+    def claim_backfill(self, echo_id: str) -> bool:
+        """
+        只有一个调用方会拿到 True，由它从 Milvus 回填后调用 finish_backfill
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO echoes (echo_id) VALUES (?)", (echo_id,))
+                cursor = self._conn.execute(
+                    "UPDATE echoes SET backfilled = -1 WHERE echo_id = ? AND backfilled = 0", (echo_id,)
+                )
+        return cursor.rowcount == 1
+
+    def finish_backfill(self, echo_id: str, doc_keys: Iterable[str]) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO documents (echo_id, doc_key) VALUES (?, ?)",
+                    [(echo_id, key) for key in doc_keys],
+                )
+                self._conn.execute("UPDATE echoes SET backfilled = 1 WHERE echo_id = ?", (echo_id,))
+
+    def release_backfill(self, echo_id: str) -> None:
+        # 回填失败时撤销，下次再试
+        with self._lock:
+            with self._conn:
+                self._conn.execute("UPDATE echoes SET backfilled = 0 WHERE echo_id = ?", (echo_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            echoes = self._conn.execute("SELECT COUNT(*) FROM echoes WHERE backfilled = 1").fetchone()[0]
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return {"echoes": echoes, "documents": documents}
@@ -1,9 +1,29 @@
+import functools
+from typing import Optional
 from urllib.parse import urlparse
 from app.core.logger import logger
-from app.services.file_loader import download_file_from_oss
-from app.services.file_parsers import parse_file
-from app.schemas.knowledge import KnowledgeIngestRequest
-from app.services.knowledge_engine import knowledge_engine
+from app.core.config import settings
+from app.core.rate_limit import Priority, with_priority
+from app.services.artifact_cache import ArtifactCache, PARSER_VERSION
+from app.services.file_loader import (
+    ObjectNotModified,
+    download_file_from_oss,
+    download_file_from_oss_to_disk,
+)
+from app.services.file_parsers import (
+    aparse_file,
+    iter_file_sections,
+    is_supported_file_type,
+    section_separator,
+)
+from app.services.ingest_pipeline import IngestProgress, iter_document_chunks
+from app.services.knowledge_engine import knowledge_engine, CHUNK_SIZE, CHUNK_OVERLAP
+
+artifact_cache = (
+    ArtifactCache(root=settings.ARTIFACT_CACHE_DIR, max_bytes=settings.ARTIFACT_CACHE_MAX_BYTES)
+    if settings.ARTIFACT_CACHE_ENABLED
+    else None
+)
 
 
 def _parse_oss_url(url: str):
@@ -28,6 +48,7 @@ def _parse_oss_url(url: str):
     return bucket, object_key
 
 
+@with_priority(Priority.INGEST)
 async def train_from_oss(
         *,
         knowledge_id: int,
@@ -36,8 +57,11 @@ async def train_from_oss(
         file_url: str,
         file_type: str,
         source_name: str,
+        streaming: bool = False,
+        upsert: bool = False,
+        progress: Optional[IngestProgress] = None,
 ):
-    logger.info(f"Start training from OSS: url={file_url}")
+    logger.info(f"Start training from OSS: url={file_url}, streaming={streaming}, upsert={upsert}")
 
     # 1️⃣ 解析 URL (替换原本的硬编码逻辑)
     try:
@@ -46,29 +70,126 @@ async def train_from_oss(
         logger.error(f"Failed to parse OSS URL: {e}")
         raise ValueError(f"无效的 OSS 链接: {file_url}")
 
-    # 2️⃣ 下载 OSS 文件
+    metadata = {
+        "knowledge_id": knowledge_id,
+        "file_type": file_type,
+        "original_url": file_url
+    }
+
+    # 先校验类型，避免下载完才发现不支持
+    if not is_supported_file_type(file_type):
+        raise RuntimeError(f"Unsupported file type: {file_type}")
+
+    progress = progress or IngestProgress(label=source_name)
+    ingest = _chunk_ingest(
+        user_id=user_id,
+        echo_id=echo_id,
+        source_name=source_name,
+        metadata=metadata,
+        upsert=upsert,
+        progress=progress,
+    )
+
+    # 2️⃣ 查产物缓存：有可用产物时带 If-None-Match 下载，文件未变化则跳过下载与解析
+    object_id = f"{bucket}/{object_key}"
+    signature = _chunk_signature(file_type, streaming)
+    manifest = artifact_cache.lookup(object_id, signature) if artifact_cache else None
+
+    # 3️⃣ 下载 OSS 文件：流式落盘，默认整个读入内存
     # 注意：这里 region 暂时硬编码为 "cn-beijing"，
     # 如果你的 bucket 在不同区域，建议将 region 也放入 .env 配置或从 URL endpoint 中解析
-    raw_bytes = await download_file_from_oss(
-        region="cn-beijing",
-        bucket=bucket,
-        object_key=object_key,
-    )
+    download = download_file_from_oss_to_disk if streaming else download_file_from_oss
+    progress.set_stage("downloading")
+    try:
+        with progress.timed("download"):
+            downloaded = await download(
+                region="cn-beijing",
+                bucket=bucket,
+                object_key=object_key,
+                on_bytes=progress.add_bytes,
+                if_none_match=manifest.etag if manifest else None,
+            )
+    except ObjectNotModified:
+        # 文件未变化：跳过下载与解析，直接用缓存的 chunk 进入向量化
+        artifact_cache.record_hit()
+        logger.info(f"Artifact cache hit (304): {object_id}")
+        return await ingest(artifact_cache.iter_chunks(manifest), content_hash=manifest.sha256)
+
+    writer = None
+    try:
+        logger.info("Downloaded {} bytes, sha256={}", downloaded.size, downloaded.sha256)
+        if artifact_cache is not None:
+            adopted = artifact_cache.adopt(object_id, downloaded.etag, downloaded.sha256, signature)
+            if adopted is not None:
+                artifact_cache.record_hit()
+                logger.info(f"Artifact cache hit (same content): {object_id}")
+                return await ingest(artifact_cache.iter_chunks(adopted), content_hash=adopted.sha256)
+            artifact_cache.record_miss()
 
-    # 3️⃣ 解析成纯文本
-    content = parse_file(raw_bytes, file_type)
+        # 4️⃣ 解析：流式按页产出 section；默认在进程池中整篇解析，作为一个 section 切分
+        # PDF 的交叉引用表在文件末尾，流式解析必须等文件完整落盘后才能按页读取
+        if streaming:
+            separator = section_separator(file_type)
+            sections = iter_file_sections(downloaded.path, file_type)
+        else:
+            progress.set_stage("parsing")
+            with progress.timed("parse"):
+                content = await aparse_file(downloaded.data, file_type)
+            separator, sections = "", iter([content])
+        if artifact_cache is not None:
+            writer = artifact_cache.writer(object_id, downloaded.etag, downloaded.sha256, signature)
+            sections = writer.tee_sections(sections, separator)
 
-    # 4️⃣ 调用已有 ingest（chunk + embedding + milvus）
-    ingest_req = KnowledgeIngestRequest(
+        # 5️⃣ 切分后分批向量化 / 写入（不经过 KnowledgeIngestRequest 的 MAX_CONTENT_LENGTH 限制）
+        # 文档指纹取原始文件的 sha256，两种模式一致，同一文件换模式重训也能识别为重复
+        chunks = iter_document_chunks(
+            sections,
+            knowledge_engine.text_splitter,
+            separator=separator,
+            progress=progress,
+        )
+        if writer is not None:
+            chunks = writer.tee_chunks(chunks)
+
+        return await ingest(chunks, content_hash=downloaded.sha256)
+    finally:
+        if writer is not None:
+            writer.abort()
+        downloaded.cleanup()
+
+
+def _chunk_ingest(
+        *,
+        user_id: str,
+        echo_id: str,
+        source_name: str,
+        metadata: dict,
+        upsert: bool,
+        progress: IngestProgress,
+):
+    """
+    chunk 流 -> 向量化 / 写入 的入口；upsert 时与该 knowledge_id 已有的 chunk 对比
+    """
+    if upsert:
+        ingest = functools.partial(
+            knowledge_engine.upsert_stream, knowledge_id=metadata["knowledge_id"]
+        )
+    else:
+        ingest = knowledge_engine.ingest_stream
+    return functools.partial(
+        ingest,
         user_id=user_id,
         echo_id=echo_id,
-        content=content,
         source_name=source_name,
-        metadata={
-            "knowledge_id": knowledge_id,
-            "file_type": file_type,
-            "original_url": file_url
-        },
+        metadata=metadata,
+        progress=progress,
     )
 
-    return await knowledge_engine.ingest(ingest_req)
\ No newline at end of file
+
+def _chunk_signature(file_type: str, streaming: bool) -> str:
+    """
+    产物与解析器版本、切分参数绑定，参数调整后旧产物不会被误用
+    流式按页切分、默认整篇切分，chunk 边界不同，两种模式的产物分开存放
+    """
+    mode = "" if streaming else "-whole"
+    return f"v{PARSER_VERSION}-{file_type.lower()}{mode}-c{CHUNK_SIZE}-o{CHUNK_OVERLAP}"
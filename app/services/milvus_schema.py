@@ -0,0 +1,288 @@
+"""
+知识库 Milvus 集合的显式 schema、索引与迁移
+
+迁移（在仓库根目录，迁移期间请暂停训练任务）:
+    python -m app.services.milvus_schema migrate --source frequency_knowledge --swap
+"""
+import argparse
+import hashlib
+import time
+from typing import Any, Dict, Optional
+
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
+
+from app.core.config import settings
+from app.core.logger import logger
+
+PRIMARY_FIELD = "pk"
+TEXT_FIELD = "text"
+VECTOR_FIELD = "vector"
+PARTITION_KEY_FIELD = "echo_id"
+
+# 需要建标量索引的过滤字段
+SCALAR_INDEX_FIELDS = ("echo_id", "user_id", "knowledge_id", "content_hash")
+
+# 只保存压缩向量的索引类型（SQ8：每维 1 字节；PQ：每向量 m × nbits / 8 字节）
+QUANTIZED_INDEX_TYPES = ("IVF_SQ8", "IVF_PQ")
+
+# 标量字段及写入时缺省值（列式写入要求每一列都有值）
+SCALAR_FIELDS: Dict[str, tuple] = {
+    "echo_id": (DataType.VARCHAR, 128, ""),
+    "user_id": (DataType.VARCHAR, 128, ""),
+    "knowledge_id": (DataType.INT64, None, 0),
+    "content_hash": (DataType.VARCHAR, 64, ""),
+    "source": (DataType.VARCHAR, 1024, ""),
+    "file_type": (DataType.VARCHAR, 32, ""),
+    "original_url": (DataType.VARCHAR, 2048, ""),
+}
+FIELD_DEFAULTS = {name: default for name, (_, _, default) in SCALAR_FIELDS.items()}
+
+# 不在 SCALAR_FIELDS 中的 metadata 键（训练请求里业务自带的字段）统一存入该 JSON 字段，读出时再展开；
+# 固定列之外的键不会在写入时被静默丢掉
+EXTRA_FIELD = "extra"
+_RESERVED_FIELDS = {PRIMARY_FIELD, TEXT_FIELD, VECTOR_FIELD, EXTRA_FIELD, *SCALAR_FIELDS}
+
+
+def pack_extra(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    SCALAR_FIELDS 之外的键收进 EXTRA_FIELD；metadata 已带 EXTRA_FIELD 时与之合并
+    """
+    packed = {name: metadata[name] for name in SCALAR_FIELDS if name in metadata}
+    extra = dict(metadata.get(EXTRA_FIELD) or {})
+    extra.update((key, value) for key, value in metadata.items() if key not in _RESERVED_FIELDS)
+    packed[EXTRA_FIELD] = extra
+    return packed
+
+
+def unpack_extra(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    读出的行 / 文档 metadata 原地展开 EXTRA_FIELD（不覆盖固定列）
+    """
+    for key, value in (row.pop(EXTRA_FIELD, None) or {}).items():
+        row.setdefault(key, value)
+    return row
+
+
+def build_knowledge_schema(dim: int) -> CollectionSchema:
+    fields = [
+        FieldSchema(PRIMARY_FIELD, DataType.INT64, is_primary=True, auto_id=True),
+        FieldSchema(TEXT_FIELD, DataType.VARCHAR, max_length=65535),
+        FieldSchema(VECTOR_FIELD, DataType.FLOAT_VECTOR, dim=dim),
+    ]
+    for name, (dtype, max_length, _) in SCALAR_FIELDS.items():
+        kwargs: Dict[str, Any] = {}
+        if max_length is not None:
+            kwargs["max_length"] = max_length
+        if name == PARTITION_KEY_FIELD:
+            kwargs["is_partition_key"] = True
+        fields.append(FieldSchema(name, dtype, **kwargs))
+    fields.append(FieldSchema(EXTRA_FIELD, DataType.JSON))
+    return CollectionSchema(fields, description="Frequency 数字分身知识库 (echo_id 为 partition key)")
+
+
+def vector_index_params() -> dict:
+    index_type = settings.MILVUS_INDEX_TYPE.upper()
+    if index_type == "HNSW":
+        params = {"M": settings.MILVUS_HNSW_M, "efConstruction": settings.MILVUS_HNSW_EF_CONSTRUCTION}
+    elif index_type in ("IVF_FLAT", "IVF_SQ8"):
+        params = {"nlist": settings.MILVUS_IVF_NLIST}
+    elif index_type == "IVF_PQ":
+        params = {"nlist": settings.MILVUS_IVF_NLIST, "m": settings.MILVUS_PQ_M, "nbits": settings.MILVUS_PQ_NBITS}
+    elif index_type == "FLAT":
+        params = {}
+    else:
+        raise ValueError(f"Unsupported MILVUS_INDEX_TYPE: {settings.MILVUS_INDEX_TYPE}")
+    return {"index_type": index_type, "metric_type": settings.MILVUS_METRIC_TYPE, "params": params}
+
+
+def vector_search_params(index_type: Optional[str] = None) -> dict:
+    """
+    index_type 为空时按 MILVUS_INDEX_TYPE；已有集合应传入实际的索引类型（见 vector_index_type）
+    """
+    index_type = (index_type or settings.MILVUS_INDEX_TYPE).upper()
+    if index_type == "HNSW":
+        params = {"ef": settings.MILVUS_HNSW_EF}
+    elif index_type in ("IVF_FLAT", "IVF_SQ8", "IVF_PQ"):
+        params = {"nprobe": settings.MILVUS_IVF_NPROBE}
+    else:
+        params = {}
+    return {"metric_type": settings.MILVUS_METRIC_TYPE, "params": params}
+
+
+def is_quantized_index(index_type: str) -> bool:
+    """
+    索引只保存压缩后的向量（距离是近似值），检索结果需要用原始向量精排
+    """
+    return index_type.upper() in QUANTIZED_INDEX_TYPES
+
+
+def vector_index_type(collection: Collection) -> Optional[str]:
+    """
+    集合上向量字段实际的索引类型；索引建好后修改 MILVUS_INDEX_TYPE 不会重建索引，以这里为准
+    """
+    for index in collection.indexes:
+        if index.field_name == VECTOR_FIELD:
+            index_type = (index.params or {}).get("index_type")
+            return index_type.upper() if index_type else None
+    return None
+
+
+def is_managed(collection: Collection) -> bool:
+    """
+    是否为本模块创建的布局（echo_id 为 partition key）
+    """
+    return any(
+        field.name == PARTITION_KEY_FIELD and getattr(field, "is_partition_key", False)
+        for field in collection.schema.fields
+    )
+
+
+def _ensure_indexes(collection: Collection) -> None:
+    existing = {index.field_name for index in collection.indexes}
+    if VECTOR_FIELD not in existing:
+        collection.create_index(VECTOR_FIELD, vector_index_params())
+        logger.info("Milvus vector index created: {} {}", collection.name, vector_index_params())
+    if settings.MILVUS_SCALAR_INDEX_TYPE:
+        field_names = {field.name for field in collection.schema.fields}
+        for name in SCALAR_INDEX_FIELDS:
+            if name in field_names and name not in existing:
+                collection.create_index(
+                    name, {"index_type": settings.MILVUS_SCALAR_INDEX_TYPE}, index_name=f"idx_{name}"
+                )
+                logger.info("Milvus scalar index created: {}.{}", collection.name, name)
+
+
+def ensure_knowledge_collection(name: str, dim: int, *, load: bool = True) -> Collection:
+    """
+    集合不存在时按显式 schema 创建；补齐缺失的索引并加载到内存
+    已存在的旧布局（langchain 隐式创建）照常使用，只提示迁移
+    """
+    if utility.has_collection(name):
+        collection = Collection(name)
+        if not is_managed(collection):
+            logger.warning(
+                "Milvus collection {} uses the legacy layout (no echo_id partition key); "
+                "run `python -m app.services.milvus_schema migrate --source {} --swap`",
+                name, name,
+            )
+    else:
+        collection = Collection(
+            name,
+            schema=build_knowledge_schema(dim),
+            num_partitions=settings.MILVUS_NUM_PARTITIONS,
+        )
+        logger.info("Milvus collection created: {} (dim={}, partitions={})", name, dim, settings.MILVUS_NUM_PARTITIONS)
+
+    _ensure_indexes(collection)
+    if load:
+        collection.load()
+    return collection
+
+
+# ==============================================================================
+# 迁移：旧集合 -> 显式 schema 的新集合
+# ==============================================================================
+def _to_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    text = row.get(TEXT_FIELD) or ""
+    packed = pack_extra({key: value for key, value in row.items() if key != PRIMARY_FIELD})
+    converted = {TEXT_FIELD: text, VECTOR_FIELD: row[VECTOR_FIELD], EXTRA_FIELD: packed[EXTRA_FIELD]}
+    for name, default in FIELD_DEFAULTS.items():
+        value = packed.get(name)
+        converted[name] = default if value is None else value
+    if not converted["content_hash"]:
+        converted["content_hash"] = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return converted
+
+
+def migrate_collection(
+    source: str,
+    target: Optional[str] = None,
+    *,
+    batch_size: int = 1000,
+    swap: bool = False,
+) -> int:
+    """
+    把 source 的全部 chunk 复制到显式 schema 的 target 集合，返回复制条数
+    swap=True 时复制完成并核对条数后：source 改名为 <source>_legacy，target 改名为 source，
+    服务配置无需改动。新集合主键重新生成，因此替换后关键词索引会被清空，检索时再从 Milvus 回填
+    """
+    target = target or f"{source}_v2"
+    if not utility.has_collection(source):
+        raise ValueError(f"collection {source} does not exist")
+    if utility.has_collection(target):
+        raise ValueError(f"target collection {target} already exists")
+
+    source_col = Collection(source)
+    source_col.load()
+    vector_field = next(f for f in source_col.schema.fields if f.name == VECTOR_FIELD)
+    dim = vector_field.params["dim"]
+    output_fields = [f.name for f in source_col.schema.fields if f.name != PRIMARY_FIELD]
+
+    target_col = ensure_knowledge_collection(target, dim, load=False)
+    iterator = source_col.query_iterator(batch_size=batch_size, expr="", output_fields=output_fields)
+    copied = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            target_col.insert([_to_row(row) for row in rows])
+            copied += len(rows)
+            logger.info("Migrated {} chunks ({:.1f}s)", copied, time.perf_counter() - started)
+    finally:
+        iterator.close()
+    target_col.flush()
+
+    # 源集合的 num_entities 含已删除未压缩的行，只核对目标集合是否完整写入
+    if target_col.num_entities != copied:
+        raise RuntimeError(
+            f"row count mismatch after migration: copied={copied}, {target}={target_col.num_entities}"
+        )
+    target_col.load()
+
+    if swap:
+        source_col.release()
+        legacy = f"{source}_legacy"
+        utility.rename_collection(source, legacy)
+        utility.rename_collection(target, source)
+        logger.info("Collections swapped: {} -> {}, {} -> {}", source, legacy, target, source)
+        _reset_keyword_index()
+    logger.info("Migration finished: {} chunks copied from {} to {}", copied, source, source if swap else target)
+    return copied
+
+
+def _reset_keyword_index() -> None:
+    # 关键词索引以 Milvus 主键为 id，迁移后主键全部变化；
+    # reset 会递增各 echo 的版本，运行中的 worker 检索时发现版本变化，会重新核对回填标记并从新集合回填
+    if not settings.HYBRID_SEARCH_ENABLED:
+        return
+    from app.services.keyword_index import KeywordIndex
+
+    KeywordIndex(db_path=settings.KEYWORD_INDEX_PATH or None, max_echoes=1).reset()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库 Milvus 集合管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    migrate = sub.add_parser("migrate", help="复制旧集合到显式 schema 的新集合")
+    migrate.add_argument("--source", default=settings.MILVUS_COLLECTION)
+    migrate.add_argument("--target", default=None)
+    migrate.add_argument("--batch-size", type=int, default=1000)
+    migrate.add_argument("--swap", action="store_true", help="完成后用新集合替换旧集合名")
+
+    create = sub.add_parser("create", help="按当前配置创建集合与索引并加载")
+    create.add_argument("--name", default=settings.MILVUS_COLLECTION)
+    create.add_argument("--dim", type=int, default=settings.EMBEDDING_DIM)
+
+    args = parser.parse_args()
+    connections.connect(alias="default", host=settings.MILVUS_HOST, port=settings.MILVUS_PORT)
+    if args.command == "migrate":
+        migrate_collection(args.source, args.target, batch_size=args.batch_size, swap=args.swap)
+    else:
+        ensure_knowledge_collection(args.name, args.dim)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def maximal_marginal_relevance(
+    query_vector: Sequence[float],
+    candidate_vectors: np.ndarray,
+    *,
+    k: int,
+    lambda_mult: float,
+    relevance: Optional[Sequence[float]] = None,
+) -> List[int]:
+    """
+    MMR：每一步选 λ·相关性 − (1−λ)·与已选结果的最大相似度 最高的候选，返回候选下标（按选中顺序）
+    - relevance 为空时以候选与 query 的余弦相似度作为相关性；
+      传入时（如 RRF 融合分）先做 min-max 归一化到 [0, 1]
+    - 候选两两相似度只算一次，之后每步只增量更新“与已选集合的最大相似度”，
+      总开销 O(n²·d + k·n)，不随 k 重复做矩阵乘
+    向量全零（取不到向量）的候选与任何结果都不相似，只按相关性参与排序
+    """
+    n = len(candidate_vectors)
+    if n == 0 or k <= 0:
+        return []
+    matrix = _normalize_rows(np.asarray(candidate_vectors, dtype=np.float32))
+
+    if relevance is None:
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = matrix @ query
+    else:
+        scores = np.asarray(relevance, dtype=np.float32)
+        span = float(scores.max() - scores.min())
+        scores = (scores - scores.min()) / span if span > 0 else np.ones(n, dtype=np.float32)
+
+    similarity = matrix @ matrix.T
+    max_redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected: List[int] = []
+
+    for _ in range(min(k, n)):
+        if selected:
+            mmr = lambda_mult * scores - (1 - lambda_mult) * max_redundancy
+        else:
+            mmr = scores.copy()
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_redundancy, similarity[best], out=max_redundancy)
+
+    return selected
@@ -0,0 +1,545 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.core.logger import logger
+from app.services.vector_store import PRIMARY_FIELD, TEXT_FIELD, VectorStore
+
+_MIN_CAPACITY = 256        # 新分区预分配的行数，之后按 2 倍扩容
+_COMPACT_MIN_DEAD = 1024   # 已删除行超过该值且多于存活行时压缩分区文件
+_SQL_BATCH = 500           # IN (...) 参数个数上限
+_SCORE_BLOCK = 4096        # 量化矩阵按块还原为 float32 计算，限制临时内存
+
+QUANTIZATIONS = ("none", "float16", "int8")
+
+
+def encode_vectors(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    量化为检索用的压缩矩阵，返回 (codes, 每行缩放系数)
+    - float16: 每维 2 字节
+    - int8: 逐行对称量化，x ≈ code · scale，scale = max|x| / 127；每维 1 字节 + 每行 4 字节
+    """
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def approximate_dots(codes: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+    """
+    压缩矩阵与 query 的内积，分块还原为 float32 后做矩阵乘（numpy 的 float16 / int8 矩阵乘没有 BLAS 加速）
+    """
+    dots = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), _SCORE_BLOCK):
+        block = codes[start:start + _SCORE_BLOCK].astype(np.float32)
+        dots[start:start + len(block)] = block @ query
+    if scales is not None:
+        dots *= scales
+    return dots
+
+
+class _Partition:
+    """
+    单个 echo 的向量矩阵
+    - vectors: 内存映射的 (capacity, dim) float32 文件，前 size 行已使用
+    - alive / pks: 每一行是否存活及其主键；删除只做标记，已删除行多了再压缩
+    - sq_norms: 每行的平方范数，L2 距离 = |x|² - 2·x·q + |q|²，检索只需一次矩阵乘
+    - codes / scales: 开启量化时检索用的内存压缩矩阵（由 float32 文件加载时生成，不单独落盘）；
+      float32 文件只在精排、取向量时按行读取，冷数据不占常驻内存
+    """
+
+    def __init__(self, path: str, dim: int, size: int, capacity: int, quantization: str = "none"):
+        self.path = path
+        self.dim = dim
+        self.size = size
+        self.capacity = capacity
+        self.quantization = quantization
+        self.vectors = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.pks = np.full(capacity, -1, dtype=np.int64)
+        self.sq_norms = np.zeros(capacity, dtype=np.float32)
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        if quantization != "none":
+            dtype = np.float16 if quantization == "float16" else np.int8
+            self.codes = np.zeros((capacity, dim), dtype=dtype)
+            if quantization == "int8":
+                self.scales = np.ones(capacity, dtype=np.float32)
+        for start in range(0, size, _SCORE_BLOCK):
+            self._index_rows(start, np.asarray(self.vectors[start:min(start + _SCORE_BLOCK, size)]))
+
+    def _index_rows(self, start: int, vectors: np.ndarray) -> None:
+        end = start + len(vectors)
+        self.sq_norms[start:end] = np.einsum("ij,ij->i", vectors, vectors)
+        if self.codes is not None:
+            codes, scales = encode_vectors(vectors, self.quantization)
+            self.codes[start:end] = codes
+            if scales is not None:
+                self.scales[start:end] = scales
+
+    @property
+    def search_bytes(self) -> int:
+        """
+        检索时需要扫描的数据量：量化后为压缩矩阵，否则为 float32 矩阵
+        """
+        if self.codes is None:
+            return self.size * self.dim * 4
+        row_bytes = self.codes.itemsize * self.dim + (4 if self.scales is not None else 0)
+        return self.size * row_bytes
+
+    @property
+    def live(self) -> int:
+        return int(self.alive[:self.size].sum())
+
+    def reserve(self, rows: int) -> None:
+        need = self.size + rows
+        if need <= self.capacity:
+            return
+        capacity = max(need, self.capacity * 2, _MIN_CAPACITY)
+        # 文件只会变长，已有的映射视图（正在进行的检索）仍然有效
+        with open(self.path, "r+b") as f:
+            f.truncate(capacity * self.dim * 4)
+        self.vectors = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self.alive = np.concatenate([self.alive, np.zeros(capacity - self.capacity, dtype=bool)])
+        self.pks = np.concatenate([self.pks, np.full(capacity - self.capacity, -1, dtype=np.int64)])
+        self.sq_norms = np.concatenate([self.sq_norms, np.zeros(capacity - self.capacity, dtype=np.float32)])
+        if self.codes is not None:
+            self.codes = np.concatenate([self.codes, np.zeros((capacity - self.capacity, self.dim), dtype=self.codes.dtype)])
+        if self.scales is not None:
+            self.scales = np.concatenate([self.scales, np.ones(capacity - self.capacity, dtype=np.float32)])
+        self.capacity = capacity
+
+    def append(self, vectors: np.ndarray, pks: Sequence[int]) -> List[int]:
+        """
+        追加并落盘，返回写入的行号
+        """
+        n = len(vectors)
+        self.reserve(n)
+        start = self.size
+        self.vectors[start:start + n] = vectors
+        self.vectors.flush()
+        self._index_rows(start, vectors)
+        self.pks[start:start + n] = pks
+        self.alive[start:start + n] = True
+        self.size = start + n
+        return list(range(start, start + n))
+
+    def snapshot(self) -> "_Snapshot":
+        """
+        检索用的只读快照（调用方持有锁）；矩阵是视图，不复制。
+        已写入的行不会被原地修改（删除只改 alive，扩容 / 压缩都换新数组），视图在锁外使用是安全的
+        """
+        size = self.size
+        return _Snapshot(
+            vectors=self.vectors[:size],
+            codes=self.codes[:size] if self.codes is not None else None,
+            scales=self.scales[:size] if self.scales is not None else None,
+            sq_norms=self.sq_norms[:size],
+            alive=self.alive[:size].copy(),
+            pks=self.pks[:size],
+        )
+
+
+@dataclass
+class _Snapshot:
+    vectors: np.ndarray
+    codes: Optional[np.ndarray]
+    scales: Optional[np.ndarray]
+    sq_norms: np.ndarray
+    alive: np.ndarray
+    pks: np.ndarray
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    进程内向量索引，无需 Milvus 服务（本地开发 / CI / 单机小规模部署）
+    - 每个 echo 一个连续的 float32 矩阵（内存映射文件），检索是一次矩阵乘 + argpartition 取 top-k，精确检索
+    - 正文与 metadata 存 SQLite（WAL），行号 slot 指向矩阵中的行
+    - 先写向量文件再提交 SQLite，崩溃时未提交的行只是矩阵尾部的空闲空间
+    - quantization=float16 / int8 时检索扫描内存中的压缩矩阵，取 k × rescore_factor 个候选
+      再读 float32 原始向量精排；切换量化方式无需迁移数据
+    矩阵只在本进程内维护，多 worker 部署请使用 Milvus 后端
+    """
+
+    backend = "numpy"
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        metric_type: str = "L2",
+        quantization: str = "none",
+        rescore_factor: int = 4,
+    ):
+        self.metric_type = metric_type.upper()
+        if self.metric_type not in ("L2", "IP", "COSINE"):
+            raise ValueError(f"Unsupported metric type for numpy backend: {metric_type}")
+        self.quantization = quantization.lower()
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unsupported vector quantization: {quantization}")
+        self.rescore_factor = rescore_factor
+        self.directory = directory
+        self._vector_dir = os.path.join(directory, "vectors")
+        os.makedirs(self._vector_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = self._open_db(os.path.join(directory, "chunks.sqlite3"))
+        self._partitions: Dict[str, _Partition] = {}
+
+        self.searches = 0
+        self.compactions = 0
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                pk INTEGER PRIMARY KEY,
+                echo_id TEXT NOT NULL,
+                knowledge_id INTEGER,
+                slot INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_echo ON chunks (echo_id, knowledge_id);
+            CREATE INDEX IF NOT EXISTS idx_chunks_knowledge ON chunks (knowledge_id);
+
+            CREATE TABLE IF NOT EXISTS partitions (
+                echo_id TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """
+        )
+        conn.commit()
+        return conn
+
+    # --------------------------------------------------------------------------
+    def _partition(self, echo_id: str) -> Optional[_Partition]:
+        """
+        取分区，首次访问时从磁盘加载（调用方持有锁）
+        """
+        part = self._partitions.get(echo_id)
+        if part is not None:
+            return part
+        row = self._conn.execute(
+            "SELECT file, dim, size FROM partitions WHERE echo_id = ?", (echo_id,)
+        ).fetchone()
+        if not row:
+            return None
+        file, dim, size = row
+        path = os.path.join(self._vector_dir, file)
+        capacity = os.path.getsize(path) // (dim * 4)
+        if capacity < size:
+            raise RuntimeError(f"vector file {path} is truncated: {capacity} rows < {size}")
+        part = _Partition(path, dim, size, capacity, self.quantization)
+        for pk, slot in self._conn.execute("SELECT pk, slot FROM chunks WHERE echo_id = ?", (echo_id,)):
+            part.alive[slot] = True
+            part.pks[slot] = pk
+        self._partitions[echo_id] = part
+        logger.info("Vector partition loaded: echo_id={}, rows={}, dim={}", echo_id, part.live, dim)
+        self._maybe_compact(echo_id)
+        return self._partitions[echo_id]
+
+    def _create_partition(self, echo_id: str, dim: int, generation: int = 0) -> _Partition:
+        digest = hashlib.sha1(echo_id.encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(self._vector_dir, f"{digest}.{generation}.f32")
+        with open(path, "wb") as f:
+            f.truncate(_MIN_CAPACITY * dim * 4)
+        return _Partition(path, dim, 0, _MIN_CAPACITY, self.quantization)
+
+    def _allocate_pks(self, n: int) -> List[int]:
+        # 主键单调递增、不复用，关键词索引等外部引用不会错指（调用方持有锁并负责提交）
+        row = self._conn.execute("SELECT value FROM counters WHERE name = 'pk'").fetchone()
+        start = (row[0] if row else 0) + 1
+        self._conn.execute(
+            "INSERT OR REPLACE INTO counters (name, value) VALUES ('pk', ?)", (start + n - 1,)
+        )
+        return list(range(start, start + n))
+
+    def insert(
+        self, texts: List[str], embeddings: List[List[float]], metadatas: List[dict]
+    ) -> List[int]:
+        if not texts:
+            return []
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError(f"embeddings shape {vectors.shape} does not match {len(texts)} texts")
+
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(metadata.get("echo_id") or "", []).append(i)
+
+        with self._lock:
+            pks = self._allocate_pks(len(texts))
+            appended: List[Tuple[_Partition, int, bool]] = []
+            try:
+                rows = []
+                for echo_id, indexes in groups.items():
+                    part = self._partition(echo_id)
+                    created = part is None
+                    if created:
+                        part = self._create_partition(echo_id, vectors.shape[1])
+                    elif part.dim != vectors.shape[1]:
+                        raise ValueError(
+                            f"embedding dim {vectors.shape[1]} does not match partition dim {part.dim} (echo_id={echo_id})"
+                        )
+                    appended.append((part, part.size, created))
+                    slots = part.append(vectors[indexes], [pks[i] for i in indexes])
+                    for i, slot in zip(indexes, slots):
+                        knowledge_id = metadatas[i].get("knowledge_id")
+                        rows.append((
+                            pks[i],
+                            echo_id,
+                            int(knowledge_id) if knowledge_id is not None else None,
+                            slot,
+                            texts[i],
+                            json.dumps(metadatas[i], ensure_ascii=False),
+                        ))
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO partitions (echo_id, file, dim, size) VALUES (?, ?, ?, ?)",
+                        (echo_id, os.path.basename(part.path), part.dim, part.size),
+                    )
+                self._conn.executemany(
+                    "INSERT INTO chunks (pk, echo_id, knowledge_id, slot, text, metadata)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                # 矩阵里已追加的行作废，下次写入直接覆盖
+                for part, size, _ in appended:
+                    part.alive[size:part.size] = False
+                    part.size = size
+                raise
+            for (part, _, created), echo_id in zip(appended, groups):
+                if created:
+                    self._partitions[echo_id] = part
+        return pks
+
+    # --------------------------------------------------------------------------
+    def _delete_where(self, where: str, params: Sequence[Any]) -> int:
+        """
+        按过滤条件删除（调用方持有锁）：SQLite 删除行，矩阵中只标记，必要时压缩
+        """
+        rows = self._conn.execute(f"SELECT echo_id, slot FROM chunks WHERE {where}", params).fetchall()
+        if not rows:
+            return 0
+        with self._conn:
+            self._conn.execute(f"DELETE FROM chunks WHERE {where}", params)
+        touched = set()
+        for echo_id, slot in rows:
+            part = self._partitions.get(echo_id)
+            if part is not None:
+                part.alive[slot] = False
+                touched.add(echo_id)
+        for echo_id in touched:
+            self._maybe_compact(echo_id)
+        return len(rows)
+
+    def delete_pks(self, pks: Sequence[int]) -> None:
+        keys = [int(pk) for pk in pks]
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                part = keys[i:i + _SQL_BATCH]
+                self._delete_where(f"pk IN ({','.join('?' * len(part))})", part)
+
+    def delete_knowledge(self, knowledge_ids: Sequence[int], echo_id: Optional[str] = None) -> None:
+        ids = [int(k) for k in knowledge_ids]
+        with self._lock:
+            for i in range(0, len(ids), _SQL_BATCH):
+                part = ids[i:i + _SQL_BATCH]
+                where = f"knowledge_id IN ({','.join('?' * len(part))})"
+                params: list = list(part)
+                if echo_id is not None:
+                    where += " AND echo_id = ?"
+                    params.append(echo_id)
+                deleted = self._delete_where(where, params)
+                logger.info("Deleted {} vectors: knowledge_ids={}, echo_id={}", deleted, part, echo_id)
+
+    def _maybe_compact(self, echo_id: str) -> None:
+        """
+        已删除行过多时把存活行拷到新文件并重排 slot（调用方持有锁）
+        新文件写完、SQLite 提交后才切换，旧文件上的检索快照不受影响
+        """
+        part = self._partitions[echo_id]
+        live = part.live
+        dead = part.size - live
+        if dead < _COMPACT_MIN_DEAD or dead <= live:
+            return
+        slots = np.flatnonzero(part.alive[:part.size])
+        generation = int(os.path.basename(part.path).split(".")[1]) + 1
+        new_part = self._create_partition(echo_id, part.dim, generation)
+        new_part.append(np.asarray(part.vectors[slots]), part.pks[slots])
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE chunks SET slot = ? WHERE pk = ?",
+                [(new_slot, int(pk)) for new_slot, pk in enumerate(part.pks[slots])],
+            )
+            self._conn.execute(
+                "UPDATE partitions SET file = ?, size = ? WHERE echo_id = ?",
+                (os.path.basename(new_part.path), new_part.size, echo_id),
+            )
+        self._partitions[echo_id] = new_part
+        try:
+            os.remove(part.path)
+        except OSError as e:
+            logger.warning("Failed to remove compacted vector file {}: {!r}", part.path, e)
+        self.compactions += 1
+        logger.info("Vector partition compacted: echo_id={}, rows={}, dropped={}", echo_id, live, dead)
+
+    # --------------------------------------------------------------------------
+    def _scores(self, dots: np.ndarray, sq_norms: np.ndarray) -> np.ndarray:
+        """
+        由内积换算相似度分数，越大越相关（L2 取负距离，省略与排序无关的 |q|²）
+        """
+        if self.metric_type == "L2":
+            return 2 * dots - sq_norms
+        if self.metric_type == "COSINE":
+            norms = np.sqrt(sq_norms)
+            norms[norms == 0] = 1.0
+            return dots / norms
+        return dots
+
+    def _load_documents(self, pks: Sequence[int]) -> Dict[int, Document]:
+        docs: Dict[int, Document] = {}
+        for i in range(0, len(pks), _SQL_BATCH):
+            part = [int(pk) for pk in pks[i:i + _SQL_BATCH]]
+            marks = ",".join("?" * len(part))
+            for pk, text, metadata in self._conn.execute(
+                f"SELECT pk, text, metadata FROM chunks WHERE pk IN ({marks})", part
+            ):
+                docs[pk] = Document(page_content=text, metadata={**json.loads(metadata), PRIMARY_FIELD: pk})
+        return docs
+
+    def search(
+        self, embedding: List[float], echo_id: str, k: int, with_vectors: bool = False
+    ) -> Tuple[List[Document], Dict[Any, np.ndarray]]:
+        with self._lock:
+            self.searches += 1
+            part = self._partition(echo_id)
+            if part is None:
+                return [], {}
+            snap = part.snapshot()
+
+        live = int(snap.alive.sum())
+        k = min(k, live)
+        if k <= 0:
+            return [], {}
+        matrix = snap.vectors
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape != (matrix.shape[1],):
+            raise ValueError(f"query dim {query.shape} does not match partition dim {matrix.shape[1]}")
+
+        # 矩阵乘在锁外执行（numpy 释放 GIL），不阻塞写入与其它 echo 的检索
+        if snap.codes is None:
+            scores = self._scores(matrix @ query, snap.sq_norms)
+        else:
+            scores = self._scores(approximate_dots(snap.codes, snap.scales, query), snap.sq_norms)
+        scores[~snap.alive] = -np.inf
+
+        rescore = snap.codes is not None and self.rescore_factor > 1
+        fetch = min(k * self.rescore_factor, live) if rescore else k
+        top = np.argpartition(-scores, fetch - 1)[:fetch]
+        if rescore:
+            # 压缩分数只用于召回候选，排序以 float32 原始向量的精确分数为准（只读 fetch 行）
+            top = np.sort(top)
+            scores = self._scores(np.asarray(matrix[top]) @ query, snap.sq_norms[top])
+            order = np.argsort(-scores, kind="stable")[:k]
+            top = top[order]
+        else:
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+        hit_pks = [int(pk) for pk in snap.pks[top]]
+        with self._lock:
+            docs = self._load_documents(hit_pks)
+        # 快照之后被删除的行直接跳过
+        results = [docs[pk] for pk in hit_pks if pk in docs]
+        vectors: Dict[Any, np.ndarray] = {}
+        if with_vectors:
+            vectors = {
+                pk: np.array(matrix[slot]) for pk, slot in zip(hit_pks, top) if pk in docs
+            }
+        return results, vectors
+
+    def fetch_vectors(self, pks: Sequence[int]) -> Dict[Any, np.ndarray]:
+        vectors: Dict[Any, np.ndarray] = {}
+        with self._lock:
+            for i in range(0, len(pks), _SQL_BATCH):
+                part_pks = [int(pk) for pk in pks[i:i + _SQL_BATCH]]
+                marks = ",".join("?" * len(part_pks))
+                for pk, echo_id, slot in self._conn.execute(
+                    f"SELECT pk, echo_id, slot FROM chunks WHERE pk IN ({marks})", part_pks
+                ).fetchall():
+                    part = self._partition(echo_id)
+                    if part is not None:
+                        vectors[pk] = np.array(part.vectors[slot])
+        return vectors
+
+    def iter_rows(
+        self,
+        echo_id: str,
+        fields: Optional[Sequence[str]] = None,
+        *,
+        knowledge_id: Optional[int] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[List[dict]]:
+        where = "echo_id = ?"
+        params: list = [echo_id]
+        if knowledge_id is not None:
+            where += " AND knowledge_id = ?"
+            params.append(int(knowledge_id))
+        last_pk = 0
+        while True:
+            # 按主键分页，批与批之间释放锁
+            with self._lock:
+                batch = self._conn.execute(
+                    f"SELECT pk, text, metadata FROM chunks WHERE {where} AND pk > ? ORDER BY pk LIMIT ?",
+                    params + [last_pk, batch_size],
+                ).fetchall()
+            if not batch:
+                return
+            rows = []
+            for pk, text, metadata in batch:
+                row = {TEXT_FIELD: text, **json.loads(metadata), PRIMARY_FIELD: pk}
+                if fields is not None:
+                    row = {key: row[key] for key in (PRIMARY_FIELD, *fields) if key in row}
+                rows.append(row)
+            yield rows
+            last_pk = batch[-1][0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            partitions = list(self._partitions.values())
+            chunks = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            echoes = self._conn.execute("SELECT COUNT(*) FROM partitions").fetchone()[0]
+        return {
+            "backend": self.backend,
+            "metric_type": self.metric_type,
+            "echoes": echoes,
+            "chunks": chunks,
+            "loaded_partitions": len(partitions),
+            "quantization": self.quantization,
+            "mapped_bytes": sum(p.capacity * p.dim * 4 for p in partitions),
+            "search_bytes": sum(p.search_bytes for p in partitions),
+            "searches": self.searches,
+            "compactions": self.compactions,
+        }
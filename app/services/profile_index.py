@@ -0,0 +1,330 @@
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.executors import indexing_pool, retrieval_pool
+from app.core.logger import logger
+
+_INTEREST_SPLIT = re.compile(r"[,，、;；/|\s]+")
+
+
+def profile_text(profile: dict) -> str:
+    """
+    用于向量化的画像文本（只取与"聊不聊得来"相关的字段）
+    """
+    return (
+        f"兴趣：{profile.get('interests', '')}\n"
+        f"风格：{profile.get('style', '')}\n"
+        f"MBTI：{profile.get('mbti', '')}"
+    )
+
+
+def _interest_set(profile: dict) -> set:
+    interests = profile.get("interests") or ""
+    if isinstance(interests, (list, tuple)):
+        interests = " ".join(map(str, interests))
+    return {token.lower() for token in _INTEREST_SPLIT.split(str(interests)) if token}
+
+
+def rule_features(user: dict, candidate: dict) -> Dict[str, float]:
+    """
+    廉价规则特征：兴趣重合度 (Jaccard)、MBTI 相同维度占比、说话风格是否一致
+    """
+    a, b = _interest_set(user), _interest_set(candidate)
+    interest_overlap = len(a & b) / len(a | b) if a and b else 0.0
+
+    mbti_a = str(user.get("mbti") or "").upper()
+    mbti_b = str(candidate.get("mbti") or "").upper()
+    if len(mbti_a) == 4 and len(mbti_b) == 4:
+        mbti_match = sum(x == y for x, y in zip(mbti_a, mbti_b)) / 4
+    else:
+        mbti_match = 0.0
+
+    style_a = str(user.get("style") or "").strip()
+    style_match = 1.0 if style_a and style_a == str(candidate.get("style") or "").strip() else 0.0
+
+    return {
+        "interest_overlap": round(interest_overlap, 4),
+        "mbti_match": mbti_match,
+        "style_match": style_match,
+    }
+
+
+class ProfileIndex:
+    """
+    用户画像向量索引（候选人粗排用）
+    - 画像文本经 embeddings 向量化（走向量缓存，画像不变则不重复调用）
+    - 异步入口 ashortlist / aupsert 先经 embeddings 的异步接口向量化，再把读写库与矩阵运算交给线程池
+    - 持久化在 SQLite，进程内维护归一化后的 float32 矩阵，检索即一次矩阵乘
+    - 其它 worker 写入后通过 PRAGMA data_version 感知并重新加载矩阵
+    """
+
+    def __init__(
+        self,
+        *,
+        embeddings: Embeddings,
+        db_path: Optional[str],
+        vector_weight: float,
+        interest_weight: float,
+        mbti_weight: float,
+        style_weight: float,
+    ):
+        self.embeddings = embeddings
+        self.weights = {
+            "similarity": vector_weight,
+            "interest_overlap": interest_weight,
+            "mbti_match": mbti_weight,
+            "style_match": style_weight,
+        }
+        self._lock = threading.Lock()
+        self._conn = self._open_db(db_path or ":memory:")
+
+        self._ids: List[str] = []
+        self._profiles: List[dict] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._data_version: Optional[int] = None
+
+        self.queries = 0
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        if db_path != ":memory:":
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            " id TEXT PRIMARY KEY,"
+            " profile TEXT NOT NULL,"
+            " vector BLOB NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+    def _refresh(self) -> None:
+        """
+        SQLite 内容变化（本进程或其它 worker 写入）时重新加载矩阵，调用方持有锁
+        """
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        rows = self._conn.execute("SELECT id, profile, vector FROM profiles ORDER BY id").fetchall()
+        self._ids = [row[0] for row in rows]
+        self._profiles = [json.loads(row[1]) for row in rows]
+        if rows:
+            self._matrix = np.vstack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+        else:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._data_version = version
+        logger.info("Profile index loaded: {} profiles", len(self._ids))
+
+    # --------------------------------------------------------------------------
+    def _embed_profiles(self, profiles: Sequence[dict]) -> np.ndarray:
+        vectors = self.embeddings.embed_documents([profile_text(p) for p in profiles])
+        return self._normalize(np.asarray(vectors, dtype=np.float32))
+
+    async def _aembed_profiles(self, profiles: Sequence[dict]) -> np.ndarray:
+        vectors = await self.embeddings.aembed_documents([profile_text(p) for p in profiles])
+        return self._normalize(np.asarray(vectors, dtype=np.float32))
+
+    @staticmethod
+    def _check_ids(profiles: Sequence[dict]) -> None:
+        missing = [i for i, p in enumerate(profiles) if p.get("id") is None]
+        if missing:
+            raise ValueError(f"profiles without id at positions {missing[:10]}")
+
+    def upsert(self, profiles: Sequence[dict], vectors: Optional[np.ndarray] = None) -> int:
+        """
+        写入/更新画像，profile 必须带 id（同步，需在线程中调用）
+        vectors 为已归一化的画像向量，不传时现场向量化
+        """
+        if not profiles:
+            return 0
+        self._check_ids(profiles)
+
+        if vectors is None:
+            vectors = self._embed_profiles(profiles)
+        rows = [
+            (str(p["id"]), json.dumps(p, ensure_ascii=False), vector.tobytes())
+            for p, vector in zip(profiles, vectors)
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO profiles (id, profile, vector) VALUES (?, ?, ?)", rows
+                )
+            # 本连接的写入不会改变 data_version，强制下次重新加载
+            self._data_version = None
+        return len(rows)
+
+    async def aupsert(self, profiles: Sequence[dict]) -> int:
+        """
+        upsert 的异步入口：向量化不占 indexing_pool 的线程
+        """
+        if not profiles:
+            return 0
+        self._check_ids(profiles)
+        vectors = await self._aembed_profiles(profiles)
+        return await indexing_pool.run(self.upsert, profiles, vectors)
+
+    def remove(self, ids: Iterable) -> int:
+        keys = [(str(i),) for i in ids]
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.executemany("DELETE FROM profiles WHERE id = ?", keys)
+            self._data_version = None
+        return cursor.rowcount
+
+    def shortlist(
+        self,
+        user: dict,
+        *,
+        top_k: int,
+        candidates: Optional[Sequence[dict]] = None,
+        exclude_ids: Iterable = (),
+        query_vector: Optional[np.ndarray] = None,
+        candidate_matrix: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """
+        向量相似度 + 规则特征加权打分，返回前 top_k 个候选人
+        candidates 为空时在整个索引中检索；否则只对传入的候选人排序（未入库的现场向量化）
+        query_vector / candidate_matrix 为调用方已算好的向量，不传时现场向量化
+        """
+        self.queries += 1
+        query = query_vector if query_vector is not None else self._embed_profiles([user])[0]
+        excluded = {str(i) for i in exclude_ids}
+        if user.get("id") is not None:
+            excluded.add(str(user["id"]))
+
+        if candidates is None:
+            with self._lock:
+                self._refresh()
+                ids, profiles, matrix = self._ids, self._profiles, self._matrix
+        else:
+            ids = [str(c.get("id", i)) for i, c in enumerate(candidates)]
+            profiles = list(candidates)
+            matrix = candidate_matrix if candidate_matrix is not None else self._candidate_matrix(candidates)
+
+        if not ids:
+            return []
+
+        similarities = matrix @ query
+        scored = []
+        for row, (candidate_id, profile) in enumerate(zip(ids, profiles)):
+            if candidate_id in excluded:
+                continue
+            features = {"similarity": round(float(similarities[row]), 4), **rule_features(user, profile)}
+            score = sum(self.weights[name] * value for name, value in features.items())
+            scored.append({
+                "candidate_id": candidate_id,
+                "position": row if candidates is not None else None,
+                "name": profile.get("name"),
+                "score": round(score, 4),
+                "features": features,
+                "profile": profile,
+            })
+
+        scored.sort(key=lambda item: item["score"], reverse=True)
+        return scored[:top_k]
+
+    async def ashortlist(
+        self,
+        user: dict,
+        *,
+        top_k: int,
+        candidates: Optional[Sequence[dict]] = None,
+        exclude_ids: Iterable = (),
+    ) -> List[dict]:
+        """
+        shortlist 的异步入口：查询画像与未入库的候选人一次异步向量化，
+        retrieval_pool 的线程只做读库与矩阵运算，不阻塞在向量化调用上
+        """
+        candidate_matrix = None
+        if candidates is None:
+            query_vector = (await self._aembed_profiles([user]))[0]
+        else:
+            rows = await retrieval_pool.run(self._stored_vectors, candidates)
+            pending = [i for i, row in enumerate(rows) if row is None]
+            fresh = await self._aembed_profiles([user] + [candidates[i] for i in pending])
+            query_vector = fresh[0]
+            for i, vector in zip(pending, fresh[1:]):
+                rows[i] = vector
+            if rows:
+                candidate_matrix = np.vstack(rows)
+        return await retrieval_pool.run(functools.partial(
+            self.shortlist,
+            user,
+            top_k=top_k,
+            candidates=candidates,
+            exclude_ids=exclude_ids,
+            query_vector=query_vector,
+            candidate_matrix=candidate_matrix,
+        ))
+
+    def _stored_vectors(self, candidates: Sequence[dict]) -> List[Optional[np.ndarray]]:
+        """
+        已入库且画像未变的候选人取索引中的向量，其余为 None
+        """
+        with self._lock:
+            self._refresh()
+            known = {pid: row for row, pid in enumerate(self._ids)}
+            stored_profiles, stored_matrix = self._profiles, self._matrix
+
+        rows: List[Optional[np.ndarray]] = []
+        for candidate in candidates:
+            row = known.get(str(candidate.get("id"))) if candidate.get("id") is not None else None
+            if row is not None and profile_text(stored_profiles[row]) == profile_text(candidate):
+                rows.append(stored_matrix[row])
+            else:
+                rows.append(None)
+        return rows
+
+    def _candidate_matrix(self, candidates: Sequence[dict]) -> np.ndarray:
+        """
+        已入库且画像未变的候选人复用索引中的向量，其余现场向量化
+        """
+        rows = self._stored_vectors(candidates)
+        pending = [i for i, row in enumerate(rows) if row is None]
+        if pending:
+            fresh = self._embed_profiles([candidates[i] for i in pending])
+            for i, vector in zip(pending, fresh):
+                rows[i] = vector
+        return np.vstack(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+        return {"profiles": count, "queries": self.queries}
+
+
+def _create_profile_index() -> ProfileIndex:
+    from app.core.config import settings
+    from app.services.knowledge_engine import knowledge_engine
+
+    return ProfileIndex(
+        embeddings=knowledge_engine.embeddings,
+        db_path=settings.PROFILE_INDEX_PATH or None,
+        vector_weight=settings.PROFILE_WEIGHT_VECTOR,
+        interest_weight=settings.PROFILE_WEIGHT_INTEREST,
+        mbti_weight=settings.PROFILE_WEIGHT_MBTI,
+        style_weight=settings.PROFILE_WEIGHT_STYLE,
+    )
+
+
+profile_index = _create_profile_index()
@@ -0,0 +1,373 @@
+import functools
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from app.core.config import settings
+from app.core.logger import logger
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+# ==============================================================================
+# Token 计数：优先 tiktoken，编码表加载失败（离线环境）时按字符估算
+# ==============================================================================
+class _Tokenizer:
+    def __init__(self, encoding_name: str):
+        self.encoding = None
+        try:
+            import tiktoken
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logger.warning("tiktoken encoding {} unavailable, falling back to char estimate: {!r}", encoding_name, e)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        # 中文约 1 字 1 token，其它约 4 字符 1 token
+        cjk = len(_CJK.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return self.encoding.decode(tokens[:max_tokens])
+        # 二分找到不超预算的最长前缀
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low]
+
+
+@functools.lru_cache(maxsize=1)
+def get_tokenizer() -> _Tokenizer:
+    return _Tokenizer(settings.PROMPT_TOKENIZER_ENCODING)
+
+
+# ==============================================================================
+# 检索结果整理：合并相邻重叠 chunk、去掉近似重复
+# ==============================================================================
+def _overlap_length(left: str, right: str, min_overlap: int, max_overlap: int) -> int:
+    """
+    left 的后缀与 right 的前缀的最长重合长度（不足 min_overlap 视为不重合）
+    """
+    upper = min(len(left), len(right), max_overlap)
+    for size in range(upper, min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _source_key(doc: Document) -> tuple:
+    metadata = doc.metadata or {}
+    return metadata.get("knowledge_id"), metadata.get("source")
+
+
+def merge_overlapping_chunks(
+    docs: Sequence[Document], *, min_overlap: int, max_overlap: int
+) -> List[str]:
+    """
+    同一文档中首尾重叠的 chunk（切分时的 overlap）拼回连续段落
+    返回的段落按其中最靠前的检索排名排序
+    """
+    groups: List[dict] = []
+    for rank, doc in enumerate(docs):
+        text = doc.page_content.strip()
+        if not text:
+            continue
+        key = _source_key(doc)
+        placed = False
+        for group in groups:
+            if group["key"] != key:
+                continue
+            if text in group["text"]:
+                placed = True
+                break
+            tail = _overlap_length(group["text"], text, min_overlap, max_overlap)
+            if tail:
+                group["text"] += text[tail:]
+                placed = True
+                break
+            head = _overlap_length(text, group["text"], min_overlap, max_overlap)
+            if head:
+                group["text"] = text + group["text"][head:]
+                placed = True
+                break
+        if not placed:
+            groups.append({"key": key, "text": text, "rank": rank})
+
+    # 新拼出的段落可能让两个组首尾相接，再合并一轮
+    merged = True
+    while merged:
+        merged = False
+        for i, left in enumerate(groups):
+            for right in groups[i + 1:]:
+                if left["key"] != right["key"]:
+                    continue
+                size = _overlap_length(left["text"], right["text"], min_overlap, max_overlap)
+                if size:
+                    left["text"] += right["text"][size:]
+                else:
+                    size = _overlap_length(right["text"], left["text"], min_overlap, max_overlap)
+                    if not size:
+                        continue
+                    left["text"] = right["text"] + left["text"][size:]
+                left["rank"] = min(left["rank"], right["rank"])
+                groups.remove(right)
+                merged = True
+                break
+            if merged:
+                break
+
+    groups.sort(key=lambda g: g["rank"])
+    return [g["text"] for g in groups]
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    compact = re.sub(r"\s+", "", text)
+    if len(compact) <= size:
+        return {compact}
+    return {compact[i:i + size] for i in range(len(compact) - size + 1)}
+
+
+def drop_near_duplicates(passages: Sequence[str], threshold: float) -> List[str]:
+    """
+    字符 3-gram 重合度（交集 / 较小集合）超过阈值的段落只保留排名靠前的一个
+    用较小集合做分母，被长段落基本包含的短段落也会被去掉
+    """
+    kept: List[str] = []
+    kept_shingles: List[set] = []
+    for passage in passages:
+        shingles = _shingles(passage)
+        duplicate = any(
+            len(shingles & other) / min(len(shingles), len(other)) >= threshold
+            for other in kept_shingles
+            if shingles and other
+        )
+        if not duplicate:
+            kept.append(passage)
+            kept_shingles.append(shingles)
+    return kept
+
+
+# ==============================================================================
+# Prompt 组装
+# ==============================================================================
+# system_prompt 中人设正文的占位符：超出预算时只截断这一段，规则与知识引导语保持完整
+PERSONA_SLOT = "<<persona>>"
+
+
+def fit_profile_field(text: Optional[str]) -> str:
+    """
+    昵称、语言风格等用户填写的短字段直接写进 system_prompt 的规则部分（可能出现多次），
+    填入前按 PROMPT_BUDGET_PROFILE_FIELD 截断，保证固定部分有上界
+    """
+    return get_tokenizer().truncate(text or "", settings.PROMPT_BUDGET_PROFILE_FIELD)
+
+
+@dataclass
+class PromptBudget:
+    system: int
+    knowledge: int
+    history: int
+    query: int
+    summary: int
+
+    @classmethod
+    def from_settings(cls) -> "PromptBudget":
+        return cls(
+            system=settings.PROMPT_BUDGET_SYSTEM,
+            knowledge=settings.PROMPT_BUDGET_KNOWLEDGE,
+            history=settings.PROMPT_BUDGET_HISTORY,
+            query=settings.PROMPT_BUDGET_QUERY,
+            summary=settings.PROMPT_BUDGET_SUMMARY,
+        )
+
+
+@dataclass
+class AssembledPrompt:
+    messages: List[BaseMessage]
+    raw_tokens: Dict[str, int] = field(default_factory=dict)
+    final_tokens: Dict[str, int] = field(default_factory=dict)
+    passages_used: int = 0
+    history_used: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return sum(self.raw_tokens.values()) - sum(self.final_tokens.values())
+
+
+class PromptAssembler:
+    """
+    按 token 预算组装 RAG 对话 prompt
+    - system：只截断 PERSONA_SLOT 处的人设正文，固定的规则部分不截断（其中的用户字段先经 fit_profile_field 限长）
+    - knowledge：检索结果先合并重叠 chunk、去近似重复，再按排名装入预算
+    - summary：更早对话的滚动摘要（见 session_memory），超出预算时截断
+    - history：从最近一条往前装，装不下的更早消息丢弃
+    - query：超长时截断
+    """
+
+    def __init__(
+        self,
+        *,
+        budget: Optional[PromptBudget] = None,
+        min_overlap: int = 20,
+        max_overlap: int = 200,
+        duplicate_threshold: float = 0.8,
+        max_history_messages: int = 20,
+    ):
+        self.budget = budget or PromptBudget.from_settings()
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.duplicate_threshold = duplicate_threshold
+        self.max_history_messages = max_history_messages
+
+    def _fit_passages(self, passages: Sequence[str], budget: int, separator: str) -> List[str]:
+        tokenizer = get_tokenizer()
+        separator_tokens = tokenizer.count(separator)
+        selected: List[str] = []
+        remaining = budget
+        for passage in passages:
+            joint = separator_tokens if selected else 0
+            cost = tokenizer.count(passage) + joint
+            if cost <= remaining:
+                selected.append(passage)
+                remaining -= cost
+                continue
+            # 剩余预算还够放一段有意义的内容时截断放入，然后停止
+            if remaining - joint >= settings.PROMPT_MIN_PASSAGE_TOKENS:
+                selected.append(tokenizer.truncate(passage, remaining - joint))
+            break
+        return selected
+
+    def _fit_system(self, system_prompt: str, persona: str) -> str:
+        """
+        整段从尾部截断会切掉末尾的规则和知识引导语，因此只截断人设正文；
+        固定部分自身超出预算说明模板或预算配置偏小，记录告警并去掉人设，规则保持完整，不让对话失败
+        """
+        tokenizer = get_tokenizer()
+        fixed_tokens = tokenizer.count(system_prompt.replace(PERSONA_SLOT, ""))
+        if fixed_tokens > self.budget.system:
+            logger.warning(
+                "System prompt instructions need {} tokens, exceeding PROMPT_BUDGET_SYSTEM={}; persona dropped",
+                fixed_tokens,
+                self.budget.system,
+            )
+        persona_text = tokenizer.truncate(persona, self.budget.system - fixed_tokens)
+        return system_prompt.replace(PERSONA_SLOT, persona_text)
+
+    def _fit_history(self, history: Sequence[BaseMessage], budget: int) -> List[BaseMessage]:
+        tokenizer = get_tokenizer()
+        selected: List[BaseMessage] = []
+        remaining = budget
+        for message in reversed(list(history)[-self.max_history_messages:]):
+            cost = tokenizer.count(str(message.content))
+            if cost > remaining:
+                break
+            selected.append(message)
+            remaining -= cost
+        selected.reverse()
+        return selected
+
+    def assemble(
+        self,
+        *,
+        system_prompt: str,
+        docs: Sequence[Document],
+        persona: str = "",
+        history: Sequence[BaseMessage],
+        query: str,
+        summary: Optional[str] = None,
+        separator: str = "\n\n",
+    ) -> AssembledPrompt:
+        """
+        system_prompt 中的知识放在末尾：最终 system 消息 = system_prompt + 整理后的知识 [+ 对话摘要]
+        persona 填入 system_prompt 中的 PERSONA_SLOT（没有占位符时放在最前面）
+        有摘要时 history 应只包含摘要之后的消息
+        """
+        tokenizer = get_tokenizer()
+        if persona and PERSONA_SLOT not in system_prompt:
+            system_prompt = f"{PERSONA_SLOT}\n{system_prompt}"
+        raw_knowledge = separator.join(doc.page_content for doc in docs)
+        raw_history = list(history)[-self.max_history_messages:]
+        raw_tokens = {
+            "system": tokenizer.count(system_prompt.replace(PERSONA_SLOT, persona)),
+            "knowledge": tokenizer.count(raw_knowledge),
+            "history": sum(tokenizer.count(str(m.content)) for m in raw_history),
+            "query": tokenizer.count(query),
+            "summary": tokenizer.count(summary or ""),
+        }
+
+        system_text = self._fit_system(system_prompt, persona)
+        passages = merge_overlapping_chunks(
+            docs, min_overlap=self.min_overlap, max_overlap=self.max_overlap
+        )
+        passages = drop_near_duplicates(passages, self.duplicate_threshold)
+        passages = self._fit_passages(passages, self.budget.knowledge, separator)
+        knowledge_text = separator.join(passages)
+        kept_history = self._fit_history(raw_history, self.budget.history)
+        query_text = tokenizer.truncate(query, self.budget.query)
+        summary_text = tokenizer.truncate(summary or "", self.budget.summary)
+
+        final_tokens = {
+            "system": tokenizer.count(system_text),
+            "knowledge": tokenizer.count(knowledge_text),
+            "history": sum(tokenizer.count(str(m.content)) for m in kept_history),
+            "query": tokenizer.count(query_text),
+            "summary": tokenizer.count(summary_text),
+        }
+
+        system_content = system_text + knowledge_text
+        if summary_text:
+            system_content += f"{separator}【更早的对话摘要】（仅供回忆上下文，不要复述）：\n{summary_text}"
+        messages: List[BaseMessage] = [SystemMessage(content=system_content)]
+        messages.extend(kept_history)
+        messages.append(HumanMessage(content=query_text))
+
+        prompt = AssembledPrompt(
+            messages=messages,
+            raw_tokens=raw_tokens,
+            final_tokens=final_tokens,
+            passages_used=len(passages),
+            history_used=len(kept_history),
+        )
+        logger.info(
+            "Prompt assembled: tokens={} (raw {}), saved={}, docs {} -> passages {}, history {} -> {}",
+            sum(final_tokens.values()),
+            sum(raw_tokens.values()),
+            prompt.tokens_saved,
+            len(docs),
+            len(passages),
+            len(raw_history),
+            len(kept_history),
+        )
+        return prompt
+
+
+def history_to_messages(history) -> List[BaseMessage]:
+    """
+    ChatRequest.history -> langchain 消息（未知角色忽略）
+    """
+    messages: List[BaseMessage] = []
+    for msg in history or []:
+        if msg.role == 'user':
+            messages.append(HumanMessage(content=msg.content))
+        elif msg.role in ['assistant', 'ai']:
+            messages.append(AIMessage(content=msg.content))
+    return messages
+
+
+prompt_assembler = PromptAssembler()
@@ -0,0 +1,110 @@
+import re
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+CacheKey = Tuple[str, str, int]
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    归一化问题文本：全角转半角、大小写、空白折叠
+    """
+    text = unicodedata.normalize("NFKC", query)
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+
+class RetrievalCache:
+    """
+    按 (echo_id, 归一化问题, k) 缓存检索结果
+    - 条数上限 (LRU) + TTL
+    - 每个 echo 维护一个 generation，写入/删除时 +1 并精确清理该 echo 的条目；
+      检索开始前取 generation，写回时不一致则丢弃，避免并发写入后缓存旧结果
+    仅在事件循环中使用，不做线程同步
+    """
+
+    def __init__(self, *, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[CacheKey, Tuple[float, List[Any]]]" = OrderedDict()
+        self._keys_by_echo: Dict[str, Set[CacheKey]] = defaultdict(set)
+        self._generations: Dict[str, int] = defaultdict(int)
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(echo_id: str, query: str, k: int) -> CacheKey:
+        return echo_id, normalize_query(query), k
+
+    def _remove(self, key: CacheKey) -> None:
+        self._entries.pop(key, None)
+        keys = self._keys_by_echo.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                self._keys_by_echo.pop(key[0], None)
+
+    # --------------------------------------------------------------------------
+    def generation(self, echo_id: str) -> int:
+        return self._generations[echo_id]
+
+    def get(self, echo_id: str, query: str, k: int) -> Optional[List[Any]]:
+        key = self._key(echo_id, query, k)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, docs = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return list(docs)
+
+    def put(
+        self, echo_id: str, query: str, k: int, docs: List[Any], generation: int
+    ) -> None:
+        if generation != self._generations[echo_id]:
+            # 检索期间该 echo 的知识发生了变化，结果可能已过期
+            return
+
+        key = self._key(echo_id, query, k)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, list(docs))
+        self._entries.move_to_end(key)
+        self._keys_by_echo[echo_id].add(key)
+
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def invalidate_echo(self, echo_id: str) -> None:
+        self._generations[echo_id] += 1
+        for key in self._keys_by_echo.pop(echo_id, set()):
+            self._entries.pop(key, None)
+        self.invalidations += 1
+
+    def invalidate_all(self) -> None:
+        for echo_id in list(self._generations):
+            self._generations[echo_id] += 1
+        self._entries.clear()
+        self._keys_by_echo.clear()
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,91 @@
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+
+from app.core.config import settings
+from app.services.knowledge_engine import knowledge_engine
+
+# 只保留文字与数字，去掉标点、空白、表情
+_NON_WORD = re.compile(r"[^0-9a-z\u3400-\u4dbf\u4e00-\u9fff]+")
+
+# 整句都由寒暄 / 附和 / 语气词组成
+_SMALL_TALK = re.compile(
+    r"(?:"
+    r"你好|您好|大家好|嗨|哈喽|哈啰|hello|hi|hey|yo|在吗|在不在|在嘛|"
+    r"早|早安|早上好|上午好|中午好|午安|下午好|晚上好|晚安|拜拜|再见|回见|bye|"
+    r"谢谢|多谢|感谢|谢啦|thanks|thx|thankyou|不客气|没事|没关系|"
+    r"好的|好滴|好吧|好呀|好|行|可以|对|对的|是的|是啊|嗯+|恩+|哦+|噢+|喔+|啊+|额+|呃+|"
+    r"ok|okay|收到|了解|明白|知道了|懂了|"
+    r"哈+|呵+|嘿+|嘻+|hh+|haha+|lol|6+|牛|厉害|赞|棒|绝了|笑死|"
+    r"你|您|呀|呢|啦|吧|嘛|哇|耶|了|我"
+    r")+"
+)
+
+# 只问当前时间 / 日期：system prompt 已给出真实时间
+_TIME_QUESTION = re.compile(
+    r"(?:请问)?(?:现在|今天|今日|此刻|当前|明天|昨天)?(?:是)?"
+    r"(?:几点|几点钟|什么时间|几号|几月几号|几月几日|星期几|礼拜几|周几|什么日子|什么日期|日期|时间)"
+    r"(?:了|呀|啊|呢|啦)*(?:吗)?"
+)
+
+# 提问 / 求助类词语：出现即检索
+_QUESTION_HINTS = re.compile(r"什么|怎么|怎样|为什么|为何|哪|谁|多少|如何|是否|介绍|讲讲|说说|推荐|建议|区别|意思")
+
+
+@dataclass
+class GateDecision:
+    retrieve: bool
+    reason: str
+
+
+def classify_query(query: str) -> GateDecision:
+    """
+    纯本地规则判断消息是否需要检索知识（不发网络请求，微秒级）
+    拿不准时一律检索，只有明确的闲聊 / 时间问题才跳过
+    """
+    text = unicodedata.normalize("NFKC", query or "").lower()
+    core = _NON_WORD.sub("", text)
+    if not core:
+        return GateDecision(False, "empty")
+    if _TIME_QUESTION.fullmatch(core):
+        return GateDecision(False, "time")
+    if _SMALL_TALK.fullmatch(core):
+        return GateDecision(False, "small_talk")
+    if _QUESTION_HINTS.search(core) or re.search(r"\d{2,}|[a-z]{3,}", core):
+        return GateDecision(True, "lexical")
+    return GateDecision(True, "default")
+
+
+class RetrievalGate:
+    """
+    RAG 检索门控：在 knowledge_engine.search 之前判断本轮是否值得检索
+    1. 规则分类：寒暄、语气词、问时间等直接跳过（省掉向量化 + Milvus 两次网络往返）
+    2. echo 没有训练过任何知识时跳过；文档数未知（尚未回填）时照常检索
+    """
+
+    def __init__(self):
+        self.decisions: Counter = Counter()
+
+    async def decide(self, query: str, echo_id: str) -> GateDecision:
+        if not settings.RETRIEVAL_GATE_ENABLED:
+            decision = GateDecision(True, "disabled")
+        else:
+            decision = classify_query(query)
+            if decision.retrieve and await knowledge_engine.knowledge_count(echo_id) == 0:
+                decision = GateDecision(False, "no_knowledge")
+        self.decisions[decision.reason] += 1
+        return decision
+
+    def stats(self) -> dict:
+        total = sum(self.decisions.values())
+        skipped = sum(n for reason, n in self.decisions.items() if reason not in ("lexical", "default", "disabled"))
+        return {
+            "total": total,
+            "skipped": skipped,
+            "skip_rate": round(skipped / total, 4) if total else 0.0,
+            "reasons": dict(self.decisions),
+        }
+
+
+retrieval_gate = RetrievalGate()
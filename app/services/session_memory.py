@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from app.core.config import settings
+from app.core.executors import local_store_pool
+from app.core.llm import get_llm
+from app.core.logger import logger
+from app.core.rate_limit import Priority, with_priority
+from app.services.prompt_assembler import get_tokenizer
+
+# 每次写入顺带清理的过期会话条数上限
+PURGE_BATCH = 64
+
+SUMMARY_SYSTEM_PROMPT = """
+你负责维护用户与数字分身之间的长期对话摘要。
+请把【已有摘要】与【新增对话】合并成一份新的摘要：
+1. 保留用户的身份信息、偏好、提过的具体人名/数字/约定，以及尚未解决的问题。
+2. 省略寒暄和重复内容，不要编造对话中没有的信息。
+3. 用第三人称陈述（“用户……”、“分身……”），不超过 {max_chars} 字。
+4. 只输出摘要正文。
+"""
+
+
+def _role(message: BaseMessage) -> str:
+    return "用户" if isinstance(message, HumanMessage) else "分身"
+
+
+def _fingerprint(messages: Sequence[BaseMessage]) -> str:
+    """
+    摘要边界指纹：已并入摘要的最后两条消息
+    只用一条时“好的”“哈哈”这类短消息很容易误匹配
+    """
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(message.type.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(str(message.content).encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+
+@dataclass
+class SessionSummary:
+    summary: str
+    boundary: str        # 已并入摘要的最后两条消息的指纹
+    covered: int         # 累计并入摘要的消息数
+    updated_at: float
+
+
+class SessionMemory:
+    """
+    长对话滚动摘要（按 user_id + echo_id 存储，SQLite WAL，多 worker 共享）
+    - 请求路径只读：摘要替换更早的原始历史，之后只保留摘要边界以后的消息
+    - 响应结束后在后台增量更新：把“超出最近 recent_messages 条”的新消息并入已有摘要
+    - 客户端可能只发送最近一段历史，所以边界用消息指纹在 history 中定位，而不是下标
+    同一会话同时只有一个更新任务，来不及处理的消息会在下次更新时一起并入
+    """
+
+    def __init__(
+        self,
+        *,
+        db_path: Optional[str],
+        recent_messages: int,
+        min_new_messages: int,
+        max_summary_tokens: int,
+        ttl_seconds: int,
+    ):
+        self.recent_messages = recent_messages
+        self.min_new_messages = min_new_messages
+        self.max_summary_tokens = max_summary_tokens
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = self._open_db(db_path or ":memory:")
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.update_failures = 0
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        if db_path != ":memory:":
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS session_summaries (
+                user_id TEXT NOT NULL,
+                echo_id TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                boundary TEXT NOT NULL,
+                covered INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (user_id, echo_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_session_summaries_updated ON session_summaries (updated_at);
+            """
+        )
+        conn.commit()
+        return conn
+
+    # --------------------------------------------------------------------------
+    def load(self, user_id: str, echo_id: str) -> Optional[SessionSummary]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, boundary, covered, updated_at FROM session_summaries"
+                " WHERE user_id = ? AND echo_id = ? AND updated_at >= ?",
+                (user_id, echo_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return SessionSummary(*row) if row else None
+
+    def _save(self, user_id: str, echo_id: str, record: SessionSummary) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO session_summaries"
+                    " (user_id, echo_id, summary, boundary, covered, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_id, echo_id, record.summary, record.boundary, record.covered, record.updated_at),
+                )
+                self._conn.execute(
+                    "DELETE FROM session_summaries WHERE rowid IN ("
+                    " SELECT rowid FROM session_summaries WHERE updated_at < ?"
+                    " ORDER BY updated_at LIMIT ?)",
+                    (record.updated_at - self.ttl_seconds, PURGE_BATCH),
+                )
+
+    def forget(self, user_id: str, echo_id: str) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM session_summaries WHERE user_id = ? AND echo_id = ?", (user_id, echo_id)
+                )
+
+    @staticmethod
+    def _locate_boundary(history: Sequence[BaseMessage], record: Optional[SessionSummary]) -> int:
+        """
+        history 中第一条尚未并入摘要的消息下标；找不到边界时返回 0
+        （客户端的历史窗口已滑过边界，或历史被清空，此时 history 全部视为未摘要）
+        """
+        if record is None:
+            return 0
+        for end in range(len(history), 0, -1):
+            if _fingerprint(history[max(0, end - 2):end]) == record.boundary:
+                return end
+        return 0
+
+    async def recall(
+        self, user_id: str, echo_id: str, history: Sequence[BaseMessage]
+    ) -> Tuple[Optional[str], List[BaseMessage]]:
+        """
+        请求路径：返回 (摘要, 摘要之后的原始消息)
+        """
+        record = await local_store_pool.run(self.load, user_id, echo_id)
+        if record is None:
+            self.misses += 1
+            return None, list(history)
+        self.hits += 1
+        start = self._locate_boundary(history, record)
+        return record.summary, list(history[start:])
+
+    # --------------------------------------------------------------------------
+    def schedule_update(self, user_id: str, echo_id: str, history: Sequence[BaseMessage]) -> None:
+        """
+        响应结束后调用（history 需包含本轮问答），不阻塞请求
+        """
+        if len(history) <= self.recent_messages:
+            return
+        key = (user_id, echo_id)
+        running = self._tasks.get(key)
+        if running is not None and not running.done():
+            return
+        task = asyncio.get_running_loop().create_task(self._update(user_id, echo_id, list(history)))
+        self._tasks[key] = task
+
+        def _discard(finished: asyncio.Task) -> None:
+            if self._tasks.get(key) is finished:
+                del self._tasks[key]
+
+        task.add_done_callback(_discard)
+
+    @with_priority(Priority.INGEST)
+    async def _update(self, user_id: str, echo_id: str, history: List[BaseMessage]) -> None:
+        try:
+            record = await local_store_pool.run(self.load, user_id, echo_id)
+            start = self._locate_boundary(history, record)
+            end = len(history) - self.recent_messages
+            fresh = history[start:end]
+            if len(fresh) < self.min_new_messages:
+                return
+
+            summary = await self._summarize(record.summary if record else "", fresh)
+            updated = SessionSummary(
+                summary=summary,
+                boundary=_fingerprint(history[max(0, end - 2):end]),
+                covered=(record.covered if record else 0) + len(fresh),
+                updated_at=time.time(),
+            )
+            await local_store_pool.run(self._save, user_id, echo_id, updated)
+            self.updates += 1
+            logger.info(
+                "Session summary updated: user_id={}, echo_id={}, folded={}, covered={}",
+                user_id, echo_id, len(fresh), updated.covered,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.update_failures += 1
+            logger.warning("Session summary update failed: user_id={}, echo_id={}, error={!r}", user_id, echo_id, e)
+
+    async def _summarize(self, previous: str, messages: Sequence[BaseMessage]) -> str:
+        dialogue = "\n".join(f"{_role(m)}：{m.content}" for m in messages)
+        llm = get_llm(temperature=0.3, streaming=False)
+        result = await llm.ainvoke([
+            SystemMessage(content=SUMMARY_SYSTEM_PROMPT.format(max_chars=self.max_summary_tokens)),
+            HumanMessage(content=f"【已有摘要】\n{previous or '（无）'}\n\n【新增对话】\n{dialogue}"),
+        ])
+        return get_tokenizer().truncate(str(result.content).strip(), self.max_summary_tokens)
+
+    async def aclose(self) -> None:
+        # 关闭时放弃未完成的更新，下次请求结束后会重新并入
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM session_summaries").fetchone()[0]
+        return {
+            "sessions": sessions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "updates": self.updates,
+            "update_failures": self.update_failures,
+            "updating": sum(1 for task in self._tasks.values() if not task.done()),
+        }
+
+
+session_memory = SessionMemory(
+    db_path=settings.SESSION_MEMORY_PATH or None,
+    recent_messages=settings.SESSION_RECENT_MESSAGES,
+    min_new_messages=settings.SESSION_SUMMARY_MIN_NEW,
+    max_summary_tokens=settings.PROMPT_BUDGET_SUMMARY,
+    ttl_seconds=settings.SESSION_MEMORY_TTL_DAYS * 24 * 3600,
+)
@@ -0,0 +1,233 @@
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.schemas.train_job import TrainJobRequest, TrainJobResponse
+from app.services.ingest_pipeline import IngestProgress
+from app.services.knowledge_trainer import train_from_oss
+
+
+class TrainJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINISHED_STATUSES = {
+    TrainJobStatus.SUCCEEDED,
+    TrainJobStatus.FAILED,
+    TrainJobStatus.CANCELLED,
+}
+
+
+class TrainJobQueueFull(RuntimeError):
+    pass
+
+
+class TrainJobNotCancellable(RuntimeError):
+    pass
+
+
+@dataclass
+class TrainJob:
+    job_id: str
+    request: TrainJobRequest
+    status: TrainJobStatus = TrainJobStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    progress: IngestProgress = field(default_factory=IngestProgress)
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def to_response(self) -> TrainJobResponse:
+        timings = dict(self.progress.snapshot()["stage_timings"])
+        if self.started_at is not None:
+            timings["queued"] = round(self.started_at - self.created_at, 3)
+            end = self.finished_at or time.time()
+            timings["total"] = round(end - self.started_at, 3)
+
+        return TrainJobResponse(
+            job_id=self.job_id,
+            status=self.status.value,
+            priority=self.request.priority,
+            knowledge_id=self.request.knowledge_id,
+            echo_id=self.request.echo_id,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            timings=timings,
+            progress=self.progress.snapshot(),
+            result=self.result,
+            error=self.error,
+        )
+
+
+class TrainJobManager:
+    """
+    进程内训练任务队列
+    - 有界优先级队列，满了直接拒绝（接口层返回 429），避免训练流量挤占对话
+    - 固定数量的 worker 消费，控制同时进行的训练数
+    - 结束的任务保留最近 retention 条供查询
+    """
+
+    def __init__(self, *, workers: int, max_queue_size: int, retention: int):
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.retention = retention
+
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._jobs: "OrderedDict[str, TrainJob]" = OrderedDict()
+        self._worker_tasks: List[asyncio.Task] = []
+        self._seq = itertools.count()
+
+    async def start(self) -> None:
+        if self._worker_tasks:
+            return
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_queue_size)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(i), name=f"train-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info("Train job workers started: workers={}, queue={}", self.workers, self.max_queue_size)
+
+    async def stop(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    # --------------------------------------------------------------------------
+    def submit(self, request: TrainJobRequest) -> TrainJob:
+        if self._queue is None:
+            raise RuntimeError("Train job manager is not started")
+
+        job_id = uuid.uuid4().hex
+        job = TrainJob(
+            job_id=job_id,
+            request=request,
+            progress=IngestProgress(label=job_id),
+        )
+        try:
+            # 优先级越大越先执行；同优先级按提交顺序
+            self._queue.put_nowait((-request.priority, next(self._seq), job_id))
+        except asyncio.QueueFull:
+            raise TrainJobQueueFull(f"Train queue is full ({self.max_queue_size})")
+
+        self._jobs[job_id] = job
+        self._evict_finished()
+        logger.info(
+            "Train job queued: job_id={}, knowledge_id={}, priority={}",
+            job_id, request.knowledge_id, request.priority,
+        )
+        return job
+
+    def get(self, job_id: str) -> Optional[TrainJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[TrainJob]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.status in FINISHED_STATUSES:
+            raise TrainJobNotCancellable(f"Job already {job.status.value}")
+
+        job.cancel_requested = True
+        if job.status == TrainJobStatus.QUEUED:
+            # 仍在队列中：打标记，worker 取到时直接跳过
+            self._finish(job, TrainJobStatus.CANCELLED)
+        elif job.task is not None:
+            job.task.cancel()
+        logger.info("Train job cancel requested: job_id={}", job_id)
+        return job
+
+    def stats(self) -> dict:
+        counts: Dict[str, int] = {status.value: 0 for status in TrainJobStatus}
+        for job in self._jobs.values():
+            counts[job.status.value] += 1
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue_size": self.max_queue_size,
+            "workers": self.workers,
+            "jobs": counts,
+        }
+
+    # --------------------------------------------------------------------------
+    def _finish(self, job: TrainJob, status: TrainJobStatus) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        job.progress.stage = status.value
+
+    def _evict_finished(self) -> None:
+        if len(self._jobs) <= self.retention:
+            return
+        for job_id in [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in FINISHED_STATUSES
+        ][: len(self._jobs) - self.retention]:
+            self._jobs.pop(job_id, None)
+
+    async def _run(self, job: TrainJob) -> dict:
+        request = job.request
+        result = await train_from_oss(
+            knowledge_id=request.knowledge_id,
+            user_id=request.user_id,
+            echo_id=request.echo_id,
+            file_url=request.file_url,
+            file_type=request.file_type,
+            source_name=request.source_name,
+            streaming=request.streaming,
+            upsert=request.upsert,
+            progress=job.progress,
+        )
+        return result.model_dump() if hasattr(result, "model_dump") else dict(result)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            try:
+                job = self._jobs.get(job_id)
+                if job is None or job.status != TrainJobStatus.QUEUED:
+                    continue
+
+                job.status = TrainJobStatus.RUNNING
+                job.started_at = time.time()
+                job.task = asyncio.create_task(self._run(job))
+                try:
+                    job.result = await job.task
+                    self._finish(job, TrainJobStatus.SUCCEEDED)
+                except asyncio.CancelledError:
+                    self._finish(job, TrainJobStatus.CANCELLED)
+                    if not job.cancel_requested:
+                        # worker 自身被取消（服务关闭），继续向上抛
+                        raise
+                except Exception as e:
+                    logger.exception("Train job failed: job_id={}, error={}", job_id, e)
+                    job.error = str(e)
+                    self._finish(job, TrainJobStatus.FAILED)
+                finally:
+                    job.task = None
+                logger.info(
+                    "Train job {} finished on worker {}: status={}",
+                    job_id, index, job.status.value,
+                )
+            finally:
+                self._queue.task_done()
+
+
+train_job_manager = TrainJobManager(
+    workers=settings.TRAIN_JOB_WORKERS,
+    max_queue_size=settings.TRAIN_JOB_QUEUE_SIZE,
+    retention=settings.TRAIN_JOB_RETENTION,
+)
@@ -0,0 +1,467 @@
+"""
+知识库向量存储后端
+- milvus: 生产环境，独立的 Milvus 服务（默认）
+- numpy: 进程内索引，按 echo 分区的 float32 矩阵 + 内存映射文件，本地开发 / CI / 单机小规模部署无需 Milvus
+
+除 asearch / aclose 外的方法都是同步的，KnowledgeEngine 放进 app.core.executors 的执行器中调用
+"""
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import Milvus
+from pymilvus import connections, utility, Collection
+
+from app.core.config import settings
+from app.core.executors import indexing_pool, retrieval_pool
+from app.core.logger import logger
+from app.services.milvus_schema import (
+    EXTRA_FIELD,
+    FIELD_DEFAULTS,
+    PRIMARY_FIELD,
+    TEXT_FIELD,
+    ensure_knowledge_collection,
+    is_managed,
+    is_quantized_index,
+    pack_extra,
+    unpack_extra,
+    vector_index_params,
+    vector_index_type,
+    vector_search_params,
+)
+
+
+class VectorStore(ABC):
+    """
+    向量存储接口。检索结果的 metadata 中带主键 PRIMARY_FIELD（"pk"），
+    关键词索引、RRF 融合与 MMR 补取向量都以它为 chunk 的唯一标识
+    """
+
+    backend: str = ""
+
+    def ensure_ready(self) -> None:
+        """
+        连接 / 建表等准备工作，可重复调用
+        """
+
+    @abstractmethod
+    def insert(
+        self, texts: List[str], embeddings: List[List[float]], metadatas: List[dict]
+    ) -> List[int]:
+        """
+        写入已向量化的 chunk，返回主键
+        """
+
+    @abstractmethod
+    def delete_pks(self, pks: Sequence[int]) -> None:
+        ...
+
+    @abstractmethod
+    def delete_knowledge(self, knowledge_ids: Sequence[int], echo_id: Optional[str] = None) -> None:
+        """
+        按 knowledge_id 删除；echo_id 为空时删除所有 echo 下的（对应 batch_delete）
+        """
+
+    @abstractmethod
+    def search(
+        self, embedding: List[float], echo_id: str, k: int, with_vectors: bool = False
+    ) -> Tuple[List[Document], Dict[Any, np.ndarray]]:
+        """
+        echo 内的向量检索，按相似度从高到低；with_vectors=True 时同时返回命中 chunk 的向量（供 MMR）
+        """
+
+    async def asearch(
+        self, embedding: List[float], echo_id: str, k: int, with_vectors: bool = False
+    ) -> Tuple[List[Document], Dict[Any, np.ndarray]]:
+        """
+        对话检索入口：默认在检索执行器的线程中调用 search，客户端支持时子类改为原生异步
+        """
+        return await retrieval_pool.run(self.search, embedding, echo_id, k, with_vectors)
+
+    @abstractmethod
+    def fetch_vectors(self, pks: Sequence[int]) -> Dict[Any, np.ndarray]:
+        """
+        按主键取向量，不存在的主键直接忽略
+        """
+
+    @abstractmethod
+    def iter_rows(
+        self,
+        echo_id: str,
+        fields: Optional[Sequence[str]] = None,
+        *,
+        knowledge_id: Optional[int] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[List[dict]]:
+        """
+        分批遍历某 echo 的 chunk（不含向量），每行带主键与 fields 中存在的字段；
+        fields 为空时返回正文与全部 metadata
+        """
+
+    async def aclose(self) -> None:
+        """
+        释放异步客户端等资源
+        """
+
+    def stats(self) -> dict:
+        return {"backend": self.backend}
+
+
+def exact_scores(matrix: np.ndarray, query: List[float], metric_type: str) -> np.ndarray:
+    """
+    float32 精确相似度，越大越相关（L2 取负距离）
+    """
+    q = np.asarray(query, dtype=np.float32)
+    metric_type = metric_type.upper()
+    if metric_type == "L2":
+        return -np.square(matrix - q).sum(axis=1)
+    dots = matrix @ q
+    if metric_type == "COSINE":
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(q) or 1.0)
+        norms[norms == 0] = 1.0
+        return dots / norms
+    return dots
+
+
+def create_vector_store(embeddings: Embeddings) -> VectorStore:
+    backend = settings.VECTOR_STORE_BACKEND.lower()
+    if backend == "milvus":
+        return MilvusVectorStore(embeddings, collection_name=settings.MILVUS_COLLECTION)
+    if backend == "numpy":
+        from app.services.numpy_vector_store import NumpyVectorStore
+
+        return NumpyVectorStore(
+            settings.NUMPY_STORE_DIR,
+            metric_type=settings.MILVUS_METRIC_TYPE,
+            quantization=settings.VECTOR_QUANTIZATION,
+            rescore_factor=settings.VECTOR_RESCORE_FACTOR,
+        )
+    raise ValueError(f"Unsupported VECTOR_STORE_BACKEND: {settings.VECTOR_STORE_BACKEND}")
+
+
+# ==============================================================================
+# Milvus
+# ==============================================================================
+def check_milvus_connection() -> None:
+    try:
+        connections.connect(
+            alias="default",
+            host=settings.MILVUS_HOST,
+            port=settings.MILVUS_PORT,
+        )
+        utility.list_collections()
+    except Exception as e:
+        raise RuntimeError(
+            "\n❌ Milvus NOT available.\n"
+            "Please start Milvus:\n\n"
+            "docker run -d -p 19530:19530 -p 9091:9091 milvusdb/milvus:v2.4.0\n\n"
+            "or set VECTOR_STORE_BACKEND=numpy for local development.\n\n"
+            f"Original error: {e}"
+        )
+
+
+def _unpack_docs(docs: List[Document]) -> List[Document]:
+    for doc in docs:
+        unpack_extra(doc.metadata)
+    return docs
+
+
+class MilvusVectorStore(VectorStore):
+    """
+    基于 langchain Milvus 封装：沿用其建表 / 文档解析逻辑，写入与检索直接操作底层 Collection
+    对话检索（asearch）优先走 pymilvus AsyncMilvusClient，不占线程；客户端不可用时退回线程
+    """
+
+    backend = "milvus"
+
+    def __init__(self, embeddings: Embeddings, *, collection_name: str):
+        self.embeddings = embeddings
+        self.collection_name = collection_name
+        self._store: Optional[Milvus] = None
+        self._rescore_factor = 1
+        self._index_type: Optional[str] = None
+        self._async_client = None
+        self._async_unavailable = not settings.MILVUS_ASYNC_CLIENT
+
+    def ensure_ready(self) -> None:
+        if self._store is not None:
+            return
+        # ⚠️ 注意：uvicorn --reload 下这里会执行两次
+        check_milvus_connection()
+        managed = False
+        index_type = None
+        if settings.MILVUS_MANAGED_SCHEMA:
+            # 显式 schema（echo_id 为 partition key）+ 索引 + 加载；旧布局请用 milvus_schema migrate 迁移
+            collection = ensure_knowledge_collection(self.collection_name, settings.EMBEDDING_DIM)
+            managed = is_managed(collection)
+            index_type = vector_index_type(collection)
+            if managed and index_type and index_type != settings.MILVUS_INDEX_TYPE.upper():
+                logger.warning(
+                    "Milvus collection {} has a {} vector index but MILVUS_INDEX_TYPE={}; "
+                    "using the existing index (drop and rebuild it to switch)",
+                    self.collection_name, index_type, settings.MILVUS_INDEX_TYPE,
+                )
+        self._store = Milvus(
+            embedding_function=self.embeddings,
+            collection_name=self.collection_name,
+            connection_args={
+                "host": settings.MILVUS_HOST,
+                "port": settings.MILVUS_PORT,
+            },
+            auto_id=True,  # <--- 【关键修改】开启自动 ID 生成
+            index_params=vector_index_params() if managed else None,
+            search_params=vector_search_params(index_type) if managed else None,
+        )
+        self._index_type = index_type
+        if managed and index_type and is_quantized_index(index_type):
+            self._rescore_factor = max(1, settings.VECTOR_RESCORE_FACTOR)
+
+    @property
+    def _col(self) -> Optional[Collection]:
+        self.ensure_ready()
+        col = self._store.col
+        return col if isinstance(col, Collection) else None
+
+    def insert(
+        self, texts: List[str], embeddings: List[List[float]], metadatas: List[dict]
+    ) -> List[int]:
+        """
+        与 Milvus.add_texts 的写入逻辑一致，只是跳过了其内部的向量化
+        """
+        self.ensure_ready()
+        store = self._store
+        if not isinstance(store.col, Collection):
+            # 集合不存在时由 langchain 按首条数据推断 schema 并创建
+            store._init(embeddings=embeddings, metadatas=metadatas)
+
+        insert_dict = {
+            store._text_field: texts,
+            store._vector_field: embeddings,
+        }
+        metadata_fields = [
+            x for x in store.fields
+            if x not in (store._primary_field, store._text_field, store._vector_field)
+        ]
+        if EXTRA_FIELD in store.fields:
+            metadatas = [pack_extra(metadata) for metadata in metadatas]
+        else:
+            # 旧布局（或加 extra 字段之前建的集合）没有地方存固定列之外的键，明确告警而不是静默丢弃
+            dropped = {key for metadata in metadatas for key in metadata} - set(store.fields)
+            if dropped:
+                logger.warning(
+                    "Milvus collection {} has no {} field; dropping metadata keys {}",
+                    self.collection_name, EXTRA_FIELD, sorted(dropped),
+                )
+        for key in metadata_fields:
+            values = [metadata.get(key) for metadata in metadatas]
+            if all(value is None for value in values) and key not in FIELD_DEFAULTS:
+                continue
+            # 列式写入要求每行都有值（显式 schema 每一列都要给），缺失的字段用 schema 缺省值补齐
+            insert_dict[key] = [
+                FIELD_DEFAULTS.get(key) if value is None else value for value in values
+            ]
+
+        insert_list = [insert_dict[x] for x in store.fields if x in insert_dict]
+        result = store.col.insert(insert_list, timeout=store.timeout)
+        return list(result.primary_keys)
+
+    def delete_pks(self, pks: Sequence[int]) -> None:
+        col = self._col
+        if col is None:
+            return
+        for i in range(0, len(pks), 1000):
+            ids_str = ", ".join(map(str, pks[i:i + 1000]))
+            col.delete(f"{self._store._primary_field} in [{ids_str}]")
+
+    def delete_knowledge(self, knowledge_ids: Sequence[int], echo_id: Optional[str] = None) -> None:
+        # knowledge_id 是 int 类型，不需要引号；echo_id 是 string，需要引号
+        ids_str = ", ".join(str(int(k)) for k in knowledge_ids)
+        expr = f"knowledge_id in [{ids_str}]"
+        if echo_id is not None:
+            expr += f' and echo_id == "{echo_id}"'
+        logger.info("Deleting vectors with expr: {}", expr)
+        col = self._col
+        if col is None:
+            col = Collection(self.collection_name)
+        col.delete(expr)
+
+    def search(
+        self, embedding: List[float], echo_id: str, k: int, with_vectors: bool = False
+    ) -> Tuple[List[Document], Dict[Any, np.ndarray]]:
+        # [修改点]: 字段不再带 metadata["..."]，直接使用字段名
+        expr = f'echo_id == "{echo_id}"'
+        self.ensure_ready()
+        rescore = self._rescore_factor > 1
+        if not with_vectors and not rescore:
+            docs = self._store.similarity_search_by_vector(embedding, k=k, expr=expr)
+            return _unpack_docs(docs), {}
+
+        docs, vectors = self._search_with_vectors(embedding, k * self._rescore_factor, expr)
+        return self._finish_search(docs, vectors, embedding, k, with_vectors)
+
+    def _finish_search(
+        self,
+        docs: List[Document],
+        vectors: Dict[Any, np.ndarray],
+        embedding: List[float],
+        k: int,
+        with_vectors: bool,
+    ) -> Tuple[List[Document], Dict[Any, np.ndarray]]:
+        docs = _unpack_docs(docs)
+        if self._rescore_factor > 1 and docs:
+            # 量化索引的距离是近似值：多取候选，按原始 float32 向量重新计算距离后截取前 k 个
+            matrix = np.vstack([vectors[doc.metadata.get(PRIMARY_FIELD)] for doc in docs])
+            order = np.argsort(-exact_scores(matrix, embedding, settings.MILVUS_METRIC_TYPE), kind="stable")
+            docs = [docs[i] for i in order[:k]]
+        if not with_vectors:
+            return docs, {}
+        return docs, {doc.metadata.get(PRIMARY_FIELD): vectors[doc.metadata.get(PRIMARY_FIELD)] for doc in docs}
+
+    def _search_with_vectors(
+        self, embedding: List[float], limit: int, expr: str
+    ) -> Tuple[List[Document], Dict[Any, np.ndarray]]:
+        """
+        与 similarity_search_by_vector 相同，但同时取回命中 chunk 的原始向量
+        """
+        store = self._store
+        if not isinstance(store.col, Collection):
+            return [], {}
+        output_fields = store.fields[:]
+        result = store.col.search(
+            data=[embedding],
+            anns_field=store._vector_field,
+            param=store.search_params,
+            limit=limit,
+            expr=expr,
+            output_fields=output_fields,
+            timeout=store.timeout,
+        )
+        docs, vectors = [], {}
+        for hit in result[0]:
+            data = {x: hit.entity.get(x) for x in output_fields}
+            vector = data.pop(store._vector_field)
+            doc = store._parse_document(data)
+            docs.append(doc)
+            vectors[doc.metadata.get(store._primary_field)] = np.asarray(vector, dtype=np.float32)
+        return docs, vectors
+
+    # --------------------------------------------------------------------------
+    def _get_async_client(self):
+        """
+        懒创建 AsyncMilvusClient（需在事件循环中创建）；创建失败后不再尝试，检索退回线程
+        """
+        if self._async_client is None and not self._async_unavailable:
+            try:
+                from pymilvus import AsyncMilvusClient
+
+                self._async_client = AsyncMilvusClient(
+                    uri=f"http://{settings.MILVUS_HOST}:{settings.MILVUS_PORT}"
+                )
+            except Exception as e:
+                self._async_unavailable = True
+                logger.warning("AsyncMilvusClient unavailable, searching in threads: {!r}", e)
+        return self._async_client
+
+    async def asearch(
+        self, embedding: List[float], echo_id: str, k: int, with_vectors: bool = False
+    ) -> Tuple[List[Document], Dict[Any, np.ndarray]]:
+        if self._store is None:
+            await indexing_pool.run(self.ensure_ready)
+        client = self._get_async_client()
+        if client is None:
+            return await super().asearch(embedding, echo_id, k, with_vectors)
+        store = self._store
+        if not isinstance(store.col, Collection):
+            return [], {}
+
+        # 与同步路径一致：需要向量（MMR / 精排）时一并取回，精排时多取候选
+        need_vectors = with_vectors or self._rescore_factor > 1
+        output_fields = [x for x in store.fields if need_vectors or x != store._vector_field]
+        async with retrieval_pool.slot():
+            result = await client.search(
+                collection_name=self.collection_name,
+                data=[embedding],
+                filter=f'echo_id == "{echo_id}"',
+                limit=k * self._rescore_factor,
+                output_fields=output_fields,
+                search_params=store.search_params,
+                anns_field=store._vector_field,
+                timeout=store.timeout,
+            )
+
+        docs, vectors = [], {}
+        for hit in result[0] if result else []:
+            entity = hit.get("entity") or {}
+            data = {x: entity.get(x) for x in output_fields}
+            data[store._primary_field] = hit.get("id", data.get(store._primary_field))
+            vector = data.pop(store._vector_field, None)
+            doc = store._parse_document(data)
+            docs.append(doc)
+            if vector is not None:
+                vectors[doc.metadata.get(store._primary_field)] = np.asarray(vector, dtype=np.float32)
+        return self._finish_search(docs, vectors, embedding, k, with_vectors)
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            client, self._async_client = self._async_client, None
+            await client.close()
+
+    def fetch_vectors(self, pks: Sequence[int]) -> Dict[Any, np.ndarray]:
+        col = self._col
+        if not pks or col is None:
+            return {}
+        store = self._store
+        ids_str = ", ".join(map(str, pks))
+        rows = col.query(
+            expr=f"{store._primary_field} in [{ids_str}]",
+            output_fields=[store._primary_field, store._vector_field],
+        )
+        return {
+            row[store._primary_field]: np.asarray(row[store._vector_field], dtype=np.float32)
+            for row in rows
+        }
+
+    def iter_rows(
+        self,
+        echo_id: str,
+        fields: Optional[Sequence[str]] = None,
+        *,
+        knowledge_id: Optional[int] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[List[dict]]:
+        col = self._col
+        if col is None:
+            return
+        store = self._store
+        if fields is None:
+            output_fields = [x for x in store.fields if x != store._vector_field]
+        else:
+            # 旧布局的集合可能缺少部分字段，只取存在的
+            output_fields = [store._primary_field] + [
+                x for x in fields if x in store.fields and x != store._primary_field
+            ]
+        expr = f'echo_id == "{echo_id}"'
+        if knowledge_id is not None:
+            expr = f"knowledge_id == {int(knowledge_id)} and {expr}"
+
+        iterator = col.query_iterator(batch_size=batch_size, expr=expr, output_fields=output_fields)
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                yield [unpack_extra(row) for row in rows]
+        finally:
+            iterator.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "collection": self.collection_name,
+            "ready": self._store is not None,
+            "index_type": self._index_type or settings.MILVUS_INDEX_TYPE,
+            "rescore_factor": self._rescore_factor,
+            "async_client": self._async_client is not None,
+        }
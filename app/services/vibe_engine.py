@@ -1,9 +1,24 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
+from typing import AsyncIterator, Tuple
+
+from app.core.config import settings
 from app.core.llm import get_llm
 from app.core.logger import logger
+from app.core.rate_limit import Priority, with_priority
+from app.core.sse import sse_event
+from app.schemas.vibe import VibeBatchRequest, VibeCheckRequest
+from app.services.profile_index import profile_index
 import json
 import asyncio
+import anyio
+
+# 裁判失败时的兜底结果；fallback 标记它不是真实评分，批量匹配据此记为配对失败、不参与排名
+JUDGE_FALLBACK = {
+    "score": 60,
+    "summary": "AI 裁判看懵了，觉得这俩人深不可测，暂定 60 分吧。",
+    "fallback": True,
+}
 
 
 class VibeEngine:
@@ -13,7 +28,23 @@ class VibeEngine:
 
     async def simulate_conversation(self, user_a_profile: dict, user_b_profile: dict, rounds: int = 5):
         """
-        模拟两个 AI 之间的对话 (逻辑保持不变)
+        模拟两个 AI 之间的对话，等全部轮次结束后一次性返回
+        """
+        chat_log = []
+        async for event, data in self.stream_conversation(user_a_profile, user_b_profile, rounds):
+            if event == "turn_end":
+                chat_log.append({"role": data["role"], "content": data["content"]})
+        return chat_log
+
+    async def stream_conversation(
+        self, user_a_profile: dict, user_b_profile: dict, rounds: int = 5
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        逐 token 产出对话过程：(事件名, 数据)
+        - turn_start: {index, role, name}
+        - delta: {index, role, content}  本轮新生成的片段
+        - turn_end: {index, role, name, content}  本轮完整内容
+        破冰语是 index=0 的 A 发言
         """
         # --- 第一步：生成动态破冰语 ---
         logger.info(
@@ -42,13 +73,19 @@ class VibeEngine:
 
         icebreaker_chain = icebreaker_prompt | self.llm | StrOutputParser()
 
-        first_message = await icebreaker_chain.ainvoke({
+        pieces = []
+        yield "turn_start", {"index": 0, "role": "A", "name": user_a_profile['name']}
+        async for piece in icebreaker_chain.astream({
             "name_a": user_a_profile['name'],
             "style_a": user_a_profile['style'],
             "interests_a": user_a_profile['interests'],
             "name_b": user_b_profile['name'],
             "interests_b": user_b_profile['interests']
-        })
+        }):
+            pieces.append(piece)
+            yield "delta", {"index": 0, "role": "A", "content": piece}
+        first_message = "".join(pieces)
+        yield "turn_end", {"index": 0, "role": "A", "name": user_a_profile['name'], "content": first_message}
 
         logger.info("✨ 破冰语生成: {}", first_message)
 
@@ -98,40 +135,37 @@ class VibeEngine:
                 history_text += f"{speaker_name}: {log['content']}\n"
 
             if current_speaker == "B":
-                logger.info("💭 {} (B) 正在思考...", user_b_profile.get("name"))
-                response = await chat_chain.ainvoke({
-                    "name": user_b_profile['name'],
-                    "mbti": user_b_profile['mbti'],
-                    "interests": user_b_profile['interests'],
-                    "style": user_b_profile['style'],
-                    "target_name": user_a_profile['name'],
-                    "history": history_text,
-                    "last_message": f"{user_a_profile['name']} 说: {last_msg_content}"
-                })
-                chat_log.append({"role": "B", "content": response})
-                last_msg_content = response
-                current_speaker = "A"
+                speaker, listener = user_b_profile, user_a_profile
             else:
-                logger.info("💭 {} (A) 正在思考...", user_a_profile.get("name"))
-                response = await chat_chain.ainvoke({
-                    "name": user_a_profile['name'],
-                    "mbti": user_a_profile['mbti'],
-                    "interests": user_a_profile['interests'],
-                    "style": user_a_profile['style'],
-                    "target_name": user_b_profile['name'],
-                    "history": history_text,
-                    "last_message": f"{user_b_profile['name']} 说: {last_msg_content}"
-                })
-                chat_log.append({"role": "A", "content": response})
-                last_msg_content = response
-                current_speaker = "B"
+                speaker, listener = user_a_profile, user_b_profile
+            logger.info("💭 {} ({}) 正在思考...", speaker.get("name"), current_speaker)
 
-        return chat_log
+            turn = i + 1
+            pieces = []
+            yield "turn_start", {"index": turn, "role": current_speaker, "name": speaker['name']}
+            async for piece in chat_chain.astream({
+                "name": speaker['name'],
+                "mbti": speaker['mbti'],
+                "interests": speaker['interests'],
+                "style": speaker['style'],
+                "target_name": listener['name'],
+                "history": history_text,
+                "last_message": f"{listener['name']} 说: {last_msg_content}"
+            }):
+                pieces.append(piece)
+                yield "delta", {"index": turn, "role": current_speaker, "content": piece}
+            response = "".join(pieces)
+            yield "turn_end", {"index": turn, "role": current_speaker, "name": speaker['name'], "content": response}
+
+            chat_log.append({"role": current_speaker, "content": response})
+            last_msg_content = response
+            current_speaker = "A" if current_speaker == "B" else "B"
 
     async def analyze_result(self, chat_log: list):
         """
         AI 裁判：打分 + 毒舌评价
         返回格式: dict {"score": int, "summary": str}
+        裁判调用或解析失败时返回 JUDGE_FALLBACK 的副本，带 fallback=True 与 error
         """
         judge_prompt = ChatPromptTemplate.from_template("""
         请作为一名“毒舌情感分析师”，阅读以下聊天记录，并生成一份 JSON 格式的分析报告。
@@ -170,7 +204,139 @@ class VibeEngine:
             return result_json
         except Exception as e:
             logger.exception("JSON 解析失败，启用兜底逻辑: {}", e)
-            return {
-                "score": 60,
-                "summary": "AI 裁判看懵了，觉得这俩人深不可测，暂定 60 分吧。"
-            }
+            return {**JUDGE_FALLBACK, "error": str(e) or type(e).__name__}
+
+
+@with_priority(Priority.VIBE)
+async def vibe_check_event_stream(request: VibeCheckRequest):
+    """
+    同频测试 SSE 生成器：对话逐 token 推送，最后推送裁判结果
+    事件顺序：turn_start / delta / turn_end（每轮重复）-> result，出错时以 error 结束
+    """
+    try:
+        engine = VibeEngine()
+        chat_log = []
+        async for event, data in engine.stream_conversation(
+            request.user_a, request.user_b, rounds=request.rounds
+        ):
+            if event == "turn_end":
+                chat_log.append({"role": data["role"], "content": data["content"]})
+            yield sse_event(event, data)
+
+        analysis_result = await engine.analyze_result(chat_log)
+        yield sse_event("result", {
+            "status": "success",
+            "session_id": request.session_id,
+            "score": analysis_result.get("score", 0),
+            "summary": analysis_result.get("summary", "AI 正在思考人生..."),
+            "fallback": bool(analysis_result.get("fallback")),
+            "dialogue": chat_log,
+        })
+    except Exception as e:
+        logger.exception("Vibe check stream failed: session_id={}, error={}", request.session_id, e)
+        yield sse_event("error", {"session_id": request.session_id, "detail": "AI 服务内部错误"})
+
+
+@with_priority(Priority.VIBE)
+async def vibe_batch_event_stream(request: VibeBatchRequest):
+    """
+    批量同频匹配 SSE 生成器：user_a 与所有候选人并发配对（受 VIBE_BATCH_CONCURRENCY 限制）
+    每完成一对推送一条 pair_result，全部结束后推送按分数排序的 ranking
+    单个配对失败/超时（含裁判失败返回兜底分）只记为该配对的 error，不影响整批，也不参与排名；粗排失败时以 error 结束
+    """
+    engine = VibeEngine()
+    semaphore = asyncio.Semaphore(settings.VIBE_BATCH_CONCURRENCY)
+
+    pairs = list(enumerate(request.candidates))
+    if request.shortlist_k and len(pairs) > request.shortlist_k:
+        # 先用画像向量粗排，只让前 K 个候选人进入多轮 LLM 模拟
+        try:
+            shortlisted = await profile_index.ashortlist(
+                request.user_a,
+                top_k=request.shortlist_k,
+                candidates=request.candidates,
+            )
+        except Exception as e:
+            # 粗排失败（向量化 / 索引错误）时与 vibe_check 一致，以 error 事件结束
+            logger.exception("Vibe batch shortlist failed: session_id={}, error={}", request.session_id, e)
+            yield sse_event("error", {"session_id": request.session_id, "detail": "AI 服务内部错误"})
+            return
+        pairs = [(item["position"], request.candidates[item["position"]]) for item in shortlisted]
+        yield sse_event("shortlist", {
+            "session_id": request.session_id,
+            "total": len(request.candidates),
+            "shortlisted": [
+                {"index": item["position"], "candidate_id": item["candidate_id"], "score": item["score"]}
+                for item in shortlisted
+            ],
+        })
+
+    async def run_pair(index: int, candidate: dict) -> dict:
+        result = {
+            "index": index,
+            "candidate_id": candidate.get("id"),
+            "name": candidate.get("name"),
+        }
+        try:
+            async with semaphore:
+                with anyio.fail_after(settings.VIBE_BATCH_PAIR_TIMEOUT):
+                    dialogue = await engine.simulate_conversation(
+                        request.user_a, candidate, rounds=request.rounds
+                    )
+                    analysis_result = await engine.analyze_result(dialogue)
+            # 裁判输出未经校验：非对象、分数为字符串或非数字时记为该配对失败
+            if not isinstance(analysis_result, dict):
+                raise ValueError(f"judge returned {type(analysis_result).__name__}, expected object")
+            # 兜底分不是真实评分，不能混进排名
+            if analysis_result.get("fallback"):
+                raise ValueError(f"judge failed: {analysis_result.get('error', 'fallback result')}")
+            score = int(float(analysis_result.get("score", 0)))
+            summary = analysis_result.get("summary", "AI 正在思考人生...")
+        except Exception as e:
+            logger.warning(
+                "Vibe batch pair failed: session_id={}, index={}, error={!r}",
+                request.session_id, index, e,
+            )
+            return {**result, "status": "error", "score": None, "error": str(e) or type(e).__name__}
+
+        return {
+            **result,
+            "status": "success",
+            "score": score,
+            "summary": summary,
+            "dialogue": dialogue,
+        }
+
+    logger.info(
+        "🚀 开始批量同频匹配: session_id={}, candidates={}",
+        request.session_id,
+        len(pairs),
+    )
+    tasks = [
+        asyncio.create_task(run_pair(index, candidate))
+        for index, candidate in pairs
+    ]
+    results = []
+    try:
+        for finished in asyncio.as_completed(tasks):
+            result = await finished
+            results.append(result)
+            yield sse_event("pair_result", result)
+    finally:
+        # 客户端断开时取消仍在进行的配对
+        for task in tasks:
+            task.cancel()
+
+    ranked = sorted(
+        (r for r in results if r["status"] == "success"),
+        key=lambda r: (-r["score"], r["index"]),
+    )
+    yield sse_event("ranking", {
+        "session_id": request.session_id,
+        "succeeded": len(ranked),
+        "failed": len(results) - len(ranked),
+        "ranking": [
+            {k: r.get(k) for k in ("index", "candidate_id", "name", "status", "score", "summary")}
+            for r in ranked
+        ],
+    })
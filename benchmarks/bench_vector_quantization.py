@@ -0,0 +1,158 @@
+"""
+向量压缩基准：float32 基线 vs float16 / int8（numpy 后端，可选精排），及 Milvus IVF_SQ8 / IVF_PQ
+输出每百万 chunk 的检索内存占用与 recall@k（相对 float32 精确检索）
+
+用法（在仓库根目录）:
+    python -m benchmarks.bench_vector_quantization --chunks 50000 --dim 1536 --queries 200
+    python -m benchmarks.bench_vector_quantization --milvus   # 另外在本地 Milvus 上测 IVF_SQ8 / IVF_PQ
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.numpy_vector_store import NumpyVectorStore
+
+ECHO_ID = "bench"
+MILLION = 1_000_000
+
+
+def build_vectors(n: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    # 聚类分布更接近真实文本向量：同一文档的 chunk 彼此相近
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_queries(vectors: np.ndarray, count: int, rng: np.random.Generator) -> np.ndarray:
+    picks = vectors[rng.integers(0, len(vectors), size=count)]
+    queries = picks + 0.3 * rng.normal(size=picks.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    return queries.astype(np.float32)
+
+
+def load_store(directory: str, vectors: np.ndarray, quantization: str, rescore_factor: int) -> NumpyVectorStore:
+    store = NumpyVectorStore(directory, quantization=quantization, rescore_factor=rescore_factor)
+    if not store.stats()["chunks"]:
+        for start in range(0, len(vectors), 5000):
+            block = vectors[start:start + 5000]
+            store.insert(
+                [str(start + i) for i in range(len(block))],
+                block,
+                [{"echo_id": ECHO_ID} for _ in range(len(block))],
+            )
+    return store
+
+
+def top_ids(store: NumpyVectorStore, queries: np.ndarray, k: int) -> tuple[List[List[str]], float]:
+    results = []
+    started = time.perf_counter()
+    for query in queries:
+        docs, _ = store.search(query, ECHO_ID, k)
+        results.append([doc.page_content for doc in docs])
+    return results, (time.perf_counter() - started) / len(queries) * 1000
+
+
+def recall(results: List[List[str]], baseline: List[List[str]], k: int) -> float:
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(results, baseline)]))
+
+
+def report(label: str, bytes_per_vector: float, recall_at_k: float, latency_ms: float) -> None:
+    print(
+        f"{label:<28} {bytes_per_vector:10.0f} B  {bytes_per_vector * MILLION / 1024 ** 3:8.2f} GB/M"
+        f"  recall={recall_at_k:.4f}  {latency_ms:7.2f} ms/query"
+    )
+
+
+def bench_numpy(vectors: np.ndarray, queries: np.ndarray, k: int, rescore_factor: int) -> List[List[str]]:
+    directory = tempfile.mkdtemp(prefix="bench_vectors_")
+    try:
+        base = load_store(directory, vectors, "none", 1)
+        baseline, latency = top_ids(base, queries, k)
+        report("numpy float32 (baseline)", base.stats()["search_bytes"] / len(vectors), 1.0, latency)
+        del base
+
+        # 同一份 float32 文件，换量化方式重新打开即可
+        for quantization in ("float16", "int8"):
+            for factor in (1, rescore_factor):
+                store = load_store(directory, vectors, quantization, factor)
+                results, latency = top_ids(store, queries, k)
+                label = f"numpy {quantization}" + (f" + rescore x{factor}" if factor > 1 else "")
+                report(label, store.stats()["search_bytes"] / len(vectors), recall(results, baseline, k), latency)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return baseline
+
+
+def bench_milvus(vectors: np.ndarray, queries: np.ndarray, k: int, baseline: List[List[str]]) -> None:
+    from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
+
+    from app.services.milvus_schema import vector_index_params, vector_search_params
+
+    connections.connect(alias="default", host=settings.MILVUS_HOST, port=settings.MILVUS_PORT)
+    dim = vectors.shape[1]
+    schema = CollectionSchema([
+        FieldSchema("pk", DataType.INT64, is_primary=True),
+        FieldSchema("vector", DataType.FLOAT_VECTOR, dim=dim),
+    ])
+    for index_type in ("FLAT", "IVF_SQ8", "IVF_PQ"):
+        name = f"bench_quantization_{index_type.lower()}"
+        if utility.has_collection(name):
+            utility.drop_collection(name)
+        col = Collection(name, schema=schema)
+        try:
+            for start in range(0, len(vectors), 5000):
+                block = vectors[start:start + 5000]
+                col.insert([list(range(start, start + len(block))), block.tolist()])
+            col.flush()
+            settings.MILVUS_INDEX_TYPE = index_type
+            settings.MILVUS_METRIC_TYPE = "L2"
+            col.create_index("vector", vector_index_params())
+            col.load()
+            utility.wait_for_loading_complete(name)
+            mem = sum(segment.mem_size for segment in utility.get_query_segment_info(name))
+
+            started = time.perf_counter()
+            hits = col.search(queries, "vector", vector_search_params(), limit=k)
+            latency = (time.perf_counter() - started) / len(queries) * 1000
+            results = [[str(hit.id) for hit in result] for result in hits]
+            report(f"milvus {index_type}", mem / len(vectors), recall(results, baseline, k), latency)
+        finally:
+            utility.drop_collection(name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=settings.EMBEDDING_DIM)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=settings.VECTOR_RESCORE_FACTOR)
+    parser.add_argument("--milvus", action="store_true", help="同时在本地 Milvus 上测 FLAT / IVF_SQ8 / IVF_PQ")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = build_vectors(args.chunks, args.dim, args.clusters, rng)
+    queries = build_queries(vectors, args.queries, rng)
+    print(f"chunks={args.chunks}, dim={args.dim}, queries={args.queries}, recall@{args.k} vs float32 exact")
+    print(f"{'':<28} {'bytes/vec':>12}  {'per 1M':>10}")
+
+    baseline = bench_numpy(vectors, queries, args.k, args.rescore_factor)
+
+    # 理论值：Milvus 量化索引常驻内存只含压缩向量（不计 IVF 质心与 id）
+    print(f"{'milvus IVF_SQ8 (estimate)':<28} {args.dim:10.0f} B  {args.dim * MILLION / 1024 ** 3:8.2f} GB/M")
+    pq_bytes = settings.MILVUS_PQ_M * settings.MILVUS_PQ_NBITS / 8
+    print(f"{'milvus IVF_PQ (estimate)':<28} {pq_bytes:10.0f} B  {pq_bytes * MILLION / 1024 ** 3:8.2f} GB/M")
+
+    if args.milvus:
+        bench_milvus(vectors, queries, args.k, baseline)
+
+
+if __name__ == "__main__":
+    main()
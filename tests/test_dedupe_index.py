@@ -0,0 +1,78 @@
+"""
+训练去重索引：跨文档共享 chunk 的引用计数
+"""
+import pytest
+
+from app.services.dedupe_index import DedupeIndex
+
+ECHO = "echo-1"
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DedupeIndex(db_path=str(tmp_path / "dedupe.sqlite3"), ttl_seconds=3600)
+
+
+def test_shared_chunk_is_written_once_but_referenced_by_both(index):
+    assert index.claim_chunks(ECHO, ["x", "y"], knowledge_id=1) == [True, True]
+    assert index.claim_chunks(ECHO, ["x", "z"], knowledge_id=2) == [False, True]
+
+    assert index.owned_chunks(ECHO, 2) == {"x", "z"}
+    assert index.shared_chunk_owners([1], ECHO) == {(ECHO, "x"): 2}
+    assert index.shared_chunk_owners([1, 2], ECHO) == {}
+
+
+def test_forget_keeps_chunks_other_documents_still_reference(index):
+    index.claim_chunks(ECHO, ["x", "y"], knowledge_id=1)
+    index.claim_chunks(ECHO, ["x"], knowledge_id=2)
+
+    index.forget_knowledge([1], ECHO)
+    # y 无人引用，可重新写入；x 仍归 2 所有，依然算重复
+    assert index.claim_chunks(ECHO, ["x", "y"], knowledge_id=3) == [False, True]
+
+    index.forget_knowledge([2, 3], ECHO)
+    assert index.claim_chunks(ECHO, ["x", "y"], knowledge_id=4) == [True, True]
+
+
+def test_forget_is_scoped_to_echo(index):
+    index.claim_chunks(ECHO, ["x"], knowledge_id=1)
+    index.claim_chunks("echo-2", ["x"], knowledge_id=1)
+
+    index.forget_knowledge([1], ECHO)
+    assert index.claim_chunks(ECHO, ["x"], knowledge_id=2) == [True]
+    assert index.claim_chunks("echo-2", ["x"], knowledge_id=2) == [False]
+
+
+def test_release_claims_keeps_chunks_a_concurrent_ingest_references(index):
+    # 1 先写入 x、y，2 并发训练同一内容只登记了 x 的引用；随后 1 失败
+    index.claim_chunks(ECHO, ["x", "y"], knowledge_id=1)
+    index.claim_chunks(ECHO, ["x"], knowledge_id=2)
+
+    assert index.release_claims(ECHO, 1, ["x", "y"], ["x", "y"]) == {"x": 2}
+    # x 改归 2 所有，仍算重复；y 无人引用，可重新写入
+    assert index.owned_chunks(ECHO, 2) == {"x"}
+    assert index.claim_chunks(ECHO, ["x", "y"], knowledge_id=3) == [False, True]
+
+
+def test_chunk_refs_expire_with_their_chunk_rows(tmp_path):
+    index = DedupeIndex(db_path=str(tmp_path / "dedupe.sqlite3"), ttl_seconds=0)
+    index.claim_chunks(ECHO, ["x"], knowledge_id=1)
+    index.claim_chunks("echo-2", ["x"], knowledge_id=1)
+
+    # 过期后重新写入的 chunk 不再带着旧的引用方
+    assert index.claim_chunks(ECHO, ["x"], knowledge_id=2) == [True]
+    assert index.owned_chunks(ECHO, 1) == set()
+    assert index.owned_chunks(ECHO, 2) == {"x"}
+    # 其它写操作顺带清理掉过期行及其引用
+    index.claim_document(ECHO, "doc")
+    assert index._conn.execute("SELECT COUNT(*) FROM chunk_refs WHERE echo_id = 'echo-2'").fetchone()[0] == 0
+
+
+def test_existing_writers_become_refs_on_upgrade(tmp_path):
+    path = str(tmp_path / "dedupe.sqlite3")
+    index = DedupeIndex(db_path=path, ttl_seconds=3600)
+    index.claim_chunks(ECHO, ["x"], knowledge_id=1)
+    index._conn.execute("DROP TABLE chunk_refs")
+
+    upgraded = DedupeIndex(db_path=path, ttl_seconds=3600)
+    assert upgraded.owned_chunks(ECHO, 1) == {"x"}
@@ -0,0 +1,91 @@
+"""
+向量缓存：用本地假 embedder 验证命中 / 持久化 / 批内去重，不访问网络
+"""
+from typing import List
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+MODEL = "fake-embedding"
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls: List[List[str]] = []
+
+    @staticmethod
+    def _vector(text: str) -> List[float]:
+        return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "embedding_cache.sqlite3")
+
+
+def make(db_path, memory_size=100):
+    fake = FakeEmbeddings()
+    cache = EmbeddingCache(memory_size=memory_size, db_path=db_path)
+    return fake, cache, CachedEmbeddings(fake, cache, model=MODEL)
+
+
+def test_only_misses_reach_the_model(db_path):
+    fake, cache, embeddings = make(db_path)
+
+    first = embeddings.embed_documents(["a", "bb", "a"])
+    second = embeddings.embed_documents(["bb", "ccc"])
+
+    # 批内重复只算一次，第二批只发送未命中的文本
+    assert fake.calls == [["a", "bb"], ["ccc"]]
+    assert first[0] == first[2] == FakeEmbeddings._vector("a")
+    assert second[0] == first[1]
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 4
+
+
+def test_disk_tier_survives_restart(db_path):
+    _, _, embeddings = make(db_path)
+    expected = embeddings.embed_documents(["persisted", "chunk"])
+
+    fake, cache, embeddings = make(db_path)
+    assert embeddings.embed_documents(["persisted", "chunk"]) == expected
+    assert fake.calls == []
+    assert cache.stats()["disk_hits"] == 2
+
+
+def test_memory_lru_is_bounded():
+    _, cache, embeddings = make(None, memory_size=2)
+    embeddings.embed_documents(["a", "b", "c"])
+    assert cache.stats()["memory_entries"] == 2
+
+
+@pytest.mark.anyio
+async def test_async_paths_share_the_cache(db_path):
+    fake, cache, embeddings = make(db_path)
+
+    query = await embeddings.aembed_query("你好")
+    docs = await embeddings.aembed_documents(["你好", "世界"])
+    assert docs[0] == query
+    assert fake.calls == [["你好"], ["世界"]]
+
+    # 新实例只有磁盘层，异步路径同样能命中
+    fake, cache, embeddings = make(db_path)
+    assert await embeddings.aembed_query("世界") == docs[1]
+    assert fake.calls == []
+    assert cache.stats()["disk_hits"] == 1
@@ -0,0 +1,175 @@
+"""
+OSS 下载：用本地假对象存储验证单次 GET、分片 Range GET（内存 / 临时文件）与条件请求
+"""
+import hashlib
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.config import settings
+from app.core.executors import object_storage_pool
+from app.services.file_loader import (
+    ObjectNotModified,
+    download_file_from_oss,
+    download_file_from_oss_to_disk,
+)
+
+pytestmark = pytest.mark.anyio
+
+BUCKET = "bucket"
+KEY = "knowledge/doc.txt"
+ETAG = '"etag-1"'
+
+
+class _NotModified(Exception):
+    status_code = 304
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_bytes(self, block_size: int):
+        for start in range(0, len(self._data), block_size):
+            yield self._data[start:start + block_size]
+
+
+class FakeObjectStore:
+    """
+    实现 ObjectStoreClient 接口的内存对象存储，记录收到的请求
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.heads = []
+        self.ranges = []
+        self._lock = threading.Lock()
+
+    def head_object(self, request):
+        data, etag = self.objects[request.key]
+        self.heads.append(request.if_none_match)
+        if request.if_none_match == etag:
+            raise _NotModified()
+        return SimpleNamespace(content_length=len(data), etag=etag)
+
+    def get_object(self, request):
+        data, etag = self.objects[request.key]
+        assert request.if_match == etag
+        start, end = map(int, request.range_header.removeprefix("bytes=").split("-"))
+        with self._lock:
+            self.ranges.append((start, end))
+        return SimpleNamespace(body=_Body(data[start:end + 1]))
+
+
+@pytest.fixture
+def payload():
+    return os.urandom(10_000) + "中文内容".encode("utf-8") * 100
+
+
+@pytest.fixture
+def store(payload):
+    return FakeObjectStore({KEY: (payload, ETAG)})
+
+
+@pytest.fixture
+def ranged(monkeypatch):
+    monkeypatch.setattr(settings, "OSS_RANGE_THRESHOLD", 1024)
+    monkeypatch.setattr(settings, "OSS_RANGE_PART_SIZE", 1000)
+    monkeypatch.setattr(settings, "OSS_RANGE_CONCURRENCY", 3)
+
+
+async def test_small_object_is_fetched_in_one_get(store, payload):
+    received = []
+    downloaded = await download_file_from_oss(
+        region="cn-beijing", bucket=BUCKET, object_key=KEY, client=store, on_bytes=received.append
+    )
+
+    assert bytes(downloaded.data) == payload
+    assert downloaded.size == len(payload)
+    assert downloaded.sha256 == hashlib.sha256(payload).hexdigest()
+    assert downloaded.etag == ETAG
+    assert store.ranges == [(0, len(payload) - 1)]
+    assert sum(received) == len(payload)
+
+
+async def test_ranged_download_into_buffer(store, payload, ranged):
+    downloaded = await download_file_from_oss(
+        region="cn-beijing", bucket=BUCKET, object_key=KEY, client=store
+    )
+
+    assert bytes(downloaded.data) == payload
+    assert downloaded.sha256 == hashlib.sha256(payload).hexdigest()
+    # 分片首尾相接、覆盖整个对象
+    parts = sorted(store.ranges)
+    assert len(parts) == -(-len(payload) // 1000)
+    assert parts[0][0] == 0 and parts[-1][1] == len(payload) - 1
+    assert all(left[1] + 1 == right[0] for left, right in zip(parts, parts[1:]))
+
+
+async def test_ranged_parts_are_submitted_to_object_storage_pool(store, payload, ranged):
+    submitted = object_storage_pool.submitted
+    await download_file_from_oss(region="cn-beijing", bucket=BUCKET, object_key=KEY, client=store)
+
+    # HEAD + 每个分片 + sha256 各占一次 object_storage_pool
+    assert object_storage_pool.submitted - submitted == len(store.ranges) + 2
+
+
+async def test_failed_part_removes_temp_file(store, ranged, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_TEMP_DIR", str(tmp_path))
+    get_object = store.get_object
+
+    def flaky_get_object(request):
+        if request.range_header.startswith("bytes=3000-"):
+            raise ConnectionError("reset by peer")
+        return get_object(request)
+
+    monkeypatch.setattr(store, "get_object", flaky_get_object)
+    with pytest.raises(ConnectionError):
+        await download_file_from_oss_to_disk(region="cn-beijing", bucket=BUCKET, object_key=KEY, client=store)
+    assert os.listdir(tmp_path) == []
+
+
+async def test_ranged_download_into_temp_file(store, payload, ranged, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_TEMP_DIR", str(tmp_path))
+    received = []
+    downloaded = await download_file_from_oss_to_disk(
+        region="cn-beijing", bucket=BUCKET, object_key=KEY, client=store, on_bytes=received.append
+    )
+    try:
+        with open(downloaded.path, "rb") as f:
+            assert f.read() == payload
+        assert downloaded.size == len(payload)
+        assert downloaded.sha256 == hashlib.sha256(payload).hexdigest()
+        assert downloaded.etag == ETAG
+        assert len(store.ranges) > 1
+        assert sum(received) == len(payload)
+    finally:
+        downloaded.cleanup()
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("to_disk", [False, True])
+async def test_unchanged_object_raises_not_modified_without_get(store, tmp_path, monkeypatch, to_disk):
+    monkeypatch.setattr(settings, "INGEST_TEMP_DIR", str(tmp_path))
+    download = download_file_from_oss_to_disk if to_disk else download_file_from_oss
+
+    with pytest.raises(ObjectNotModified):
+        await download(region="cn-beijing", bucket=BUCKET, object_key=KEY, client=store, if_none_match=ETAG)
+    assert store.heads == [ETAG]
+    assert store.ranges == []
+    assert os.listdir(tmp_path) == []
+
+    # ETag 不同则正常下载
+    downloaded = await download(
+        region="cn-beijing", bucket=BUCKET, object_key=KEY, client=store, if_none_match='"stale"'
+    )
+    downloaded.cleanup()
+    assert store.ranges
@@ -0,0 +1,37 @@
+"""
+关键词索引：其它进程 reset（集合迁移）后，运行中的实例能发现并重新回填
+"""
+import pytest
+
+from app.services.keyword_index import KeywordIndex
+
+ECHO = "echo-1"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "keyword.sqlite3")
+
+
+def test_reset_from_another_process_bumps_version_and_reopens_backfill(db_path):
+    worker = KeywordIndex(db_path=db_path, max_echoes=8)
+    assert worker.claim_backfill(ECHO)
+    worker.add([1, 2], ["猫咪喜欢晒太阳", "他的生日是五月"], [{"echo_id": ECHO}, {"echo_id": ECHO}])
+    assert worker.search("生日", ECHO, 5)
+    before = worker.loaded_version(ECHO)
+    assert not worker.claim_backfill(ECHO)
+
+    # 迁移脚本在另一个进程里清空索引
+    KeywordIndex(db_path=db_path, max_echoes=1).reset()
+
+    assert worker.search("生日", ECHO, 5) == []
+    assert worker.loaded_version(ECHO) != before
+    assert worker.claim_backfill(ECHO)
+
+
+def test_loaded_version_is_none_until_searched(db_path):
+    index = KeywordIndex(db_path=db_path, max_echoes=8)
+    index.add([1], ["文本"], [{"echo_id": ECHO}])
+    assert index.loaded_version(ECHO) is None
+    index.search("文本", ECHO, 1)
+    assert index.loaded_version(ECHO) == 1
@@ -0,0 +1,92 @@
+"""
+Milvus 集合的索引类型以集合上实际的索引为准，而不是 MILVUS_INDEX_TYPE
+"""
+from types import SimpleNamespace
+
+from app.services.milvus_schema import VECTOR_FIELD, is_quantized_index, vector_index_type, vector_search_params
+
+
+def _collection(*indexes):
+    return SimpleNamespace(indexes=[SimpleNamespace(field_name=f, params=p) for f, p in indexes])
+
+
+def test_vector_index_type_reads_the_vector_field_index():
+    collection = _collection(
+        ("echo_id", {"index_type": "INVERTED"}),
+        (VECTOR_FIELD, {"index_type": "ivf_sq8", "metric_type": "L2", "params": {"nlist": 128}}),
+    )
+    assert vector_index_type(collection) == "IVF_SQ8"
+    assert is_quantized_index(vector_index_type(collection))
+    assert vector_index_type(_collection(("echo_id", {"index_type": "INVERTED"}))) is None
+
+
+def test_search_params_follow_the_actual_index_type():
+    assert "nprobe" in vector_search_params("IVF_PQ")["params"]
+    assert "ef" in vector_search_params("HNSW")["params"]
+
+
+def test_managed_schema_keeps_unknown_metadata_in_extra():
+    from pymilvus import DataType
+
+    from app.services.milvus_schema import EXTRA_FIELD, SCALAR_FIELDS, build_knowledge_schema
+
+    fields = {field.name: field for field in build_knowledge_schema(8).fields}
+    assert fields[EXTRA_FIELD].dtype == DataType.JSON
+    assert EXTRA_FIELD not in SCALAR_FIELDS
+
+
+def test_extra_metadata_round_trips():
+    from app.services.milvus_schema import EXTRA_FIELD, pack_extra, unpack_extra
+
+    metadata = {"echo_id": "e", "knowledge_id": 3, "title": "周报", "tags": ["a", "b"]}
+    packed = pack_extra(metadata)
+    assert packed == {"echo_id": "e", "knowledge_id": 3, EXTRA_FIELD: {"title": "周报", "tags": ["a", "b"]}}
+    assert unpack_extra({"pk": 1, **packed}) == {"pk": 1, **metadata}
+    # 已打包的行再次打包（重新写入 / 再次迁移）不会嵌套
+    assert pack_extra({**packed, "page": 2})[EXTRA_FIELD] == {"title": "周报", "tags": ["a", "b"], "page": 2}
+
+
+def test_migration_row_keeps_unknown_metadata():
+    from app.services.milvus_schema import EXTRA_FIELD, FIELD_DEFAULTS, TEXT_FIELD, _to_row
+
+    row = {"pk": 7, TEXT_FIELD: "正文", VECTOR_FIELD: [0.0] * 8, "echo_id": "e", "title": "周报", "page": 2}
+    converted = _to_row(row)
+    assert converted[EXTRA_FIELD] == {"title": "周报", "page": 2}
+    assert converted["echo_id"] == "e"
+    assert set(converted) == {TEXT_FIELD, VECTOR_FIELD, EXTRA_FIELD, *FIELD_DEFAULTS}
+    assert "pk" not in converted and "title" not in converted
+
+
+def test_insert_writes_unknown_metadata_into_extra_column():
+    from pymilvus import Collection
+
+    from app.services.milvus_schema import EXTRA_FIELD, PRIMARY_FIELD, SCALAR_FIELDS, TEXT_FIELD
+    from app.services.vector_store import MilvusVectorStore
+
+    class FakeCollection(Collection):
+        def __init__(self):
+            self.inserted = None
+
+        def insert(self, data, timeout=None):
+            self.inserted = data
+            return SimpleNamespace(primary_keys=[1, 2])
+
+    fields = [PRIMARY_FIELD, TEXT_FIELD, VECTOR_FIELD, *SCALAR_FIELDS, EXTRA_FIELD]
+    store = MilvusVectorStore(embeddings=None, collection_name="unused")
+    store._store = SimpleNamespace(
+        col=FakeCollection(),
+        fields=fields,
+        timeout=None,
+        _primary_field=PRIMARY_FIELD,
+        _text_field=TEXT_FIELD,
+        _vector_field=VECTOR_FIELD,
+    )
+    store.insert(
+        ["a", "b"],
+        [[0.0] * 8, [1.0] * 8],
+        [{"echo_id": "e", "knowledge_id": 1, "title": "周报"}, {"echo_id": "e", "knowledge_id": 1}],
+    )
+
+    columns = dict(zip([name for name in fields if name != PRIMARY_FIELD], store._store.col.inserted))
+    assert columns[EXTRA_FIELD] == [{"title": "周报"}, {}]
+    assert columns["echo_id"] == ["e", "e"]
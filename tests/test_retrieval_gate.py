@@ -0,0 +1,21 @@
+"""
+检索门控规则：只跳过明确的闲聊与时间问题，短消息照常检索
+"""
+import pytest
+
+from app.services.retrieval_gate import classify_query
+
+
+@pytest.mark.parametrize("query", ["他生日", "喜欢猫", "猫呢", "去哪玩", "推荐本书"])
+def test_short_content_queries_retrieve(query):
+    assert classify_query(query).retrieve
+
+
+@pytest.mark.parametrize(
+    "query, reason",
+    [("你好呀~", "small_talk"), ("嗯嗯", "small_talk"), ("谢谢！", "small_talk"), ("现在几点了？", "time"), ("", "empty")],
+)
+def test_small_talk_and_time_questions_skip(query, reason):
+    decision = classify_query(query)
+    assert not decision.retrieve
+    assert decision.reason == reason
@@ -0,0 +1,336 @@
+"""
+向量存储后端一致性：同一组用例分别跑 numpy 后端与 Milvus 后端（连不上 Milvus 时跳过）
+另含 numpy 后端特有的落盘重开、分区压缩与量化检索
+"""
+import functools
+import os
+import socket
+import time
+import uuid
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import FakeEmbeddings
+
+from app.core.config import settings
+from app.services import numpy_vector_store
+from app.services.numpy_vector_store import NumpyVectorStore
+from app.services.vector_store import PRIMARY_FIELD, TEXT_FIELD, MilvusVectorStore
+
+DIM = 8
+ECHO = "echo-a"
+OTHER_ECHO = "echo-b"
+
+
+def _vec(*values: float) -> list:
+    return list(values) + [0.0] * (DIM - len(values))
+
+
+QUERY = _vec(1, 0)
+
+# 三种度量下的排序各不相同：
+#   L2     a(0) < c(0.26) < d(4) < b(5)
+#   IP     b(3) > a(1) > c(0.5) > d(-1)
+#   COSINE a(1) > c(0.98) > b(0.95) > d(-1)
+CHUNKS = {
+    "a": _vec(1, 0),
+    "b": _vec(3, 1),
+    "c": _vec(0.5, 0.1),
+    "d": _vec(-1, 0),
+}
+EXPECTED_ORDER = {
+    "L2": ["a", "c", "d", "b"],
+    "IP": ["b", "a", "c", "d"],
+    "COSINE": ["a", "c", "b", "d"],
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _milvus_reachable() -> bool:
+    try:
+        with socket.create_connection((settings.MILVUS_HOST, int(settings.MILVUS_PORT)), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+@pytest.fixture(params=["numpy", "milvus"])
+def make_store(request, tmp_path, monkeypatch):
+    """
+    按度量创建空的存储；Milvus 每次建一个随机名的 FLAT 集合（精确检索），用完删除
+    """
+    backend = request.param
+    if backend == "milvus" and not _milvus_reachable():
+        pytest.skip(f"Milvus not reachable at {settings.MILVUS_HOST}:{settings.MILVUS_PORT}")
+    collections = []
+
+    def factory(metric_type: str = "L2"):
+        if backend == "numpy":
+            return NumpyVectorStore(str(tmp_path / f"vs-{metric_type}"), metric_type=metric_type)
+        monkeypatch.setattr(settings, "MILVUS_METRIC_TYPE", metric_type)
+        monkeypatch.setattr(settings, "MILVUS_INDEX_TYPE", "FLAT")
+        monkeypatch.setattr(settings, "MILVUS_MANAGED_SCHEMA", True)
+        monkeypatch.setattr(settings, "EMBEDDING_DIM", DIM)
+        name = f"test_parity_{uuid.uuid4().hex[:12]}"
+        store = MilvusVectorStore(FakeEmbeddings(size=DIM), collection_name=name)
+        collections.append(name)
+        store.ensure_ready()
+        return store
+
+    yield factory
+
+    if collections:
+        from pymilvus import utility
+
+        for name in collections:
+            if utility.has_collection(name):
+                utility.drop_collection(name)
+
+
+def _eventually(check, timeout: float = 5.0):
+    """
+    Milvus 默认是有界一致性，写入 / 删除后短时间内可能还读到旧数据；numpy 后端第一次就通过
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return check()
+        except AssertionError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.2)
+
+
+def _insert(store, chunks=CHUNKS, echo_id=ECHO, knowledge_ids=None) -> dict:
+    texts = list(chunks)
+    knowledge_ids = knowledge_ids or {text: i + 1 for i, text in enumerate(texts)}
+    metadatas = [
+        {"echo_id": echo_id, "knowledge_id": knowledge_ids[text], "source": f"{text}.txt"} for text in texts
+    ]
+    pks = store.insert(texts, [chunks[text] for text in texts], metadatas)
+    assert len(pks) == len(texts) and len(set(pks)) == len(pks)
+    return dict(zip(texts, pks))
+
+
+def _texts(store, echo_id=ECHO, **kwargs) -> list:
+    return sorted(row[TEXT_FIELD] for rows in store.iter_rows(echo_id, **kwargs) for row in rows)
+
+
+@pytest.mark.parametrize("metric_type", ["L2", "IP", "COSINE"])
+def test_search_orders_top_k_by_metric(make_store, metric_type):
+    store = make_store(metric_type)
+    pks = _insert(store)
+    # 其它 echo 中与 query 完全相同的向量不应出现在结果里
+    _insert(store, {"other": QUERY}, echo_id=OTHER_ECHO)
+
+    def check():
+        docs, vectors = store.search(QUERY, ECHO, 3, with_vectors=True)
+        assert [doc.page_content for doc in docs] == EXPECTED_ORDER[metric_type][:3]
+        for doc in docs:
+            assert doc.metadata[PRIMARY_FIELD] == pks[doc.page_content]
+            assert doc.metadata["echo_id"] == ECHO
+            assert doc.metadata["source"] == f"{doc.page_content}.txt"
+            np.testing.assert_allclose(vectors[doc.metadata[PRIMARY_FIELD]], CHUNKS[doc.page_content])
+
+    _eventually(check)
+    docs, vectors = store.search(QUERY, ECHO, 10)
+    assert [doc.page_content for doc in docs] == EXPECTED_ORDER[metric_type]
+    assert vectors == {}
+
+
+def test_search_unknown_echo_is_empty(make_store):
+    store = make_store()
+    _insert(store)
+    assert store.search(QUERY, "missing", 3) == ([], {})
+
+
+def test_delete_pks(make_store):
+    store = make_store()
+    pks = _insert(store)
+    store.delete_pks([pks["a"], pks["c"]])
+
+    def check():
+        assert _texts(store) == ["b", "d"]
+        assert [doc.page_content for doc in store.search(QUERY, ECHO, 3)[0]] == ["d", "b"]
+
+    _eventually(check)
+
+
+def test_delete_knowledge_scoped_to_echo(make_store):
+    store = make_store()
+    _insert(store, knowledge_ids={"a": 1, "b": 1, "c": 2, "d": 3})
+    _insert(store, {"a2": CHUNKS["a"]}, echo_id=OTHER_ECHO, knowledge_ids={"a2": 1})
+    store.delete_knowledge([1], ECHO)
+
+    def check():
+        assert _texts(store) == ["c", "d"]
+        assert _texts(store, OTHER_ECHO) == ["a2"]
+
+    _eventually(check)
+
+
+def test_delete_knowledge_across_echoes(make_store):
+    store = make_store()
+    _insert(store, knowledge_ids={"a": 1, "b": 1, "c": 2, "d": 3})
+    _insert(store, {"a2": CHUNKS["a"]}, echo_id=OTHER_ECHO, knowledge_ids={"a2": 1})
+    store.delete_knowledge([1, 3])
+
+    def check():
+        assert _texts(store) == ["c"]
+        assert _texts(store, OTHER_ECHO) == []
+
+    _eventually(check)
+
+
+def test_iter_rows_projection_and_knowledge_filter(make_store):
+    store = make_store()
+    pks = _insert(store, knowledge_ids={"a": 1, "b": 1, "c": 2, "d": 2})
+    _insert(store, {"other": QUERY}, echo_id=OTHER_ECHO)
+
+    def check():
+        rows = [row for rows in store.iter_rows(ECHO, ["knowledge_id"], batch_size=3) for row in rows]
+        assert sorted(rows, key=lambda row: row[PRIMARY_FIELD]) == sorted(
+            ({PRIMARY_FIELD: pks[text], "knowledge_id": 1 if text in ("a", "b") else 2} for text in CHUNKS),
+            key=lambda row: row[PRIMARY_FIELD],
+        )
+
+        full = [row for rows in store.iter_rows(ECHO, knowledge_id=2) for row in rows]
+        assert sorted(row[TEXT_FIELD] for row in full) == ["c", "d"]
+        for row in full:
+            assert row[PRIMARY_FIELD] == pks[row[TEXT_FIELD]]
+            assert row["source"] == f"{row[TEXT_FIELD]}.txt"
+            assert "vector" not in row
+
+    _eventually(check)
+
+
+def test_custom_metadata_round_trips(make_store):
+    store = make_store()
+    pks = store.insert(
+        ["a"],
+        [CHUNKS["a"]],
+        [{"echo_id": ECHO, "knowledge_id": 1, "source": "a.txt", "title": "周报", "page": 2}],
+    )
+
+    def check():
+        docs, _ = store.search(QUERY, ECHO, 1)
+        assert docs[0].metadata["title"] == "周报" and docs[0].metadata["page"] == 2
+        rows = [row for rows in store.iter_rows(ECHO) for row in rows]
+        assert [(row[PRIMARY_FIELD], row["title"], row["page"]) for row in rows] == [(pks[0], "周报", 2)]
+
+    _eventually(check)
+
+
+def test_fetch_vectors(make_store):
+    store = make_store()
+    pks = _insert(store)
+
+    def check():
+        vectors = store.fetch_vectors([pks["b"], pks["d"], max(pks.values()) + 1000])
+        assert set(vectors) == {pks["b"], pks["d"]}
+        np.testing.assert_allclose(vectors[pks["b"]], CHUNKS["b"])
+        np.testing.assert_allclose(vectors[pks["d"]], CHUNKS["d"])
+
+    _eventually(check)
+    assert store.fetch_vectors([]) == {}
+
+
+# ==============================================================================
+# numpy 后端：内存映射文件的持久化与压缩
+# ==============================================================================
+def test_numpy_reopen_from_disk(tmp_path):
+    directory = str(tmp_path / "vs")
+    store = NumpyVectorStore(directory, metric_type="IP")
+    pks = _insert(store)
+    store.delete_pks([pks["b"]])
+
+    reopened = NumpyVectorStore(directory, metric_type="IP")
+    docs, vectors = reopened.search(QUERY, ECHO, 3, with_vectors=True)
+    assert [doc.page_content for doc in docs] == ["a", "c", "d"]
+    np.testing.assert_allclose(vectors[pks["c"]], CHUNKS["c"])
+
+    # 主键不复用，新写入接在已有行之后
+    new_pks = _insert(reopened, {"e": _vec(2, 0)})
+    assert new_pks["e"] > max(pks.values())
+    assert [doc.page_content for doc in reopened.search(QUERY, ECHO, 2)[0]] == ["e", "a"]
+    assert _texts(NumpyVectorStore(directory, metric_type="IP")) == ["a", "c", "d", "e"]
+
+
+def test_numpy_compacts_after_enough_deletes(tmp_path):
+    directory = str(tmp_path / "vs")
+    store = NumpyVectorStore(directory)
+    dead = numpy_vector_store._COMPACT_MIN_DEAD
+    rng = np.random.default_rng(0)
+    filler = {f"x{i}": rng.normal(size=DIM).tolist() for i in range(dead)}
+    filler_pks = _insert(store, filler)
+    pks = _insert(store)
+    vector_files = os.listdir(os.path.join(directory, "vectors"))
+
+    # 删到恰好 _COMPACT_MIN_DEAD - 1 行时不压缩
+    doomed = list(filler_pks.values())
+    store.delete_pks(doomed[:-1])
+    assert store.compactions == 0
+
+    store.delete_pks(doomed[-1:])
+    assert store.compactions == 1
+    assert os.listdir(os.path.join(directory, "vectors")) != vector_files
+    assert len(os.listdir(os.path.join(directory, "vectors"))) == 1
+    assert [doc.page_content for doc in store.search(QUERY, ECHO, 4)[0]] == EXPECTED_ORDER["L2"]
+    np.testing.assert_allclose(store.fetch_vectors([pks["b"]])[pks["b"]], CHUNKS["b"])
+
+    reopened = NumpyVectorStore(directory)
+    assert [doc.page_content for doc in reopened.search(QUERY, ECHO, 4)[0]] == EXPECTED_ORDER["L2"]
+    assert _texts(reopened) == sorted(CHUNKS)
+
+
+# ==============================================================================
+# numpy 后端：量化检索（压缩矩阵召回 + float32 精排）与 float32 暴力检索一致
+# ==============================================================================
+def _brute_force_scores(corpus: np.ndarray, query: np.ndarray, metric_type: str) -> np.ndarray:
+    if metric_type == "L2":
+        return -np.linalg.norm(corpus - query, axis=1)
+    dots = corpus @ query
+    if metric_type == "COSINE":
+        return dots / (np.linalg.norm(corpus, axis=1) * np.linalg.norm(query))
+    return dots
+
+
+@pytest.mark.parametrize("metric_type", ["L2", "IP", "COSINE"])
+@pytest.mark.parametrize("quantization", numpy_vector_store.QUANTIZATIONS)
+def test_numpy_quantized_top_k_matches_float32(tmp_path, quantization, metric_type):
+    rng = np.random.default_rng(7)
+    corpus = rng.normal(size=(500, 32)).astype(np.float32)
+    store = NumpyVectorStore(str(tmp_path / "vs"), metric_type=metric_type, quantization=quantization)
+    _insert(store, {f"c{i}": vector.tolist() for i, vector in enumerate(corpus)})
+
+    for query in rng.normal(size=(5, 32)).astype(np.float32):
+        expected_scores = _brute_force_scores(corpus, query, metric_type)
+        expected = np.argsort(-expected_scores, kind="stable")[:10]
+
+        docs, vectors = store.search(query.tolist(), ECHO, 10, with_vectors=True)
+        rows = [int(doc.page_content[1:]) for doc in docs]
+        assert rows == expected.tolist()
+        # 精排用的是原始 float32 向量：返回向量与写入时一致，据此算出的分数与暴力检索一致
+        returned = np.vstack([vectors[doc.metadata[PRIMARY_FIELD]] for doc in docs])
+        np.testing.assert_array_equal(returned, corpus[rows])
+        np.testing.assert_allclose(
+            _brute_force_scores(returned, query, metric_type), expected_scores[expected], rtol=1e-5, atol=1e-5
+        )
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_numpy_quantized_dots_within_tolerance(quantization):
+    rng = np.random.default_rng(7)
+    corpus = rng.normal(size=(1000, 32)).astype(np.float32)
+    query = rng.normal(size=32).astype(np.float32)
+
+    codes, scales = numpy_vector_store.encode_vectors(corpus, quantization)
+    error = np.abs(numpy_vector_store.approximate_dots(codes, scales, query) - corpus @ query)
+    if quantization == "int8":
+        # 每维舍入误差不超过 scale / 2
+        bound = scales / 2 * np.abs(query).sum()
+    else:
+        # float16 单位舍入误差 2^-11
+        bound = np.abs(corpus) @ np.abs(query) * 2.0 ** -11
+    assert np.all(error <= bound * 1.01 + 1e-5)
+    assert error.max() < 0.05 * np.abs(corpus @ query).max()